@@ -0,0 +1,113 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+READ_CHUNK_SIZE = 1024 * 1024
+FILE_PART = b'name="file"'
+
+
+# A stand-in for Ladle's submission endpoints. Every POST is answered after "latency" seconds with a new document id,
+# or, for a fraction "error_rate" of them, with a 503. Bodies are read in chunks and thrown away, so large documents
+# don't add to the memory measured by the benchmark. A POST to "batch_endpoint" is answered with one result per
+# document part it holds.
+#
+# Use as "with FakeLadle(...) as ladle", then point DART_URL and SUBMISSION_PORT at ladle.url and ladle.port
+class FakeLadle:
+    def __init__(self, latency=0, error_rate=0, batch_endpoint=None, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.batch_endpoint = batch_endpoint
+        self.requests = 0
+        self.failures = 0
+        self.bytes_received = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1'
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Forget the requests counted so far
+    def reset_counts(self):
+        with self._lock:
+            self.requests = 0
+            self.failures = 0
+            self.bytes_received = 0
+
+    def _record(self, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += size
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.failures += 1
+            return failed
+
+    def _handler(self):
+        ladle = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                size = int(self.headers.get('Content-Length') or 0)
+                documents = self._read_body(size)
+                failed = ladle._record(size)
+
+                if ladle.latency > 0:
+                    time.sleep(ladle.latency)
+
+                if failed:
+                    self._respond(503, b'{ "error": "unavailable" }')
+                elif self.path == ladle.batch_endpoint:
+                    self._respond(200, json.dumps([{'document_id': uuid.uuid4().hex} for _ in range(documents)]).encode('utf-8'))
+                else:
+                    self._respond(200, json.dumps({'document_id': uuid.uuid4().hex}).encode('utf-8'))
+
+            # Read and discard the body, counting its file parts
+            def _read_body(self, size):
+                documents = 0
+                tail = b''
+                remaining = size
+                while remaining > 0:
+                    chunk = self.rfile.read(min(READ_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    window = tail + chunk
+                    documents += window.count(FILE_PART)
+                    # Too short to hold a whole part name, so nothing is counted twice, but enough to find one split
+                    # across chunks
+                    tail = window[-(len(FILE_PART) - 1):]
+                return documents
+
+            def _respond(self, status, body):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
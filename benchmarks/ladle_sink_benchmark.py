@@ -0,0 +1,373 @@
+import argparse
+import collections
+import contextlib
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import boto3
+
+from benchmarks.fake_ladle import FakeLadle
+from dart_lambdas.common.circuit_breaker import reset_circuit_breakers
+from dart_lambdas.common.concurrency_limit import reset_concurrency_limiters
+from dart_lambdas.common.http_utils import reset_http_session
+from dart_lambdas.common.idempotency import set_idempotency_store
+from dart_lambdas.common.s3_utils import get_s3_client, reset_s3_client
+from dart_lambdas.ladleSink.config import reset_config
+from dart_lambdas.ladleSink.ladle_sink import lambda_handler, handle_records
+
+# Benchmarks for the ladleSink pipeline, run against moto's S3 server (in its own process, so that the documents
+# it stores don't count towards the pipeline's memory) and a FakeLadle.
+#
+#   python -m benchmarks.ladle_sink_benchmark                   run the default scenarios and print their results
+#   python -m benchmarks.ladle_sink_benchmark --large           include the 500 MB document scenario
+#   python -m benchmarks.ladle_sink_benchmark -s single-1kb     run only the scenarios named
+#   python -m benchmarks.ladle_sink_benchmark --save-baseline   store the results as the new baseline
+#   python -m benchmarks.ladle_sink_benchmark --check           exit with 1 if a result regressed from the baseline
+#
+# Needs moto's server dependencies (pip install -e .[benchmark])
+
+KB = 1024
+MB = 1024 * KB
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'baselines', 'ladle_sink.json')
+# Fraction by which a result may be worse than its baseline before it counts as a regression
+DEFAULT_TOLERANCE = 0.25
+MOTO_SERVER_START_SECONDS = 30
+BATCH_SUBMISSION_ENDPOINT = '/submit/batch'
+SYNTHETIC_BLOCK = bytes(range(256)) * 256
+
+# Metrics compared with the baseline, and whether higher values are better
+COMPARED_METRICS = {
+    'documents_per_second': True,
+    'megabytes_per_second': True,
+    'p50_ms': False,
+    'p99_ms': False,
+    'peak_rss_mb': False,
+    's3_calls_per_document': False,
+    'http_calls_per_document': False,
+}
+
+
+# "invocations" invocations, each of an event holding "documents" new documents of "document_size" bytes, sent to
+# "entry_point" (lambda_handler or handle_records). Ladle answers after "latency" seconds, and fails "error_rate"
+# of its requests. "environment" sets further configuration, e.g. to batch submissions
+class Scenario:
+    def __init__(self, name, documents, document_size, invocations, latency=0, error_rate=0,
+                 entry_point='lambda_handler', environment=None):
+        self.name = name
+        self.documents = documents
+        self.document_size = document_size
+        self.invocations = invocations
+        self.latency = latency
+        self.error_rate = error_rate
+        self.entry_point = entry_point
+        self.environment = environment or {}
+
+
+DEFAULT_SCENARIOS = [
+    Scenario('single-1kb', 1, KB, 50),
+    Scenario('batch10-1kb', 10, KB, 20),
+    Scenario('batch10-1kb-handle-records', 10, KB, 20, entry_point='handle_records'),
+    Scenario('batch10-1kb-batched-submissions', 10, KB, 20,
+             environment={'BATCH_SUBMISSION_ENDPOINT': BATCH_SUBMISSION_ENDPOINT, 'SUBMISSION_BATCH_SIZE': '10'}),
+    Scenario('batch10-1kb-slow-ladle', 10, KB, 10, latency=0.1),
+    Scenario('batch10-1kb-flaky-ladle', 10, KB, 10, error_rate=0.2),
+    Scenario('batch10-1mb', 10, MB, 5),
+    Scenario('single-50mb', 1, 50 * MB, 2),
+]
+
+LARGE_SCENARIOS = [
+    Scenario('single-500mb', 1, 500 * MB, 1),
+]
+
+
+# A document of "size" bytes generated while it is read, so that uploading one doesn't need it in memory. Documents
+# start with their key, so no two have the same content
+class SyntheticDocument:
+    def __init__(self, key, size):
+        self._prefix = f'{key}\n'.encode('utf-8')
+        self._size = size
+        self._position = 0
+
+    def read(self, size=-1):
+        remaining = self._size - self._position
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        chunks = []
+        while size > 0:
+            if self._position < len(self._prefix):
+                chunk = self._prefix[self._position:self._position + size]
+            else:
+                offset = (self._position - len(self._prefix)) % len(SYNTHETIC_BLOCK)
+                chunk = SYNTHETIC_BLOCK[offset:offset + size]
+            chunks.append(chunk)
+            self._position += len(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+
+# Lambda context reporting the maximum Lambda timeout, so that deadlines apply as they would in AWS
+class BenchmarkContext:
+    aws_request_id = 'benchmark'
+
+    def __init__(self, timeout_seconds=900):
+        self.expires_at = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int((self.expires_at - time.monotonic()) * 1000)
+
+
+# Counts the calls made with an S3 client, by operation
+class CallCounter:
+    def __init__(self):
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, model, **kwargs):
+        with self._lock:
+            self.counts[model.name] += 1
+
+    def total(self):
+        return sum(self.counts.values())
+
+
+# Start moto's S3 server in its own process
+#
+# @returns (process, endpoint url)
+def start_moto_server():
+    with socket.socket() as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        port = free_socket.getsockname()[1]
+
+    process = subprocess.Popen([sys.executable, '-m', 'moto.server', '-H', '127.0.0.1', '-p', str(port)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    endpoint_url = f'http://127.0.0.1:{port}'
+    started = time.monotonic()
+    while True:
+        try:
+            urllib.request.urlopen(f'{endpoint_url}/moto-api/', timeout=1)
+            return process, endpoint_url
+        except OSError:
+            if process.poll() is not None or time.monotonic() - started > MOTO_SERVER_START_SECONDS:
+                process.kill()
+                raise Exception(f'Unable to start moto server on {endpoint_url}; is moto[server] installed?')
+            time.sleep(0.1)
+
+
+# Start measuring peak memory afresh (Linux only; elsewhere peaks are for the whole run so far)
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+# Peak resident set size in MB since the last reset_peak_rss
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / KB
+    except OSError:
+        pass
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / MB if sys.platform == 'darwin' else max_rss / KB
+
+
+# Value at "fraction" of "values" (nearest rank)
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def s3_record(bucket, key, size, etag):
+    return {
+        's3': {
+            'object': {'key': key, 'size': size, 'eTag': etag},
+            'bucket': {'name': bucket},
+        },
+    }
+
+
+# Point the lambda at moto's server and "ladle", with "scenario"'s configuration, and forget everything it kept
+# from a previous scenario
+def configure_lambda(scenario, endpoint_url, ladle, bucket_in, bucket_processed):
+    for name in ['BATCH_SUBMISSION_ENDPOINT', 'SUBMISSION_BATCH_SIZE', 'PIPELINE_ENGINE']:
+        os.environ.pop(name, None)
+
+    os.environ.update({
+        'AWS_ENDPOINT_URL_S3': endpoint_url,
+        'S3_BUCKET_IN': bucket_in,
+        'S3_BUCKET_PROCESSED': bucket_processed,
+        'DART_URL': ladle.url,
+        'SUBMISSION_PORT': str(ladle.port),
+        'SUBMISSION_ENDPOINT': '/submit',
+        'BAUTH_USERNAME': 'benchmark',
+        'BAUTH_PASSWORD': 'benchmark',
+    })
+    os.environ.update(scenario.environment)
+
+    reset_config()
+    reset_s3_client()
+    reset_http_session()
+    set_idempotency_store(None)
+    reset_circuit_breakers()
+    reset_concurrency_limiters()
+
+
+# Upload every document of "scenario" (and its metadata) to "bucket"
+#
+# @returns a list of records per invocation
+def upload_documents(scenario, s3_client, bucket):
+    invocations = []
+    for invocation in range(scenario.invocations):
+        records = []
+        for document in range(scenario.documents):
+            name = f'{scenario.name}-{invocation}-{document}'
+            key = f'{name}.pdf.raw'
+            s3_client.upload_fileobj(SyntheticDocument(key, scenario.document_size), bucket, key)
+            s3_client.put_object(Bucket=bucket, Key=f'{name}.meta', Body=json.dumps({'name': name}).encode('utf-8'))
+            etag = s3_client.head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+            records.append(s3_record(bucket, key, scenario.document_size, etag))
+        invocations.append(records)
+    return invocations
+
+
+def run_scenario(scenario, endpoint_url):
+    setup_client = boto3.session.Session().client('s3', endpoint_url=endpoint_url)
+    bucket_in = f'bench-in-{scenario.name}'
+    bucket_processed = f'bench-processed-{scenario.name}'
+    setup_client.create_bucket(Bucket=bucket_in)
+    setup_client.create_bucket(Bucket=bucket_processed)
+
+    with FakeLadle(scenario.latency, scenario.error_rate, BATCH_SUBMISSION_ENDPOINT) as ladle:
+        configure_lambda(scenario, endpoint_url, ladle, bucket_in, bucket_processed)
+        invocations = upload_documents(scenario, setup_client, bucket_in)
+
+        s3_calls = CallCounter()
+        get_s3_client().meta.events.register('before-call.s3', s3_calls)
+        ladle.reset_counts()
+        reset_peak_rss()
+
+        latencies = []
+        started = time.perf_counter()
+        for records in invocations:
+            invocation_started = time.perf_counter()
+            if scenario.entry_point == 'handle_records':
+                handle_records(records)
+            else:
+                lambda_handler({'Records': records}, BenchmarkContext())
+            latencies.append(time.perf_counter() - invocation_started)
+        elapsed = time.perf_counter() - started
+
+    # Documents that weren't processed are left in the input bucket
+    failures = sum(1 for listed in setup_client.list_objects_v2(Bucket=bucket_in).get('Contents', [])
+                   if listed['Key'].endswith('.raw'))
+
+    documents = scenario.invocations * scenario.documents
+    return {
+        'documents': documents,
+        'document_size': scenario.document_size,
+        'failed_documents': failures,
+        'seconds': round(elapsed, 3),
+        'documents_per_second': round(documents / elapsed, 2),
+        'megabytes_per_second': round(documents * scenario.document_size / MB / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        's3_calls_per_document': round(s3_calls.total() / documents, 2),
+        's3_calls': dict(sorted(s3_calls.counts.items())),
+        'http_calls_per_document': round(ladle.requests / documents, 2),
+    }
+
+
+# Compare "results" with "baseline", both keyed by scenario name
+#
+# @returns a list of messages, one per metric that is worse than its baseline by more than "tolerance"
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            expected, actual = baseline[name].get(metric), result.get(metric)
+            if expected is None or actual is None:
+                continue
+            if (higher_is_better and actual < expected * (1 - tolerance)) or \
+                    (not higher_is_better and actual > expected * (1 + tolerance)):
+                regressions.append(f'{name}: {metric} is {actual}, baseline {expected}')
+    return regressions
+
+
+def print_results(results):
+    columns = ['documents', 'failed_documents', 'documents_per_second', 'megabytes_per_second', 'p50_ms', 'p99_ms',
+               'peak_rss_mb', 's3_calls_per_document', 'http_calls_per_document']
+    headers = ['scenario', 'docs', 'failed', 'docs/s', 'MB/s', 'p50 ms', 'p99 ms', 'peak RSS MB', 'S3/doc', 'HTTP/doc']
+    rows = [[name] + [str(result[column]) for column in columns] for name, result in results.items()]
+    widths = [max(len(row[i]) for row in [headers] + rows) for i in range(len(headers))]
+    for row in [headers] + rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ladleSink pipeline against local S3 and Ladle stand-ins')
+    parser.add_argument('-s', '--scenario', action='append', help='run only this scenario (may be repeated)')
+    parser.add_argument('--large', action='store_true', help='include scenarios with 500 MB documents')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help='baseline results file')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--check', action='store_true', help='exit with 1 if any result regressed from the baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='fraction a result may regress by')
+    parser.add_argument('--log', default=os.devnull, help="file to write the lambda's log to (discarded by default)")
+    args = parser.parse_args(argv)
+
+    scenarios = DEFAULT_SCENARIOS + (LARGE_SCENARIOS if args.large else [])
+    if args.scenario:
+        scenarios = [scenario for scenario in DEFAULT_SCENARIOS + LARGE_SCENARIOS if scenario.name in args.scenario]
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    moto_server, endpoint_url = start_moto_server()
+    try:
+        with open(args.log, 'a') as log_file, contextlib.redirect_stdout(log_file):
+            results = {scenario.name: run_scenario(scenario, endpoint_url) for scenario in scenarios}
+    finally:
+        moto_server.terminate()
+        moto_server.wait()
+
+    print_results(results)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['scenarios']
+
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': f'{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs',
+                'scenarios': dict(baseline, **results),
+            }, baseline_file, indent=2)
+            baseline_file.write('\n')
+
+    return 1 if args.check and len(regressions) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import base64
+
+import aiohttp
+
+from dart_lambdas.common.custom_logging import get_logger
+from dart_lambdas.common.deadline import NO_DEADLINE
+from dart_lambdas.common.http_utils import POST_STATUS_FAILURE, POST_EXCEPTION_FAILURE, http_settings, \
+    is_resendable_status
+from dart_lambdas.common.retry import RetryPolicy
+
+log = get_logger('async_http_utils')
+
+
+# Create a session for coroutines, keeping at most as many connections open per host as the shared pool does (see
+# http_utils.configure_http).
+#
+# Like aiobotocore clients, aiohttp sessions belong to the event loop they are opened on: use it as
+# "async with create_http_session() as http_session"
+def create_http_session():
+    max_pool_connections = http_settings()['max_pool_connections']
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=max_pool_connections))
+
+
+# Connect and read timeouts for a request that has to finish by "deadline" (see http_utils.request_timeout)
+def request_timeout(deadline=NO_DEADLINE):
+    settings = http_settings()
+    return aiohttp.ClientTimeout(sock_connect=deadline.timeout(settings['connect_timeout']),
+                                 sock_read=deadline.timeout(settings['read_timeout']), total=deadline.remaining())
+
+
+# Whether a POST failed before anything was sent (see http_utils.is_connect_failure)
+def is_connect_failure(exception):
+    return isinstance(exception, aiohttp.ClientConnectorError)
+
+
+# Build the multipart body for "post_files" and "post_data", given in the same forms as for try_post. A body can only
+# be sent once, so each attempt builds its own
+def _form_data(post_files, post_data):
+    form_data = aiohttp.FormData()
+
+    for name, value in (post_data or {}).items():
+        form_data.add_field(name, value)
+
+    for name, file in post_files.items():
+        filename, content = file[0], file[1]
+        content_type = file[2] if len(file) > 2 else None
+        if filename is None:
+            form_data.add_field(name, content, content_type=content_type)
+        else:
+            form_data.add_field(name, content, filename=filename, content_type=content_type)
+
+    return form_data
+
+
+# Authorization header value for HTTP basic authentication, encoded the way requests does it
+def _basic_auth_header(username, password):
+    credentials = f'{username}:{password or ""}'.encode('latin1')
+    return 'Basic ' + base64.b64encode(credentials).decode('ascii')
+
+
+# Same as http_utils.try_post, for coroutines: send a multipart POST request with "http_session", retrying
+# failures to connect and resendable statuses (see http_utils.is_resendable_status) "numtimes" times "sleep_time" seconds apart (or according to
+# "retry_policy"), never past "deadline". File contents must be bytes or str
+#
+# @returns (success: Boolean, response: Any) where "success" says whether it was successful, and
+# "response" is either the content of the response, or the status or exception of failure
+async def try_post(http_session, url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes,
+                   retry_policy=None, deadline=NO_DEADLINE):
+    policy = retry_policy or RetryPolicy.fixed(numtimes, sleep_time * 1000, is_connect_failure)
+    headers = {} if basic_auth is None or basic_auth[0] is None else {'Authorization': _basic_auth_header(*basic_auth)}
+    attempts = [0]
+
+    async def post():
+        deadline.check('posting')
+        attempts[0] += 1
+        log.debug('Attempt #%s: %s:%s%s', attempts[0], url, port, endpoint)
+        async with http_session.post(f"{url}:{port}{endpoint}", data=_form_data(post_files, post_data), headers=headers,
+                                     timeout=request_timeout(deadline)) as response:
+            return response.status, await response.text()
+
+    try:
+        status, text = await policy.execute_async(post, lambda res: is_resendable_status(res[0]), deadline)
+    except Exception as e:
+        log.warning('Exception posting to %s:%s%s: %s', url, port, endpoint, e)
+        return [False, POST_EXCEPTION_FAILURE + str(e)]
+
+    if status == 200:
+        return [True, text]
+    else:
+        return [False, f"{POST_STATUS_FAILURE}{status}"]
@@ -0,0 +1,38 @@
+import asyncio
+
+import botocore.exceptions
+from aiobotocore.session import get_session
+
+from dart_lambdas.common.s3_utils import s3_client_config, get_s3_client, MAX_COPY_OBJECT_SIZE, \
+    copy_tagging_arguments, _is_copy_source_too_large, _multipart_copy_s3_object
+
+
+# Create an S3 client for coroutines, configured like the one returned by get_s3_client.
+#
+# aiobotocore clients belong to the event loop they are opened on, so unlike the shared synchronous client this
+# one only lives as long as the loop: use it as "async with create_async_s3_client() as s3_client"
+def create_async_s3_client():
+    return get_session().create_client('s3', config=s3_client_config())
+
+
+# Same as copy_s3_object, for an aiobotocore client. Sources too large for copy_object are rare enough that they
+# are copied in parts by the synchronous client, on a separate thread so the event loop isn't blocked
+async def copy_s3_object_async(s3_client, input_key, input_bucket, output_key, output_bucket, size=None, tags=None):
+    if size is None or size <= MAX_COPY_OBJECT_SIZE:
+        try:
+            await s3_client.copy_object(
+                Bucket=output_bucket,
+                Key=output_key,
+                CopySource={
+                    "Bucket": input_bucket,
+                    "Key": input_key,
+                },
+                **copy_tagging_arguments(tags),
+            )
+            return
+        except botocore.exceptions.ClientError as e:
+            if size is not None or not _is_copy_source_too_large(e):
+                raise
+
+    await asyncio.to_thread(_multipart_copy_s3_object, get_s3_client(), input_key, input_bucket, output_key, output_bucket,
+                            tags)
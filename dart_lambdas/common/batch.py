@@ -0,0 +1,130 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# Run "fn" on every item in "items" using at most "max_workers" threads.
+#
+# @returns a list of (success: Boolean, message: Any) in the same order as "items". "fn" is expected
+# to return its own (success, message) pair; an exception raised by "fn" is reported as a failure
+# for that item only, so one bad item never prevents the rest of the batch from being processed
+def run_batch(fn, items, max_workers):
+    items = list(items)
+
+    if max_workers < 1:
+        raise Exception("max_workers must be greater than 0")
+
+    if len(items) <= 1 or max_workers == 1:
+        return [_run_item(fn, item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [executor.submit(_run_item, fn, item) for item in items]
+        return [future.result() for future in futures]
+
+
+def _run_item(fn, item):
+    try:
+        return fn(item)
+    except Exception as e:
+        return False, f'Exception: {str(e)}'
+
+
+# Run independent zero-argument "calls" at the same time and wait for all of them.
+#
+# The last call runs on the calling thread, so running n calls only costs n - 1 extra threads.
+# @returns the results of "calls" in order. If any call raises, the first exception (in call order) is
+# re-raised once every call has finished
+def run_concurrently(*calls):
+    if len(calls) <= 1:
+        return [call() for call in calls]
+
+    with ThreadPoolExecutor(max_workers=len(calls) - 1) as executor:
+        futures = [executor.submit(call) for call in calls[:-1]]
+        try:
+            last_result = calls[-1]()
+            last_error = None
+        except Exception as e:
+            last_result = None
+            last_error = e
+
+        results = []
+        for future in futures:
+            results.append(future.result())
+
+    if last_error is not None:
+        raise last_error
+
+    return results + [last_result]
+
+
+# Gathers items submitted from several threads into batches for "flush_fn", which takes a list of items and
+# returns a list of results in the same order.
+#
+# A batch is flushed once it holds "max_items" items or "max_bytes" bytes (as declared by each submitter), or
+# "linger" seconds after its first item arrived, whichever comes first. The thread that started a batch is the
+# one that flushes it; every submitter waits for its own item's result
+class MicroBatcher:
+    def __init__(self, flush_fn, max_items, max_bytes=None, linger=0.05):
+        if max_items < 1:
+            raise Exception("max_items must be greater than 0")
+
+        self.flush_fn = flush_fn
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.linger = linger
+        self._open_batch = None
+        self._lock = threading.Lock()
+
+    # @returns the result for "item" once its batch has been flushed. Raises what "flush_fn" raised, if it did
+    def submit(self, item, size=0):
+        future = Future()
+
+        with self._lock:
+            batch = self._open_batch
+            if batch is not None and self.max_bytes is not None and batch.size + size > self.max_bytes:
+                self._close(batch)
+                batch = None
+
+            is_leader = batch is None
+            if is_leader:
+                batch = self._open_batch = _Batch()
+
+            batch.items.append(item)
+            batch.futures.append(future)
+            batch.size += size
+            if len(batch.items) >= self.max_items or (self.max_bytes is not None and batch.size >= self.max_bytes):
+                self._close(batch)
+
+        if is_leader:
+            batch.closed.wait(self.linger)
+            with self._lock:
+                if self._open_batch is batch:
+                    self._close(batch)
+            self._flush(batch)
+
+        return future.result()
+
+    def _close(self, batch):
+        if self._open_batch is batch:
+            self._open_batch = None
+        batch.closed.set()
+
+    def _flush(self, batch):
+        try:
+            results = self.flush_fn(batch.items)
+            if len(results) != len(batch.items):
+                raise Exception(f'Batch of {len(batch.items)} items produced {len(results)} results')
+        except Exception as e:
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+
+        for future, result in zip(batch.futures, results):
+            future.set_result(result)
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.futures = []
+        self.size = 0
+        self.closed = threading.Event()
@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import deque
+
+from dart_lambdas.common.custom_logging import get_logger
+
+log = get_logger('circuit_breaker')
+
+DEFAULT_CIRCUIT_BREAKER_FAILURE_RATE = 0.5
+DEFAULT_CIRCUIT_BREAKER_MIN_CALLS = 5
+DEFAULT_CIRCUIT_BREAKER_WINDOW_SECONDS = 60
+DEFAULT_CIRCUIT_BREAKER_OPEN_SECONDS = 30
+# Slow calls aren't counted as failures unless a "slow_call" is configured
+DEFAULT_CIRCUIT_BREAKER_SLOW_CALL_SECONDS = None
+
+MIB = 1024 ** 2
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+# Stops calls to a service that keeps failing, so that callers fail fast instead of adding to its load.
+#
+# Outcomes of the calls made in the last "window" seconds are kept; once at least "min_calls" of them were made
+# and "failure_rate" or more of them failed (slow calls count as failures if "slow_call" is set, see is_slow_call),
+# the circuit opens and no calls are allowed for "open_duration" seconds. After that a single trial call is let
+# through (half-open): if it succeeds the circuit closes again, otherwise it reopens
+class CircuitBreaker:
+    def __init__(self, name, failure_rate=DEFAULT_CIRCUIT_BREAKER_FAILURE_RATE, min_calls=DEFAULT_CIRCUIT_BREAKER_MIN_CALLS,
+                 window=DEFAULT_CIRCUIT_BREAKER_WINDOW_SECONDS, open_duration=DEFAULT_CIRCUIT_BREAKER_OPEN_SECONDS,
+                 slow_call=DEFAULT_CIRCUIT_BREAKER_SLOW_CALL_SECONDS):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_duration = open_duration
+        self.slow_call = slow_call
+        self.state = CLOSED
+        self._outcomes = deque()
+        self._opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    # Whether a call may be made now. A caller that is allowed must report the outcome with "record"
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_duration:
+                    return False
+                self.state = HALF_OPEN
+                self._trial_in_progress = False
+
+            if self.state == HALF_OPEN:
+                if self._trial_in_progress:
+                    return False
+                self._trial_in_progress = True
+
+            return True
+
+    # Report the outcome of an allowed call that took "duration" seconds and sent "size" bytes, if known
+    def record(self, success, duration=0, size=None):
+        failed = not success or is_slow_call(duration, size, self.slow_call)
+        now = time.monotonic()
+
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial_in_progress = False
+                if failed:
+                    self._open(now)
+                else:
+                    log.info('circuit %s closed', self.name)
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                return
+
+            self._outcomes.append((now, failed))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+
+            failures = sum(1 for _, outcome_failed in self._outcomes if outcome_failed)
+            if self.state == CLOSED and len(self._outcomes) >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
+                self._open(now)
+
+    def _open(self, now):
+        log.warning('circuit %s opened for %s seconds', self.name, self.open_duration)
+        self.state = OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+
+
+# Whether a call that took "duration" seconds to send "size" bytes is slower than "slow_call" seconds per MiB: a
+# large upload takes longer without the service being any slower. Calls of up to a MiB, or of unknown size, are
+# allowed "slow_call" seconds. A "slow_call" of None means no call is slow
+def is_slow_call(duration, size, slow_call):
+    if slow_call is None:
+        return False
+
+    return duration > slow_call * max(1, (size or 0) / MIB)
+
+
+_circuit_breaker_settings = {
+    'failure_rate': DEFAULT_CIRCUIT_BREAKER_FAILURE_RATE,
+    'min_calls': DEFAULT_CIRCUIT_BREAKER_MIN_CALLS,
+    'window': DEFAULT_CIRCUIT_BREAKER_WINDOW_SECONDS,
+    'open_duration': DEFAULT_CIRCUIT_BREAKER_OPEN_SECONDS,
+    'slow_call': DEFAULT_CIRCUIT_BREAKER_SLOW_CALL_SECONDS,
+}
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+# Set how circuit breakers are built (see CircuitBreaker); anything not given is set back to its default. Settings
+# are checked by the caller, e.g. from the lambda's configuration, and breakers built with other settings are
+# forgotten
+def configure_circuit_breakers(failure_rate=DEFAULT_CIRCUIT_BREAKER_FAILURE_RATE, min_calls=DEFAULT_CIRCUIT_BREAKER_MIN_CALLS,
+                               window=DEFAULT_CIRCUIT_BREAKER_WINDOW_SECONDS, open_duration=DEFAULT_CIRCUIT_BREAKER_OPEN_SECONDS,
+                               slow_call=DEFAULT_CIRCUIT_BREAKER_SLOW_CALL_SECONDS):
+    global _circuit_breaker_settings
+
+    settings = {'failure_rate': failure_rate, 'min_calls': min_calls, 'window': window, 'open_duration': open_duration,
+                'slow_call': slow_call}
+    with _circuit_breakers_lock:
+        if settings != _circuit_breaker_settings:
+            _circuit_breaker_settings = settings
+            _circuit_breakers.clear()
+
+
+# Get the circuit breaker named "name", shared by every thread and kept across warm invocations, built with the
+# settings given to configure_circuit_breakers
+def get_circuit_breaker(name):
+    with _circuit_breakers_lock:
+        if name not in _circuit_breakers:
+            _circuit_breakers[name] = CircuitBreaker(name, **_circuit_breaker_settings)
+
+        return _circuit_breakers[name]
+
+
+# Forget every circuit breaker's state; the next call to get_circuit_breaker builds a new one from configuration
+def reset_circuit_breakers():
+    with _circuit_breakers_lock:
+        _circuit_breakers.clear()
@@ -0,0 +1,92 @@
+import threading
+import time
+
+from dart_lambdas.common.circuit_breaker import is_slow_call
+from dart_lambdas.common.deadline import NO_DEADLINE
+
+DEFAULT_CONCURRENCY_LIMIT_MIN = 1
+DEFAULT_CONCURRENCY_LIMIT_MAX = 16
+# Slow calls aren't counted as failures unless a "slow_call" is configured
+DEFAULT_CONCURRENCY_LIMIT_SLOW_CALL_SECONDS = None
+
+# Fraction of the limit kept after a failure
+BACKOFF_RATIO = 0.5
+
+
+# Limits how many calls to a service are in flight at once, adapting the limit to how the service copes (AIMD):
+# every success adds 1 / limit (so a full limit's worth of successes adds one slot), while a failure (or a slow
+# call, if "slow_call" is set, see circuit_breaker.is_slow_call) halves it. Calls that were already in flight when
+# the limit was last halved don't halve it again, so a burst of failures of concurrent calls backs off once, as
+# one outage. The limit stays between "min_limit" and "max_limit", starting at "max_limit"
+class AimdLimiter:
+    def __init__(self, min_limit=DEFAULT_CONCURRENCY_LIMIT_MIN, max_limit=DEFAULT_CONCURRENCY_LIMIT_MAX,
+                 slow_call=DEFAULT_CONCURRENCY_LIMIT_SLOW_CALL_SECONDS):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.slow_call = slow_call
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._backed_off_at = None
+        self._condition = threading.Condition()
+
+    # Wait for a free slot, but not past "deadline"
+    #
+    # @returns whether a slot was acquired; one that was must be given back with "release"
+    def acquire(self, deadline=NO_DEADLINE):
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout=deadline.remaining()):
+                return False
+            self.in_flight += 1
+            return True
+
+    # Give back a slot, adjusting the limit by the outcome of the call that held it, which took "duration" seconds
+    # and sent "size" bytes, if known. A "success" of None (the slot wasn't used for a call) leaves the limit as it is
+    def release(self, success=None, duration=0, size=None):
+        now = time.monotonic()
+
+        with self._condition:
+            self.in_flight -= 1
+            if success is not None and success and not is_slow_call(duration, size, self.slow_call):
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif success is not None and (self._backed_off_at is None or now - duration >= self._backed_off_at):
+                self.limit = max(self.min_limit, self.limit * BACKOFF_RATIO)
+                self._backed_off_at = now
+            self._condition.notify_all()
+
+
+_limiter_settings = {
+    'min_limit': DEFAULT_CONCURRENCY_LIMIT_MIN,
+    'max_limit': DEFAULT_CONCURRENCY_LIMIT_MAX,
+    'slow_call': DEFAULT_CONCURRENCY_LIMIT_SLOW_CALL_SECONDS,
+}
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+# Set how limiters are built (see AimdLimiter); anything not given is set back to its default. Settings are checked
+# by the caller, e.g. from the lambda's configuration, and limiters built with other settings are forgotten
+def configure_concurrency_limiters(min_limit=DEFAULT_CONCURRENCY_LIMIT_MIN, max_limit=DEFAULT_CONCURRENCY_LIMIT_MAX,
+                                   slow_call=DEFAULT_CONCURRENCY_LIMIT_SLOW_CALL_SECONDS):
+    global _limiter_settings
+
+    settings = {'min_limit': min_limit, 'max_limit': max_limit, 'slow_call': slow_call}
+    with _limiters_lock:
+        if settings != _limiter_settings:
+            _limiter_settings = settings
+            _limiters.clear()
+
+
+# Get the limiter named "name", shared by every thread and kept across warm invocations, built with the settings
+# given to configure_concurrency_limiters
+def get_concurrency_limiter(name):
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AimdLimiter(**_limiter_settings)
+
+        return _limiters[name]
+
+
+# Forget every limiter's state; the next call to get_concurrency_limiter builds a new one from configuration
+def reset_concurrency_limiters():
+    with _limiters_lock:
+        _limiters.clear()
@@ -1,14 +1,114 @@
+import datetime
+import json
 import os
+import random
+import re
 
-LOGGING = os.environ.get('LOGGING')
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
 
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+# Values of fields (and environment variables) whose names match this are never written out
+SECRET_NAME_PATTERN = re.compile(r'PASSWORD|SECRET|TOKEN|CREDENTIAL|AUTH|ACCESS_KEY|PRIVATE', re.IGNORECASE)
+REDACTED = '**REDACTED**'
+
+_log_context = {}
+_environment_logged = False
+
+
+# Level below which nothing is logged: LOG_LEVEL if set; otherwise DEBUG if LOGGING is ON (which used to turn on
+# all of the lambdas' logging) and WARNING if not. Read on every call so that it can be changed without a restart
+def log_level():
+    level_name = os.environ.get('LOG_LEVEL')
+    if level_name:
+        return LEVELS.get(level_name.upper(), INFO)
+
+    return DEBUG if os.environ.get('LOGGING') == 'ON' else WARNING
+
+
+def redact(fields):
+    if isinstance(fields, dict):
+        return {name: REDACTED if isinstance(name, str) and SECRET_NAME_PATTERN.search(name) else redact(value)
+                for name, value in fields.items()}
+    if isinstance(fields, (list, tuple)):
+        return [redact(value) for value in fields]
+
+    return fields
+
+
+# Fields added to every log line until the next call, e.g. the request id of the current invocation
+def set_log_context(**fields):
+    global _log_context
+    _log_context = fields
+
+
+# Logger writing one JSON object per line, which CloudWatch Logs Insights can query field by field.
+#
+# Messages are formatted lazily: "args" are only interpolated into "msg" (%-style) if the level is enabled,
+# so a disabled log call costs little more than the call itself. Keyword arguments are added as fields of the
+# log line, with secrets redacted
+class StructuredLogger:
+    def __init__(self, name):
+        self.name = name
+
+    def is_enabled(self, level):
+        return level >= log_level()
+
+    def debug(self, msg, *args, **fields):
+        self.log(DEBUG, msg, *args, **fields)
+
+    def info(self, msg, *args, **fields):
+        self.log(INFO, msg, *args, **fields)
+
+    def warning(self, msg, *args, **fields):
+        self.log(WARNING, msg, *args, **fields)
+
+    def error(self, msg, *args, **fields):
+        self.log(ERROR, msg, *args, **fields)
+
+    def log(self, level, msg, *args, **fields):
+        if not self.is_enabled(level):
+            return
+
+        record = {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'level': LEVEL_NAMES[level],
+            'logger': self.name,
+            'message': msg % args if args else msg,
+        }
+        record.update(redact(_log_context))
+        record.update(redact(fields))
+        print(json.dumps(record, default=str))
+
+
+def get_logger(name):
+    return StructuredLogger(name)
+
+
+_logger = get_logger('dart_lambdas')
+
+
+# Kept for existing callers: logs "print_in" at DEBUG level
 def LOG(print_in):
-    if LOGGING == 'ON':
-        print(print_in)
+    _logger.debug('%s', print_in)
+
 
+# Log the incoming event (for a sample of LOG_EVENT_SAMPLE_RATE of invocations, default all of them) and, once
+# per container, the environment with secrets redacted. Both are only logged at DEBUG level
 def log_environment(event_in):
-    LOG('## EVENT ##')
-    LOG(event_in)
-    LOG('\n\n## ENVIRONMENT ##')
-    for key in os.environ:
-        LOG(f'{key}: {os.environ.get(key)}')
+    global _environment_logged
+
+    if not _logger.is_enabled(DEBUG):
+        return
+
+    sample_rate = float(os.environ.get('LOG_EVENT_SAMPLE_RATE') or 1)
+    if sample_rate >= 1 or random.random() < sample_rate:
+        _logger.debug('event', event=event_in)
+
+    if not _environment_logged:
+        _environment_logged = True
+        _logger.debug('environment', environment=redact(dict(os.environ)))
@@ -0,0 +1,64 @@
+import time
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# A point in time by which some work has to be finished, e.g. the end of a Lambda invocation.
+#
+# A Deadline without an expiry never runs out, so code can take a deadline unconditionally. All durations are
+# in seconds
+class Deadline:
+    def __init__(self, expires_at=None):
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds):
+        return cls(time.monotonic() + seconds)
+
+    # Deadline for the invocation described by Lambda "context", leaving "reserve" seconds to wrap up and
+    # return a response. Without a context (e.g. when called directly) there is no deadline
+    @classmethod
+    def from_lambda_context(cls, context, reserve=0):
+        if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+            return cls()
+
+        return cls.after(context.get_remaining_time_in_millis() / 1000 - reserve)
+
+    # The first of "deadlines" to expire (a deadline without an expiry if there are none)
+    @staticmethod
+    def earliest(deadlines):
+        expiries = [deadline.expires_at for deadline in deadlines if deadline.expires_at is not None]
+        return Deadline(min(expiries) if len(expiries) > 0 else None)
+
+    # Deadline that expires "seconds" before this one, to keep time in hand for work that must follow
+    def minus(self, seconds):
+        return Deadline(None if self.expires_at is None else self.expires_at - seconds)
+
+    # @returns seconds left, or None if there is no deadline
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def has_at_least(self, seconds):
+        remaining = self.remaining()
+        return remaining is None or remaining >= seconds
+
+    # Shrink a timeout of "seconds" so that it ends by the deadline
+    def timeout(self, seconds):
+        remaining = self.remaining()
+        return seconds if remaining is None else min(seconds, remaining)
+
+    def check(self, action):
+        if self.expired():
+            raise DeadlineExceeded(f'Deadline exceeded before {action}')
+
+
+NO_DEADLINE = Deadline()
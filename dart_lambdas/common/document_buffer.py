@@ -0,0 +1,250 @@
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+
+from dart_lambdas.common.custom_logging import get_logger
+
+log = get_logger('document_buffer')
+
+DEFAULT_DOCUMENT_BUFFER_MEMORY_BYTES = 8 * 1024 ** 2
+DEFAULT_READ_SIZE = 1024 * 1024
+
+_buffer_memory_limit = DEFAULT_DOCUMENT_BUFFER_MEMORY_BYTES
+_buffer_directory = None
+
+# Bytes of disk promised to the buffers in use that may spill (see replayable_documents)
+_reserved_disk_space = 0
+_reserved_disk_space_lock = threading.Lock()
+
+
+# Seekable stream over a document read once from "source" (a stream of known length, e.g. a SizedStream), so that
+# it can be sent again, e.g. when a POST is retried. Whatever is read from "source" is kept: in memory up to
+# "memory_limit" bytes, and beyond that in a temporary file in "directory" (see configure_document_buffers; the
+# system's temporary directory, /tmp on Lambda, by default), so memory stays bounded however large the document is.
+#
+# Reading goes through to "source" only as far as nothing has been kept yet, so the first pass streams the document
+# as it arrives. Once "source" has been read to the end the document is frozen: a file is memory-mapped, and
+# read_view and view return slices of it (or of memory) without copying. Closing the buffer closes "source",
+# removes the file and gives back the "reserved_disk_space" it was promised, if any
+class DocumentBuffer:
+    def __init__(self, source, length=None, memory_limit=None, directory=None, reserved_disk_space=0):
+        self._source = source
+        self._length = int(len(source) if length is None else length)
+        self._memory_limit = buffer_memory_limit() if memory_limit is None else memory_limit
+        self._directory = buffer_directory() if directory is None else directory
+        self._reserved_disk_space = reserved_disk_space
+        self._memory = bytearray()
+        self._file = None
+        self._mapped = None
+        self._view = None
+        self._kept = 0
+        self._position = 0
+
+    # Read all of "source" into a new buffer, e.g. to hold a whole document before posting it
+    @staticmethod
+    def from_stream(source, length=None, memory_limit=None, directory=None):
+        buffer = DocumentBuffer(source, length, memory_limit, directory)
+        try:
+            buffer.fill()
+        except Exception:
+            buffer.close()
+            raise
+        return buffer
+
+    def __len__(self):
+        return self._length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._length
+
+        if offset < 0:
+            raise ValueError(f'Negative seek position {offset}')
+
+        self._keep_up_to(min(offset, self._length))
+        self._position = offset
+        return self._position
+
+    # Whether the whole document has been read from "source"
+    @property
+    def complete(self):
+        return self._kept == self._length
+
+    def read(self, size=-1):
+        return bytes(self.read_view(size))
+
+    # Same as read, but once the document is complete the result is a view of the buffer rather than a copy.
+    # A view is only valid until the buffer is closed
+    def read_view(self, size=-1):
+        remaining = max(self._length - self._position, 0)
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        if size == 0:
+            return memoryview(b'')
+
+        start = self._position
+        self._keep_up_to(start + size)
+        self._position += size
+
+        if self.complete:
+            return self.view()[start:start + size]
+        if self._file is None:
+            return memoryview(bytes(self._memory[start:start + size]))
+        return memoryview(self._read_kept(start, size))
+
+    # The whole document, without copying it, read from "source" first if need be. Valid until the buffer is closed
+    def view(self):
+        if self._view is None:
+            self.fill()
+            if self._file is None:
+                self._view = memoryview(self._memory)
+            else:
+                self._file.flush()
+                self._mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._mapped)
+        return self._view
+
+    # Read the rest of "source"
+    def fill(self):
+        self._keep_up_to(self._length)
+
+    def close(self):
+        self._source.close()
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mapped is not None:
+            try:
+                self._mapped.close()
+            except BufferError:
+                pass  # a view of it is still in use; it is unmapped once that is dropped
+            self._mapped = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._memory = bytearray()
+        if self._reserved_disk_space > 0:
+            _release_disk_space(self._reserved_disk_space)
+            self._reserved_disk_space = 0
+
+    def _keep_up_to(self, end):
+        while self._kept < end:
+            chunk = self._source.read(min(DEFAULT_READ_SIZE, self._length - self._kept))
+            if len(chunk) == 0:
+                raise Exception(f'Document ended {self._length - self._kept} bytes before its declared length of {self._length}')
+            self._keep(chunk)
+
+    def _keep(self, chunk):
+        if self._file is None and self._kept + len(chunk) > self._memory_limit:
+            log.debug('spilling document of %s bytes to disk', self._length)
+            self._file = tempfile.TemporaryFile(dir=self._directory)
+            self._file.write(self._memory)
+            self._memory = bytearray()
+
+        if self._file is None:
+            self._memory += chunk
+        else:
+            self._file.write(chunk)
+        self._kept += len(chunk)
+
+    def _read_kept(self, start, size):
+        self._file.flush()
+        return os.pread(self._file.fileno(), size, start)
+
+
+# Set how much of a document DocumentBuffers keep in memory, and the directory they spill the rest to (None for the
+# system's temporary directory); anything not given is set back to its default. Settings are checked by the caller,
+# e.g. from the lambda's configuration, and apply to buffers created from then on
+def configure_document_buffers(memory_limit=DEFAULT_DOCUMENT_BUFFER_MEMORY_BYTES, directory=None):
+    global _buffer_memory_limit, _buffer_directory
+
+    _buffer_memory_limit = memory_limit
+    _buffer_directory = directory
+
+
+# Bytes of a document a DocumentBuffer keeps in memory before spilling to disk (see configure_document_buffers)
+def buffer_memory_limit():
+    return _buffer_memory_limit
+
+
+# Directory a DocumentBuffer spills to, or None for the system's temporary directory (see configure_document_buffers)
+def buffer_directory():
+    return _buffer_directory
+
+
+# "documents" in a form that can be sent more than once: streams of known length are wrapped in DocumentBuffers,
+# anything else that can be sent again (e.g. bytes, or something that can already be rewound) is returned as is.
+#
+# Buffers of documents too large for memory need as much free disk space as the documents' size. It is set aside
+# for all of them at once, counting what buffers already in use were promised, so that concurrent posts can't run
+# the disk (Lambda's /tmp is 512 MB by default) out of space between them.
+#
+# @returns a list of the documents in the same order, or None if any of them can't be sent again, or there isn't
+# the space to keep them: they should then be sent once, as they are
+def replayable_documents(documents):
+    memory_limit = buffer_memory_limit()
+    directory = buffer_directory()
+
+    disk_space = []
+    for document in documents:
+        if _can_be_sent_again(document):
+            disk_space.append(None)
+        elif hasattr(document, 'read') and hasattr(document, '__len__'):
+            disk_space.append(len(document) if len(document) > memory_limit else 0)
+        else:
+            return None
+
+    needed = sum(space or 0 for space in disk_space)
+    if needed > 0 and not _reserve_disk_space(needed, directory):
+        log.warning('not enough free space in %s to keep %s bytes of documents; they can only be sent once',
+                    directory or tempfile.gettempdir(), needed)
+        return None
+
+    return [document if space is None else DocumentBuffer(document, memory_limit=memory_limit, directory=directory,
+                                                          reserved_disk_space=space)
+            for document, space in zip(documents, disk_space)]
+
+
+# "document" in a form that can be sent more than once, or None if there isn't one (see replayable_documents)
+def replayable(document):
+    documents = replayable_documents([document])
+    return None if documents is None else documents[0]
+
+
+def _can_be_sent_again(document):
+    if isinstance(document, (bytes, bytearray, memoryview, str)):
+        return True
+    return getattr(document, 'seekable', None) is not None and document.seekable()
+
+
+def _reserve_disk_space(size, directory):
+    global _reserved_disk_space
+
+    with _reserved_disk_space_lock:
+        free = shutil.disk_usage(directory or tempfile.gettempdir()).free
+        if _reserved_disk_space + size > free:
+            return False
+        _reserved_disk_space += size
+        return True
+
+
+def _release_disk_space(size):
+    global _reserved_disk_space
+
+    with _reserved_disk_space_lock:
+        _reserved_disk_space -= size
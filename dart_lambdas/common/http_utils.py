@@ -1,67 +1,217 @@
-from time import sleep
+import threading
+
 import requests
+import urllib3.exceptions
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from dart_lambdas.common.custom_logging import get_logger
+from dart_lambdas.common.deadline import NO_DEADLINE
+from dart_lambdas.common.multipart import MultipartEncoder
+from dart_lambdas.common.retry import RetryPolicy
+
+log = get_logger('http_utils')
+
+DEFAULT_HTTP_MAX_POOL_CONNECTIONS = 10
+DEFAULT_HTTP_CONNECT_RETRIES = 2
+
+DEFAULT_HTTP_CONNECT_TIMEOUT = 5
+DEFAULT_HTTP_READ_TIMEOUT = 60
+
+RETRYABLE_STATUS_CODES = {408, 429}
+# Statuses with which a server turns a request down without processing it (see is_resendable_status)
+UNPROCESSED_STATUS_CODES = {429, 503}
+
+# try_post reports failures as one of these followed by the status code or exception
+POST_STATUS_FAILURE = 'FAILED TO POST. Response status-code: '
+POST_EXCEPTION_FAILURE = 'FAILED TO POST. Exception: '
+
+_http_settings = {
+    'max_pool_connections': DEFAULT_HTTP_MAX_POOL_CONNECTIONS,
+    'connect_retries': DEFAULT_HTTP_CONNECT_RETRIES,
+    'connect_timeout': DEFAULT_HTTP_CONNECT_TIMEOUT,
+    'read_timeout': DEFAULT_HTTP_READ_TIMEOUT,
+}
+_http_adapter = None
+_http_adapter_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+# Set how requests made from this container are pooled and timed (see _get_http_adapter and request_timeout);
+# anything not given is set back to its default. Settings are checked by the caller, e.g. from the lambda's
+# configuration, and the pool is rebuilt with them if they changed
+def configure_http(max_pool_connections=DEFAULT_HTTP_MAX_POOL_CONNECTIONS, connect_retries=DEFAULT_HTTP_CONNECT_RETRIES,
+                   connect_timeout=DEFAULT_HTTP_CONNECT_TIMEOUT, read_timeout=DEFAULT_HTTP_READ_TIMEOUT):
+    global _http_settings
+
+    settings = {
+        'max_pool_connections': max_pool_connections,
+        'connect_retries': connect_retries,
+        'connect_timeout': connect_timeout,
+        'read_timeout': read_timeout,
+    }
+    if settings != _http_settings:
+        _http_settings = settings
+        reset_http_session()
+
+
+# The settings given to configure_http
+def http_settings():
+    return _http_settings
+
+
+# Get the adapter that holds the keep-alive connection pool shared by every request made from this container.
+#
+# The pool keeps "max_pool_connections" connections open per host. Failures to connect are retried
+# "connect_retries" times by the adapter; nothing is retried once a request may have been sent, since a POST to
+# Ladle is not idempotent
+def _get_http_adapter():
+    global _http_adapter
+
+    if _http_adapter is None:
+        with _http_adapter_lock:
+            if _http_adapter is None:
+                connect_retries = _http_settings['connect_retries']
+                _http_adapter = HTTPAdapter(
+                    pool_maxsize=_http_settings['max_pool_connections'],
+                    max_retries=Retry(total=connect_retries, connect=connect_retries, read=0, status=0, backoff_factor=0.1),
+                )
+
+    return _http_adapter
+
+
+# Get a session for the calling thread. Sessions are kept per thread because requests.Session is not
+# thread-safe, but they all mount the same adapter, so connections are pooled and kept alive across
+# threads and warm invocations
+def get_http_session():
+    adapter = _get_http_adapter()
+    session = getattr(_thread_local, 'session', None)
 
-from dart_lambdas.common.custom_logging import LOG
+    if session is None or session.get_adapter('http://') is not adapter:
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _thread_local.session = session
+
+    return session
+
+
+# (connect, read) timeouts in seconds for a request that has to finish by "deadline": those given to configure_http,
+# shortened to the time remaining before "deadline"
+def request_timeout(deadline=NO_DEADLINE):
+    return deadline.timeout(_http_settings['connect_timeout']), deadline.timeout(_http_settings['read_timeout'])
+
+
+# Close all pooled connections; the next request builds a new pool using the current configuration
+def reset_http_session():
+    global _http_adapter
+
+    with _http_adapter_lock:
+        if _http_adapter is not None:
+            _http_adapter.close()
+        _http_adapter = None
+
+
+# Whether a failed request is worth retrying: the server couldn't be reached or didn't answer in time.
+# Anything else (e.g. an invalid URL, or a streamed body that can't be sent again) fails the same way every time
+def is_retryable_http_error(exception):
+    return isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+# Whether a POST failed before anything was sent: the server couldn't be reached. Unlike is_retryable_http_error, a
+# read timeout doesn't count, since the server may have taken the request and only been slow to answer, and sending
+# a non-idempotent POST again would then submit it twice
+def is_connect_failure(exception):
+    if isinstance(exception, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(exception, requests.exceptions.ConnectionError) or len(exception.args) == 0:
+        return False
+
+    reason = getattr(exception.args[0], 'reason', exception.args[0])
+    return isinstance(reason, (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError))
+
+
+# Whether a response status means the request may succeed if repeated
+def is_retryable_status(status_code):
+    return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+
+
+# Whether a POST answered with "status_code" can be sent again: the server turned it down without processing it.
+# Other retryable statuses, 500, 502 and 504 among them, may come after the server took the request, and a
+# non-idempotent POST sent again would then be submitted twice
+def is_resendable_status(status_code):
+    return status_code in UNPROCESSED_STATUS_CODES
+
+
+# Whether "response", as returned by a failed try_post, means the server is struggling: it couldn't be reached or
+# didn't answer in time, or it answered with a retryable status. Other failures (e.g. the request being rejected, or
+# running out of time before sending it) say nothing about the server's health
+def is_server_failure(response):
+    if response.startswith(POST_STATUS_FAILURE):
+        status = response[len(POST_STATUS_FAILURE):]
+        return not status.isdigit() or is_retryable_status(int(status))
+
+    return response.startswith(POST_EXCEPTION_FAILURE) and 'Deadline exceeded' not in response
 
 
 # Send a multipart POST request to "url" at "endpoint" on "port" with a file stream "file_data" and
 # form data "post_data", trying "num_times" times, and sleeping for "sleep_time" seconds
-# between each request.
+# between each request (or retrying according to "retry_policy" if one is given). Only failures to
+# connect (see is_connect_failure) and statuses for which is_resendable_status holds are retried, since
+# anything else may have been processed. No attempt is started, and no
+# attempt's timeouts run, past "deadline". File contents may be streams, which are sent
+# in chunks rather than read into memory (see MultipartEncoder); a stream that can't be rewound can
+# only be sent once.
 #
 # @returns (success: Boolean, response: Any) where "success" says whether it was successful, and
 # "response" is either the content of the response, or the status or exception of failure
-def try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes):
-    times_left = numtimes - 1
+def try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, retry_policy=None, deadline=NO_DEADLINE):
+    policy = retry_policy or RetryPolicy.fixed(numtimes, sleep_time * 1000, is_connect_failure)
+    body = MultipartEncoder(post_files, post_data)
+    attempts = [0]
 
-    LOG(f"Attempt #{numtimes}: {url}:{port}{endpoint}")
+    def post():
+        deadline.check('posting')
+        attempts[0] += 1
+        log.debug('Attempt #%s: %s:%s%s', attempts[0], url, port, endpoint)
+        return get_http_session().post(f"{url}:{port}{endpoint}", data=body, headers={'Content-Type': body.content_type},
+                                       auth=basic_auth, timeout=request_timeout(deadline))
 
     try:
-        response = requests.post(f"{url}:{port}{endpoint}", files=post_files, data=post_data, auth=basic_auth)
-
-        if response.status_code == 200:
-            return [True, response.text]
-        else:
-            if times_left == 0:
-                return [False, f"FAILED TO POST. Response status-code: {response.status_code}"]
-            else:
-                sleep(sleep_time)
-                return try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, times_left)
+        response = policy.execute(post, lambda res: is_resendable_status(res.status_code), deadline)
     except Exception as e:
-        LOG(f"Exception: {e}")
-        if times_left == 0:
-            return [False, f"FAILED TO POST. Exception: {str(e)}"]
-        else:
-            sleep(sleep_time)
-            return try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, times_left)
+        log.warning('Exception posting to %s:%s%s: %s', url, port, endpoint, e)
+        return [False, POST_EXCEPTION_FAILURE + str(e)]
+
+    if response.status_code == 200:
+        return [True, response.text]
+    else:
+        return [False, f"{POST_STATUS_FAILURE}{response.status_code}"]
 
 
 # send GET request to "url" at "endpoint" on "port". tries "num_times" times, and sleeps for "sleep_time" seconds
-# between each request. Each request will fail after timeout of "time_out" seconds
+# between each request (or retries according to "retry_policy" if one is given), never past "deadline"
 #
 # @returns (success: Boolean, response: Any) where "success" says whether it was successful, and
 # "response" is either the content of the response, or the status or exception of failure
-def try_get(url, port, endpoint, params, sleep_time, num_times):
-    times_left = num_times - 1
-    LOG(f"Attempt #{num_times}: {url}:{port}{endpoint}")
+def try_get(url, port, endpoint, params, sleep_time, num_times, retry_policy=None, deadline=NO_DEADLINE):
+    policy = retry_policy or RetryPolicy.fixed(num_times, sleep_time * 1000, is_retryable_http_error)
+    attempts = [0]
+
+    def get():
+        deadline.check('getting')
+        attempts[0] += 1
+        log.debug('Attempt #%s: %s:%s%s', attempts[0], url, port, endpoint)
+        return get_http_session().get(f"{url}:{port}{endpoint}", params=params, timeout=request_timeout(deadline))
 
     try:
-        response = requests.get(f"{url}:{port}{endpoint}", params=params)
-
-        if response.status_code == 200:
-            return (True, response.content)
-        else:
-            LOG(f"Response status-code {response.status_code}")
-
-            if times_left == 0:
-                return (False, f"Response status-code: {response.status_code}")
-            else:
-                sleep(sleep_time)
-                return try_get(url, port, endpoint, params, sleep_time, times_left)
+        response = policy.execute(get, lambda res: res.status_code != 200 and is_retryable_status(res.status_code), deadline)
     except Exception as e:
-        LOG(f"Exception: {e}")
+        log.warning('Exception getting %s:%s%s: %s', url, port, endpoint, e)
+        return (False, f"Exception: {str(e)}")
 
-        if times_left == 0:
-            return (False, f"Exception: {str(e)}")
-        else:
-            sleep(sleep_time)
-            return try_get(url, port, endpoint, params, sleep_time, times_left)
+    if response.status_code == 200:
+        return (True, response.content)
+    else:
+        log.warning('Response status-code %s from %s:%s%s', response.status_code, url, port, endpoint)
+        return (False, f"Response status-code: {response.status_code}")
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import botocore.exceptions
+
+from dart_lambdas.common.custom_logging import get_logger
+from dart_lambdas.common.s3_utils import get_s3_client
+
+log = get_logger('idempotency')
+
+DEFAULT_IDEMPOTENCY_CACHE_SIZE = 1024
+DEFAULT_IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_IDEMPOTENCY_PREFIX = 'idempotency/'
+
+
+# Key identifying one version of an object: the same bucket and key with a different ETag is a different upload
+def idempotency_key(bucket, key, etag):
+    unquoted_etag = etag.strip('"')
+    return f'{bucket}/{key}#{unquoted_etag}'
+
+
+# Key identifying a document by its content alone, whatever it was uploaded as
+def content_hash_key(md5):
+    return f'md5:{md5}'
+
+
+# Server-side encryption under which an object's ETag is still the MD5 of its content: none, or S3-managed keys.
+# The ETags of objects encrypted with KMS keys (SSE-KMS, DSSE-KMS) or customer-provided keys (SSE-C) are not
+MD5_ETAG_ENCRYPTION = (None, 'AES256')
+
+
+# MD5 of an object's content as given by the ETag in "object_response", its GetObject or HeadObject response. That
+# is only the case for objects uploaded in a single part (multipart ETags look like "<hash>-<parts>") and encrypted
+# as in MD5_ETAG_ENCRYPTION, which the response also says; None otherwise
+def md5_from_etag(object_response):
+    etag = object_response.get('ETag')
+    if etag is None:
+        return None
+    if object_response.get('ServerSideEncryption') not in MD5_ETAG_ENCRYPTION or object_response.get('SSECustomerAlgorithm'):
+        return None
+
+    unquoted_etag = etag.strip('"').lower()
+    if len(unquoted_etag) != 32 or any(c not in '0123456789abcdef' for c in unquoted_etag):
+        return None
+
+    return unquoted_etag
+
+
+# Least-recently-used cache of at most "max_size" entries, each of which expires "ttl" seconds after it was put.
+# Lives as long as the container, so it catches redeliveries that land on a warm Lambda
+class InMemoryIdempotencyStore:
+    def __init__(self, max_size=DEFAULT_IDEMPOTENCY_CACHE_SIZE, ttl=DEFAULT_IDEMPOTENCY_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+# Store keeping each entry as a small JSON object under "prefix" in "bucket", so that it survives cold starts and
+# is shared between containers. Entries should be expired with a lifecycle rule on the prefix
+class S3IdempotencyStore:
+    def __init__(self, bucket, prefix=DEFAULT_IDEMPOTENCY_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _object_key(self, key):
+        return self.prefix + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    # A record that can't be read, for whatever reason, is a miss: the document is then posted as if it were new
+    def get(self, key):
+        try:
+            get_response = get_s3_client().get_object(Bucket=self.bucket, Key=self._object_key(key))
+            return json.loads(get_response['Body'].read())['value']
+        except botocore.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                log.warning('unable to read idempotency record for %s: %s', key, e)
+            return None
+        except Exception as e:
+            log.warning('unable to read idempotency record for %s: %s', key, e)
+            return None
+
+    def put(self, key, value):
+        get_s3_client().put_object(
+            Bucket=self.bucket,
+            Key=self._object_key(key),
+            Body=json.dumps({'key': key, 'value': value}).encode('utf-8'),
+            ContentType='application/json',
+        )
+
+
+# Looks entries up in each store in turn (fastest first), copying hits into the faster stores, and writes to all
+class TieredIdempotencyStore:
+    def __init__(self, stores):
+        self.stores = stores
+
+    def get(self, key):
+        for index, store in enumerate(self.stores):
+            value = store.get(key)
+            if value is not None:
+                for faster_store in self.stores[:index]:
+                    faster_store.put(key, value)
+                return value
+
+        return None
+
+    def put(self, key, value):
+        for store in self.stores:
+            store.put(key, value)
+
+
+_idempotency_settings = {
+    'cache_size': DEFAULT_IDEMPOTENCY_CACHE_SIZE,
+    'ttl': DEFAULT_IDEMPOTENCY_TTL_SECONDS,
+    'bucket': None,
+    'prefix': DEFAULT_IDEMPOTENCY_PREFIX,
+}
+_idempotency_store = None
+_idempotency_store_lock = threading.Lock()
+
+
+# Set how the shared store is built (see get_idempotency_store); anything not given is set back to its default.
+# Settings are checked by the caller, e.g. from the lambda's configuration, and the store is rebuilt with them if
+# they changed
+def configure_idempotency_store(cache_size=DEFAULT_IDEMPOTENCY_CACHE_SIZE, ttl=DEFAULT_IDEMPOTENCY_TTL_SECONDS, bucket=None,
+                                prefix=DEFAULT_IDEMPOTENCY_PREFIX):
+    global _idempotency_settings, _idempotency_store
+
+    settings = {'cache_size': cache_size, 'ttl': ttl, 'bucket': bucket, 'prefix': prefix}
+    with _idempotency_store_lock:
+        if settings != _idempotency_settings:
+            _idempotency_settings = settings
+            _idempotency_store = None
+
+
+# Get the store shared by this container: an in-memory cache ("cache_size" entries kept for "ttl" seconds), backed
+# by an S3IdempotencyStore if a "bucket" is given (see configure_idempotency_store)
+def get_idempotency_store():
+    global _idempotency_store
+
+    if _idempotency_store is None:
+        with _idempotency_store_lock:
+            if _idempotency_store is None:
+                settings = _idempotency_settings
+                stores = [InMemoryIdempotencyStore(settings['cache_size'], settings['ttl'])]
+                if settings['bucket']:
+                    stores.append(S3IdempotencyStore(settings['bucket'], settings['prefix']))
+                _idempotency_store = TieredIdempotencyStore(stores)
+
+    return _idempotency_store
+
+
+# Replace the shared store, e.g. with a local stand-in; None rebuilds it from configuration on next use
+def set_idempotency_store(store):
+    global _idempotency_store
+
+    with _idempotency_store_lock:
+        _idempotency_store = store
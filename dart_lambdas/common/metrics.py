@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+DEFAULT_METRICS_NAMESPACE = 'DART/Lambdas'
+
+MILLISECONDS = 'Milliseconds'
+BYTES = 'Bytes'
+COUNT = 'Count'
+
+
+# Metrics collected for one unit of work (e.g. one record), written out as a single CloudWatch Embedded Metric
+# Format (EMF) log line by "emit". CloudWatch turns the line into metrics without any API calls from the Lambda.
+#
+# Stages are timed with "time", which records "<stage>Latency" in milliseconds. Metrics may be recorded from
+# several threads at once
+class Metrics:
+    def __init__(self, namespace, dimensions):
+        self.namespace = namespace
+        self.dimensions = dimensions
+        self._values = {}
+        self._units = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f'{stage}Latency', (time.perf_counter() - start) * 1000, MILLISECONDS)
+
+    def add(self, name, value, unit=COUNT):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+            self._units[name] = unit
+
+    def counter(self, name):
+        return lambda *args: self.add(name, 1)
+
+    def to_emf(self):
+        with self._lock:
+            values = dict(self._values)
+            units = dict(self._units)
+
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(self.dimensions.keys())],
+                    'Metrics': [{'Name': name, 'Unit': units[name]} for name in values],
+                }],
+            },
+            **self.dimensions,
+            **values,
+        }
+
+    def emit(self):
+        print(json.dumps(self.to_emf()))
+
+
+# Stand-in used when metrics are disabled: every method does nothing, so instrumented code costs next to nothing
+class NullMetrics:
+    def time(self, stage):
+        return _NULL_TIMER
+
+    def add(self, name, value, unit=COUNT):
+        pass
+
+    def counter(self, name):
+        return _ignore
+
+    def emit(self):
+        pass
+
+
+def _ignore(*args):
+    pass
+
+
+_NULL_TIMER = nullcontext()
+
+
+NULL_METRICS = NullMetrics()
+
+
+# Start collecting metrics for a unit of work if METRICS is ON, under METRICS_NAMESPACE with the given dimensions
+# (e.g. function name); otherwise return NULL_METRICS
+def create_metrics(**dimensions):
+    if os.environ.get('METRICS') != 'ON':
+        return NULL_METRICS
+
+    return Metrics(os.environ.get('METRICS_NAMESPACE') or DEFAULT_METRICS_NAMESPACE, dimensions)
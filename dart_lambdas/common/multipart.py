@@ -0,0 +1,149 @@
+from collections.abc import Mapping
+
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+# Readable wrapper around a stream whose length is known up front (e.g. an S3 StreamingBody and its
+# ContentLength), so that it can be sent with a Content-Length instead of being read into memory first
+class SizedStream:
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._length = int(length)
+        self._remaining = self._length
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+
+        size = self._remaining if size is None or size < 0 else min(size, self._remaining)
+        chunk = self._stream.read(size)
+        if len(chunk) == 0:
+            raise Exception(f'Stream ended {self._remaining} bytes before its declared length of {self._length}')
+
+        self._remaining -= len(chunk)
+        return chunk
+
+    def close(self):
+        self._stream.close()
+
+
+# Iterable multipart/form-data body that is produced chunk by chunk, so that file contents given as
+# streams are never held in memory as a whole.
+#
+# "files" and "data" take the same forms as the arguments of the same names to requests.post, and the
+# encoded body is byte-for-byte what requests would build from them. File contents can be bytes, str or
+# any object with a read method. Contents that are seekable are rewound before each iteration, so the body
+# can be sent again; other streams can only be sent once. When every part has a known length the total is
+# exposed as "len", which requests uses as the Content-Length; otherwise the body is sent chunked
+class MultipartEncoder:
+    def __init__(self, files, data=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.boundary = choose_boundary()
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self._chunk_size = chunk_size
+        self._parts = [self._encode_part(field) for field in self._fields(files, data)]
+        self._closing = f'--{self.boundary}--\r\n'.encode('latin-1')
+
+        if all(length is not None for _, _, _, length in self._parts):
+            self.len = sum(len(header) + length + 2 for header, _, _, length in self._parts) + len(self._closing)
+
+    def __iter__(self):
+        for header, content, start, length in self._parts:
+            yield header
+
+            if _is_in_memory(content):
+                yield content
+            else:
+                if start is not None:
+                    content.seek(start)
+
+                # Contents that can (e.g. a DocumentBuffer) hand out views of what they hold rather than copies
+                read = getattr(content, 'read_view', content.read)
+                sent = 0
+                while True:
+                    chunk = read(self._chunk_size)
+                    if not chunk:
+                        break
+                    sent += len(chunk)
+                    yield chunk
+
+                # Never let a short stream go out under a Content-Length it doesn't fill
+                if length is not None and sent != length:
+                    raise Exception(f'Multipart part produced {sent} bytes but {length} were expected')
+
+            yield b'\r\n'
+
+        yield self._closing
+
+    def to_bytes(self):
+        return b''.join(self)
+
+    @staticmethod
+    def _fields(files, data):
+        fields = []
+
+        for name, value in _items(data):
+            values = value if isinstance(value, (list, tuple)) else [value]
+            for single_value in values:
+                fields.append((name, None, single_value, None, None))
+
+        for name, value in _items(files):
+            content_type = None
+            headers = None
+            if isinstance(value, (tuple, list)):
+                if len(value) == 2:
+                    filename, content = value
+                elif len(value) == 3:
+                    filename, content, content_type = value
+                else:
+                    filename, content, content_type, headers = value
+            else:
+                filename, content = name, value
+
+            if content is None:
+                continue
+
+            fields.append((name, filename, content, content_type, headers))
+
+        return fields
+
+    def _encode_part(self, field):
+        name, filename, content, content_type, headers = field
+
+        request_field = RequestField(name=name, data=b'', filename=filename, headers=headers)
+        request_field.make_multipart(content_type=content_type)
+        header = f'--{self.boundary}\r\n'.encode('latin-1') + request_field.render_headers().encode('utf-8')
+
+        if isinstance(content, (int, float)):
+            content = str(content)
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+
+        if _is_in_memory(content):
+            return header, content, None, memoryview(content).nbytes
+
+        start = content.tell() if _is_seekable(content) else None
+        length = len(content) if hasattr(content, '__len__') else None
+        return header, content, start, length
+
+
+def _items(fields):
+    if fields is None:
+        return []
+    if isinstance(fields, Mapping):
+        return list(fields.items())
+    return list(fields)
+
+
+def _is_in_memory(content):
+    return isinstance(content, (bytes, bytearray, memoryview))
+
+
+def _is_seekable(content):
+    seekable = getattr(content, 'seekable', None)
+    return seekable is not None and seekable()
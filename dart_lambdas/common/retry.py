@@ -1,6 +1,9 @@
 import collections
+import random
 import time
 
+from dart_lambdas.common.deadline import NO_DEADLINE
+
 
 def execute_with_arguments(fn_to_execute, args):
     if isinstance(args, collections.abc.Mapping):
@@ -11,25 +14,138 @@ def execute_with_arguments(fn_to_execute, args):
         raise Exception( "must provide arguments as a dictionary (**kwargs) or list (*args)" )
 
 
-def retry(retry_fn, args, num_times, fail_check_fn = None, pause = 0):
-    if num_times < 1:
-        raise Exception( "num_times must be greater than 0" )
+def always_retryable(exception):
+    return True
+
+
+# How to retry an operation: up to "max_attempts" attempts, waiting between them with exponential backoff
+# starting at "base_delay" and growing by "multiplier" up to "max_delay" (all delays in milliseconds).
+#
+# With "jitter" (full jitter) each wait is drawn uniformly between 0 and the backoff, so that many Lambdas
+# retrying the same throttled service don't do so in lockstep. "max_elapsed" (milliseconds) bounds the total
+# time spent: no retry is attempted if its wait would end after that. "retryable" classifies exceptions;
+# anything it rejects is raised immediately.
+#
+# A multiplier of 1 without jitter gives a fixed pause between attempts
+class RetryPolicy:
+    def __init__(self, max_attempts, base_delay=0, max_delay=None, multiplier=2, jitter=True, max_elapsed=None,
+                 retryable=always_retryable):
+        if max_attempts < 1:
+            raise Exception( "num_times must be greater than 0" )
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_elapsed = max_elapsed
+        self.retryable = retryable
+
+    @classmethod
+    def fixed(cls, max_attempts, pause=0, retryable=always_retryable):
+        return cls(max_attempts, base_delay=pause, multiplier=1, jitter=False, retryable=retryable)
+
+    # Wait in milliseconds before the attempt following attempt number "attempt" (starting at 1)
+    def delay(self, attempt):
+        backoff = self.base_delay * self.multiplier ** (attempt - 1)
+        if self.max_delay is not None:
+            backoff = min(backoff, self.max_delay)
 
-    try:
-        res = execute_with_arguments(retry_fn, args)
-        if fail_check_fn is not None:
-            if fail_check_fn( res ):
-                if num_times == 1:
+        return random.uniform(0, backoff) if self.jitter else backoff
+
+    # Call "fn" until it neither raises a retryable exception nor returns a result that "fail_check_fn"
+    # flags as a failure, or until the policy runs out of attempts or time.
+    #
+    # No retry is attempted if its wait would end after "deadline". "on_retry", if given, is called with the
+    # number of the failed attempt before each retry.
+    #
+    # @returns the last result, even if "fail_check_fn" flags it. Raises the last exception if the last
+    # attempt raised
+    def execute(self, fn, fail_check_fn=None, deadline=NO_DEADLINE, on_retry=None):
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            attempt += 1
+            try:
+                res = fn()
+            except Exception as e:
+                if not self.retryable(e):
+                    raise
+                delay = self._next_delay(attempt, start, deadline)
+                if delay is None:
+                    raise
+            else:
+                if fail_check_fn is None or not fail_check_fn(res):
+                    return res
+                delay = self._next_delay(attempt, start, deadline)
+                if delay is None:
                     return res
 
-                time.sleep(pause / 1000)
-                return retry(retry_fn, args, num_times - 1, fail_check_fn, pause)
+            if on_retry is not None:
+                on_retry(attempt)
+            time.sleep(delay / 1000)
+
+    # Same as "execute" for a coroutine function "fn", waiting between attempts without blocking the event loop
+    async def execute_async(self, fn, fail_check_fn=None, deadline=NO_DEADLINE, on_retry=None):
+        # Imported here so that the threaded engine doesn't pay for importing asyncio at cold start
+        import asyncio
+
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            attempt += 1
+            try:
+                res = await fn()
+            except Exception as e:
+                if not self.retryable(e):
+                    raise
+                delay = self._next_delay(attempt, start, deadline)
+                if delay is None:
+                    raise
+            else:
+                if fail_check_fn is None or not fail_check_fn(res):
+                    return res
+                delay = self._next_delay(attempt, start, deadline)
+                if delay is None:
+                    return res
+
+            if on_retry is not None:
+                on_retry(attempt)
+            await asyncio.sleep(delay / 1000)
+
+    def _next_delay(self, attempt, start, deadline):
+        if attempt >= self.max_attempts:
+            return None
+
+        delay = self.delay(attempt)
+        if self.max_elapsed is not None and (time.monotonic() - start) * 1000 + delay > self.max_elapsed:
+            return None
+        if not deadline.has_at_least(delay / 1000):
+            return None
+
+        return delay
+
+
+# Call "retry_fn" with "args" until it succeeds, trying at most "num_times" times with a fixed "pause"
+# (milliseconds) in between, or according to "policy" if one is given, and never waiting past "deadline"
+def retry(retry_fn, args, num_times=None, fail_check_fn = None, pause = 0, policy = None, deadline = NO_DEADLINE,
+          on_retry = None):
+    if policy is None:
+        if num_times is None or num_times < 1:
+            raise Exception( "num_times must be greater than 0" )
+        policy = RetryPolicy.fixed(num_times, pause)
+
+    return policy.execute(lambda: execute_with_arguments(retry_fn, args), fail_check_fn, deadline, on_retry)
 
-        return res
-    except Exception:
-        if num_times == 1:
-            raise
 
-        time.sleep(pause / 1000)
-        return retry(retry_fn, args, num_times - 1, fail_check_fn, pause)
+# Same as "retry" for a coroutine function "retry_fn"
+async def retry_async(retry_fn, args, num_times=None, fail_check_fn = None, pause = 0, policy = None, deadline = NO_DEADLINE,
+                      on_retry = None):
+    if policy is None:
+        if num_times is None or num_times < 1:
+            raise Exception( "num_times must be greater than 0" )
+        policy = RetryPolicy.fixed(num_times, pause)
 
+    return await policy.execute_async(lambda: execute_with_arguments(retry_fn, args), fail_check_fn, deadline, on_retry)
@@ -0,0 +1,247 @@
+import collections
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import botocore.config
+import botocore.exceptions
+
+DEFAULT_S3_MAX_POOL_CONNECTIONS = 25
+DEFAULT_S3_CONNECT_TIMEOUT = 5
+DEFAULT_S3_READ_TIMEOUT = 30
+
+MAX_COPY_OBJECT_SIZE = 5 * 1024 ** 3
+MAX_MULTIPART_PARTS = 10000
+MULTIPART_COPY_PART_SIZE = 512 * 1024 ** 2
+MULTIPART_COPY_CONCURRENCY = 8
+
+# NoSuchKey is not: S3 reads are strongly consistent, so an object that isn't there won't appear by retrying
+RETRYABLE_S3_ERROR_CODES = {
+    'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'RequestTimeout',
+    'InternalError', 'ServiceUnavailable',
+}
+
+_s3_client_settings = {
+    'max_pool_connections': DEFAULT_S3_MAX_POOL_CONNECTIONS,
+    'connect_timeout': DEFAULT_S3_CONNECT_TIMEOUT,
+    'read_timeout': DEFAULT_S3_READ_TIMEOUT,
+}
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+# Set how the shared S3 client is pooled and timed (see get_s3_client); anything not given is set back to its
+# default. Settings are checked by the caller, e.g. from the lambda's configuration, and the client is rebuilt with
+# them if they changed
+def configure_s3_client(max_pool_connections=DEFAULT_S3_MAX_POOL_CONNECTIONS, connect_timeout=DEFAULT_S3_CONNECT_TIMEOUT,
+                        read_timeout=DEFAULT_S3_READ_TIMEOUT):
+    global _s3_client_settings
+
+    settings = {'max_pool_connections': max_pool_connections, 'connect_timeout': connect_timeout, 'read_timeout': read_timeout}
+    if settings != _s3_client_settings:
+        _s3_client_settings = settings
+        reset_s3_client()
+
+
+# Get the S3 client shared by every worker in this container.
+#
+# The client is created on first use and then kept at module level, so it (and its connection pool) survives
+# across warm invocations. boto3 clients are thread-safe, but creating one from the default session is not,
+# hence the lock. The pool size (see configure_s3_client) should be at least the number of S3 calls that can be
+# in flight at once. The connect and read timeouts (seconds) bound each call, since a client's timeouts can't be
+# changed per call
+def get_s3_client():
+    global _s3_client
+
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = boto3.client('s3', config=s3_client_config())
+
+    return _s3_client
+
+
+# Client configuration from the settings given to configure_s3_client (see get_s3_client)
+def s3_client_config():
+    return botocore.config.Config(
+        max_pool_connections=_s3_client_settings['max_pool_connections'],
+        connect_timeout=_s3_client_settings['connect_timeout'],
+        read_timeout=_s3_client_settings['read_timeout'],
+        # Presigned URLs would otherwise be signed with the legacy SigV2, which newer regions don't accept
+        signature_version='s3v4',
+    )
+
+
+# Whether an exception raised by an S3 call is worth retrying: throttling, server-side errors and connection
+# problems. Anything else (e.g. AccessDenied, NoSuchBucket or NoSuchKey) won't go away by retrying
+def is_retryable_s3_error(exception):
+    if isinstance(exception, botocore.exceptions.ClientError):
+        status_code = exception.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return exception.response.get('Error', {}).get('Code') in RETRYABLE_S3_ERROR_CODES or status_code >= 500
+
+    return isinstance(exception, (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError))
+
+
+# Drop the shared client so the next call to get_s3_client builds a new one (e.g. after changing configuration)
+def reset_s3_client():
+    global _s3_client
+
+    with _s3_client_lock:
+        _s3_client = None
+
+
+# Copy an object between buckets server-side.
+#
+# copy_object only accepts sources up to 5 GB, so larger objects are copied in parts with upload_part_copy.
+# "size" is the size of the source if already known (e.g. from the event record); when it is not, a plain
+# copy is attempted first and the multipart copy is only used if S3 rejects the source as too large.
+# The copy gets the source's tags, unless "tags" (a dict) is given to replace them
+def copy_s3_object(s3_client, input_key, input_bucket, output_key, output_bucket, size=None, tags=None):
+    if size is None or size <= MAX_COPY_OBJECT_SIZE:
+        try:
+            s3_client.copy_object(
+                Bucket=output_bucket,
+                Key=output_key,
+                CopySource={
+                    "Bucket": input_bucket,
+                    "Key": input_key,
+                },
+                **copy_tagging_arguments(tags),
+            )
+            return
+        except botocore.exceptions.ClientError as e:
+            if size is not None or not _is_copy_source_too_large(e):
+                raise
+
+    _multipart_copy_s3_object(s3_client, input_key, input_bucket, output_key, output_bucket, tags)
+
+
+# Arguments to copy_object that give the copy "tags" in place of its source's; none if "tags" is None
+def copy_tagging_arguments(tags):
+    if tags is None:
+        return {}
+
+    return {'TaggingDirective': 'REPLACE', 'Tagging': urllib.parse.urlencode(tags)}
+
+
+def _is_copy_source_too_large(client_error):
+    error = client_error.response.get('Error', {})
+    return error.get('Code') == 'InvalidRequest' and 'copy source is larger' in error.get('Message', '')
+
+
+def _multipart_copy_s3_object(s3_client, input_key, input_bucket, output_key, output_bucket, tags=None):
+    # Unlike copy_object, a multipart upload doesn't carry the source's content type, metadata and tags over by itself
+    head_response = s3_client.head_object(Bucket=input_bucket, Key=input_key)
+    size = head_response['ContentLength']
+    create_args = {'Bucket': output_bucket, 'Key': output_key, 'Metadata': head_response.get('Metadata', {})}
+    if head_response.get('ContentType') is not None:
+        create_args['ContentType'] = head_response['ContentType']
+    if tags is None:
+        tag_set = s3_client.get_object_tagging(Bucket=input_bucket, Key=input_key)['TagSet']
+        tags = {tag['Key']: tag['Value'] for tag in tag_set}
+    if len(tags) > 0:
+        create_args['Tagging'] = urllib.parse.urlencode(tags)
+
+    upload_id = s3_client.create_multipart_upload(**create_args)['UploadId']
+
+    def copy_part(part):
+        part_number, start, end = part
+        part_response = s3_client.upload_part_copy(
+            Bucket=output_bucket,
+            Key=output_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            CopySource={"Bucket": input_bucket, "Key": input_key},
+            CopySourceRange=f'bytes={start}-{end}',
+        )
+        return {'ETag': part_response['CopyPartResult']['ETag'], 'PartNumber': part_number}
+
+    part_size = max(MULTIPART_COPY_PART_SIZE, -(-size // MAX_MULTIPART_PARTS))
+    parts = [(index + 1, start, min(start + part_size, size) - 1) for index, start in enumerate(range(0, size, part_size))]
+
+    try:
+        with ThreadPoolExecutor(max_workers=MULTIPART_COPY_CONCURRENCY) as executor:
+            completed_parts = list(executor.map(copy_part, parts))
+
+        s3_client.complete_multipart_upload(
+            Bucket=output_bucket,
+            Key=output_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': completed_parts},
+        )
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=output_bucket, Key=output_key, UploadId=upload_id)
+        raise
+
+
+# Split an object of "size" bytes into byte ranges of "part_size": a list of (start, end), both inclusive
+def byte_ranges(size, part_size):
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+
+# Readable stream over an object of known "size" that is fetched in byte ranges of "part_size", up to
+# "concurrency" at a time, by calling "get_range(start, end)" (which returns the bytes from "start" to "end",
+# inclusive, retrying as it sees fit). Ranges are handed out in order, and only "concurrency" of them are fetched
+# ahead of the reader, so memory stays around "concurrency" times "part_size" however large the object is.
+#
+# Like SizedStream it has a length, so it can be streamed with a Content-Length, but it can't be rewound. Reading
+# raises if a range can't be fetched; close it to stop fetching
+class RangedStream:
+    def __init__(self, get_range, size, part_size, concurrency):
+        self._get_range = get_range
+        self._length = int(size)
+        self._remaining = self._length
+        self._ranges = iter(byte_ranges(self._length, part_size))
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._pending = collections.deque()
+        self._part = b''
+        self._offset = 0
+
+        for _ in range(concurrency):
+            self._fetch_next_range()
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        size = self._remaining if size is None or size < 0 else min(size, self._remaining)
+        chunks = []
+
+        while size > 0:
+            if self._offset == len(self._part):
+                self._next_part()
+
+            chunk = self._part[self._offset:self._offset + size]
+            self._offset += len(chunk)
+            self._remaining -= len(chunk)
+            size -= len(chunk)
+            chunks.append(chunk)
+
+        return b''.join(chunks)
+
+    # Wait for the first range, so that an object that can't be fetched at all fails here rather than on first read
+    def wait_for_first_range(self):
+        if self._offset == len(self._part) and self._remaining > 0:
+            self._next_part()
+
+    def close(self):
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=False)
+
+    def _fetch_next_range(self):
+        byte_range = next(self._ranges, None)
+        if byte_range is not None:
+            self._pending.append((byte_range, self._executor.submit(self._get_range, *byte_range)))
+
+    def _next_part(self):
+        (start, end), future = self._pending.popleft()
+        part = future.result()
+        if len(part) != end - start + 1:
+            raise Exception(f'Range {start}-{end} produced {len(part)} bytes but {end - start + 1} were expected')
+
+        self._part = part
+        self._offset = 0
+        self._fetch_next_range()
@@ -0,0 +1,24 @@
+import boto3
+
+SSM_PREFIX = 'ssm:'
+FILE_PREFIX = 'file:'
+
+
+# Resolve a configuration value that may hold a reference to a secret rather than the secret itself:
+#   "ssm:<name>"  the (decrypted) value of SSM parameter <name>, e.g. a SecureString holding a password
+#   "file:<path>" the contents of the file at <path> (without a trailing newline), e.g. to stand in for SSM locally
+# Any other value, including None, is returned as is. Errors reading the secret are raised
+def resolve_secret(value):
+    if value is None:
+        return None
+
+    if value.startswith(SSM_PREFIX):
+        ssm_client = boto3.client('ssm')
+        response = ssm_client.get_parameter(Name=value[len(SSM_PREFIX):], WithDecryption=True)
+        return response['Parameter']['Value']
+
+    if value.startswith(FILE_PREFIX):
+        with open(value[len(FILE_PREFIX):], 'r') as secret_file:
+            return secret_file.read().rstrip('\n')
+
+    return value
@@ -0,0 +1,24 @@
+import json
+
+SQS_EVENT_SOURCE = 'aws:sqs'
+
+
+def is_sqs_event(records_list):
+    return len(records_list) > 0 and all(record.get('eventSource') == SQS_EVENT_SOURCE for record in records_list)
+
+
+# Unwrap the S3 event notification carried in the body of an SQS message
+#
+# @returns the list of S3 event records in the message. S3 test notifications (sent when the bucket
+# notification is first configured) carry no records and produce an empty list. Raises if the body
+# is not valid JSON
+def s3_records_from_sqs_message(message_in):
+    body = json.loads(message_in['body'])
+    return body.get('Records', [])
+
+
+# Build the response that tells the SQS trigger to delete every message except "failed_message_ids"
+def batch_item_failures(failed_message_ids):
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+    }
@@ -1 +1 @@
-from .ladle_sink import lambda_handler
+from .ladle_sink import lambda_handler, warm_up
@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import os
+
+from dart_lambdas.common.async_http_utils import create_http_session
+from dart_lambdas.common.async_s3_utils import create_async_s3_client
+from dart_lambdas.common.custom_logging import get_logger
+from dart_lambdas.common.deadline import NO_DEADLINE
+from dart_lambdas.common.metrics import create_metrics, NULL_METRICS
+from dart_lambdas.ladleSink import async_workers
+from dart_lambdas.ladleSink.config import get_config
+from dart_lambdas.ladleSink.journal import COPIED
+from dart_lambdas.ladleSink.ladle_sink import start_record, work_deadline_for, find_duplicated_document, \
+    archive_duplicate_document, falls_back_to_posting, add_configured_content_hash, finish_posting, retrieval_failure, \
+    submission_failure, move_failure, posted_and_moved, fail
+from dart_lambdas.ladleSink.workers import submits_by_url, post_presigned_url_and_metadata
+
+log = get_logger('ladleSink.async')
+
+
+# Process "records_list" with the async pipeline: the same fetch -> post -> move steps as
+# ladle_sink.process_record, run as coroutines on one event loop, so that a container can keep many records in flight
+# without a thread for each. Selected with PIPELINE_ENGINE=async (see ladle_sink.handle_records).
+#
+# Raw documents are read into memory before posting (aiohttp needs a sized body to send a Content-Length), so
+# ASYNC_MAX_CONCURRENT_RECORDS also bounds how many documents are held in memory at once. Steps shared with the
+# threaded pipeline that are rare or may block (pairing, lookups in the idempotency store and the journal, moves of
+# duplicates) run on threads
+#
+# @returns a list of (success: Boolean, message: String), one per record, in the same order as "records_list"
+async def handle_records(records_list, deadline=NO_DEADLINE):
+    limit = asyncio.Semaphore(get_config().async_max_concurrent_records)
+
+    async with create_async_s3_client() as s3_client, create_http_session() as http_session:
+        async def handle(record):
+            async with limit:
+                try:
+                    return await handle_record(s3_client, http_session, record, deadline)
+                except Exception as e:
+                    return False, f'Exception: {str(e)}'
+
+        return list(await asyncio.gather(*[handle(record) for record in records_list]))
+
+
+async def handle_record(s3_client, http_session, record, deadline=NO_DEADLINE):
+    metrics = create_metrics(Function=os.environ.get('AWS_LAMBDA_FUNCTION_NAME') or 'ladleSink')
+
+    success = False
+    try:
+        with metrics.time('Record'):
+            success, message = await process_record(s3_client, http_session, record, deadline, metrics)
+        return success, message
+    finally:
+        metrics.add('RecordFailures', 0 if success else 1)
+        metrics.emit()
+
+
+async def process_record(s3_client, http_session, record, deadline=NO_DEADLINE, metrics=NULL_METRICS):
+    config = get_config()
+
+    document, result = await asyncio.to_thread(start_record, record, deadline, metrics)
+    if result is not None:
+        return result
+
+    record, bucket, key, post_key = document.record, document.bucket, document.key, document.post_key
+    work_deadline = work_deadline_for(deadline)
+    # Documents submitted by URL are fetched by Ladle, so only their metadata is read here
+    by_url = submits_by_url(config.routes.endpoint(post_key))
+
+    async def fetch_metadata():
+        with metrics.time('FetchMetadata'):
+            return await async_workers.get_created_object_metadata(s3_client, record, bucket, work_deadline, metrics,
+                                                                   document.object_key)
+
+    async def fetch_raw():
+        with metrics.time('FetchRaw'):
+            return await async_workers.get_created_object(s3_client, record, bucket, work_deadline, metrics,
+                                                          document.object_key)
+
+    if by_url:
+        metadata_result, raw_doc_result = await fetch_metadata(), None
+    else:
+        metadata_result, raw_doc_result = await asyncio.gather(fetch_metadata(), fetch_raw())
+    get_success_metadata, key_metadata, metadata, get_err_metadata = metadata_result
+
+    if not get_success_metadata:
+        return retrieval_failure(key_metadata, bucket, get_err_metadata)
+
+    content_md5 = None
+    posted_md5 = None
+    if by_url:
+        # Copying is server-side, signing is local and the post is small, so the synchronous worker (with Ladle's
+        # limiter) runs on a thread
+        with metrics.time('Post'):
+            post_success, post_response = await asyncio.to_thread(
+                post_presigned_url_and_metadata, post_key, bucket, key, metadata, work_deadline, document.size)
+
+        if falls_back_to_posting(document, post_success, post_response, metrics):
+            by_url = False
+            raw_doc_result = await fetch_raw()
+
+    if not by_url:
+        get_success, key, raw_doc, get_err = raw_doc_result
+        if not get_success:
+            return retrieval_failure(key, bucket, get_err)
+
+        # The whole document is in memory, so its content MD5 is known before posting whatever its ETag is. The
+        # same content may have been uploaded under another key
+        content_md5 = hashlib.md5(raw_doc).hexdigest()
+        duplicated_doc_id = await asyncio.to_thread(find_duplicated_document, content_md5, metrics)
+        if duplicated_doc_id is not None:
+            return await asyncio.to_thread(archive_duplicate_document, record, document.object_key,
+                                           duplicated_doc_id, deadline, metrics)
+
+        metadata = add_configured_content_hash(metadata, content_md5)
+
+        # Post object to Ladle using correct key as filename
+        with metrics.time('Post'):
+            post_success, post_response = await async_workers.post_retrieved_object_and_metadata(
+                http_session, post_key, raw_doc, metadata, work_deadline)
+
+        posted_md5 = content_md5
+
+    if not post_success:
+        return submission_failure(document, post_response)
+
+    doc_id, final_key, final_key_metadata, result = await asyncio.to_thread(
+        finish_posting, document, post_response, content_md5, posted_md5, deadline)
+    if result is not None:
+        return result
+
+    # Move metadata and object from ingest bucket to processed bucket together: either both move or neither does
+    with metrics.time('Move'):
+        move_success, move_err = await async_workers.move_processed_objects(
+            s3_client,
+            [(key_metadata, final_key_metadata), (key, final_key, document.size)],
+            config.s3_bucket_in,
+            config.s3_bucket_processed,
+            lambda: document.journal.record(COPIED, doc_id),
+            document.journal.copy_tags(),
+        )
+
+    if not move_success:
+        return fail(move_failure(key, key_metadata, final_key, final_key_metadata, move_err))
+
+    return posted_and_moved(document, final_key)
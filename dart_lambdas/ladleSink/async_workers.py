@@ -0,0 +1,191 @@
+import asyncio
+import time
+
+from dart_lambdas.common import async_http_utils
+from dart_lambdas.common.async_s3_utils import copy_s3_object_async
+from dart_lambdas.common.s3_utils import byte_ranges
+from dart_lambdas.common.circuit_breaker import get_circuit_breaker
+from dart_lambdas.common.custom_logging import get_logger
+from dart_lambdas.common.deadline import NO_DEADLINE
+from dart_lambdas.common.http_utils import is_server_failure
+from dart_lambdas.common.metrics import NULL_METRICS, BYTES
+from dart_lambdas.common.retry import retry_async
+from dart_lambdas.ladleSink.workers import S3_GET_RETRY_POLICY, LADLE, CIRCUIT_OPEN_FAILURE, ObjectMoves, \
+    submission_arguments, on_get_retry, delete_objects_arguments, delete_objects_error
+from dart_lambdas.ladleSink.config import get_config
+from dart_lambdas.ladleSink.object_key import ObjectKey
+
+log = get_logger('ladleSink.async_workers')
+
+# Coroutine versions of the workers in workers.py, for the async pipeline. Each takes the aiobotocore client or
+# aiohttp session to use, since those belong to the event loop, and returns the same results as its counterpart
+
+
+async def get_created_object(s3_client, record_in, bucket_in, deadline=NO_DEADLINE, metrics=NULL_METRICS,
+                             object_key=None):
+    if object_key is None:
+        object_key = ObjectKey.from_record(record_in)
+    key = object_key.key
+
+    size = record_in['s3']['object'].get('size')
+    if size is not None and size >= get_config().ranged_get_threshold:
+        return await get_created_object_in_ranges(s3_client, record_in, bucket_in, size, deadline, metrics,
+                                                 object_key)
+
+    try:
+        get_response = await retry_async(s3_client.get_object, {'Bucket': bucket_in, 'Key': key}, policy=S3_GET_RETRY_POLICY,
+                                         deadline=deadline, on_retry=on_get_retry(metrics, 'FetchRawRetries', bucket_in, key))
+        async with get_response['Body'] as body:
+            raw_doc_out = await body.read()
+    except Exception as e:
+        return False, key, None, f'Exception: {str(e)}'  # Deliver what we can, send exception message
+
+    metrics.add('RawBytes', len(raw_doc_out), BYTES)
+    return True, key, raw_doc_out, None
+
+
+# Same as workers.open_created_object_in_ranges, but the ranges are fetched into a buffer: the async pipeline
+# holds whole documents in memory anyway. The buffer (a bytearray) is returned as is rather than copied, and the
+# first range that can't be fetched cancels the others
+async def get_created_object_in_ranges(s3_client, record_in, bucket_in, size, deadline=NO_DEADLINE, metrics=NULL_METRICS,
+                                       object_key=None):
+    config = get_config()
+    if object_key is None:
+        object_key = ObjectKey.from_record(record_in)
+    key = object_key.key
+    etag = record_in['s3']['object'].get('eTag')
+    on_retry = on_get_retry(metrics, 'FetchRawRetries', bucket_in, key)
+    raw_doc_out = bytearray(size)
+    slots = asyncio.Semaphore(config.ranged_get_concurrency)
+
+    async def get_range_once(start, end):
+        get_args = {'Bucket': bucket_in, 'Key': key, 'Range': f'bytes={start}-{end}'}
+        if etag:
+            get_args['IfMatch'] = etag
+        get_response = await s3_client.get_object(**get_args)
+        async with get_response['Body'] as body:
+            return await body.read()
+
+    async def get_range(start, end):
+        async with slots:
+            part = await retry_async(get_range_once, [start, end], policy=S3_GET_RETRY_POLICY, deadline=deadline,
+                                     on_retry=on_retry)
+        if len(part) != end - start + 1:
+            raise Exception(f'Range {start}-{end} produced {len(part)} bytes but {end - start + 1} were expected')
+        raw_doc_out[start:end + 1] = part
+
+    ranges = [asyncio.ensure_future(get_range(start, end)) for start, end in byte_ranges(size, config.ranged_get_part_size)]
+    try:
+        await asyncio.gather(*ranges)
+    except Exception as e:
+        for pending_range in ranges:
+            pending_range.cancel()
+        await asyncio.gather(*ranges, return_exceptions=True)
+        return False, key, None, f'Exception: {str(e)}'  # Deliver what we can, send exception message
+
+    metrics.add('RawBytes', size, BYTES)
+    metrics.add('RangedFetches', 1)
+    return True, key, raw_doc_out, None
+
+
+async def get_created_object_metadata(s3_client, record_in, bucket_in, deadline=NO_DEADLINE, metrics=NULL_METRICS,
+                                      object_key=None):
+    if object_key is None:
+        object_key = ObjectKey.from_record(record_in)
+    key_metadata = object_key.metadata_key
+
+    try:
+        get_response = await retry_async(s3_client.get_object, {'Bucket': bucket_in, 'Key': key_metadata}, policy=S3_GET_RETRY_POLICY,
+                                         deadline=deadline, on_retry=on_get_retry(metrics, 'FetchMetadataRetries', bucket_in, key_metadata))
+        async with get_response['Body'] as body:
+            metadata_bytes = await body.read()
+    except Exception as e:
+        return False, key_metadata, None, f'Exception: {str(e)}'  # Deliver what we can, send exception message
+
+    metrics.add('MetadataBytes', len(metadata_bytes), BYTES)
+    return True, key_metadata, metadata_bytes.decode('utf-8'), None
+
+
+# Posts go through Ladle's circuit breaker like the synchronous ones, but not its concurrency limiter, whose waits
+# would block the event loop; ASYNC_MAX_CONCURRENT_RECORDS bounds them instead
+async def post_retrieved_object_and_metadata(http_session, key_in, raw_doc_in, metadata_in, deadline=NO_DEADLINE):
+    breaker = get_circuit_breaker(LADLE)
+    if not breaker.allow():
+        return [False, CIRCUIT_OPEN_FAILURE]
+
+    start = time.monotonic()
+    healthy = False
+    try:
+        post_success, post_response = await async_http_utils.try_post(
+                http_session,
+                **submission_arguments(key_in, raw_doc_in, metadata_in),
+                post_data=None,
+                sleep_time=0,
+                numtimes=1,
+                deadline=deadline,
+            )
+        healthy = post_success or not is_server_failure(post_response)
+        return post_success, post_response
+    finally:
+        breaker.record(healthy, time.monotonic() - start, len(raw_doc_in))
+
+
+async def move_processed_object(s3_client, input_key, input_bucket, output_key, output_bucket):
+    return await move_processed_objects(s3_client, [(input_key, output_key)], input_bucket, output_bucket)
+
+
+# Same as workers.move_processed_objects: copy every object concurrently, then remove all the sources with one
+# request (calling "on_copied", if given, in between), undoing the copies if either step fails. "tags" replaces
+# the tags of some copies, as for workers.move_processed_objects
+async def move_processed_objects(s3_client, moves, input_bucket, output_bucket, on_copied=None, tags=None):
+    moves = ObjectMoves(moves, input_bucket, output_bucket, tags)
+
+    async def copy(move):
+        input_key, output_key, size = move
+        try:
+            await copy_s3_object_async(s3_client, input_key, input_bucket, output_key, output_bucket, size,
+                                       moves.tags_for(input_key))
+            return None
+        except Exception as e:
+            return moves.copy_error(input_key, output_key, e)
+
+    copy_errors = await asyncio.gather(*[copy(move) for move in moves.moves])
+
+    if moves.any_failed(copy_errors):
+        undo_err = await _delete_objects(s3_client, output_bucket, moves.copied_keys(copy_errors))
+        return moves.copy_failure(copy_errors, undo_err)
+
+    if on_copied is not None:
+        await asyncio.to_thread(on_copied)
+
+    delete_err = await _delete_objects(s3_client, input_bucket, moves.input_keys)
+
+    if delete_err is not None:
+        moves.log_rollback(delete_err)
+        # Some sources may be gone already: put those back before removing the copies
+        restore_errors = []
+        for input_key, output_key, size in moves.moves:
+            try:
+                await s3_client.head_object(Bucket=input_bucket, Key=input_key)
+            except Exception:
+                try:
+                    await copy_s3_object_async(s3_client, output_key, output_bucket, input_key, input_bucket, size)
+                except Exception as e:
+                    restore_errors.append(moves.restore_error(input_key, e))
+
+        undo_err = None if len(restore_errors) > 0 else await _delete_objects(s3_client, output_bucket, moves.output_keys)
+        return moves.removal_failure(delete_err, restore_errors, undo_err)
+
+    return moves.success()
+
+
+async def _delete_objects(s3_client, bucket, keys):
+    if len(keys) == 0:
+        return None
+
+    try:
+        delete_response = await s3_client.delete_objects(**delete_objects_arguments(bucket, keys))
+    except Exception as e:
+        return str(e)
+
+    return delete_objects_error(delete_response)
@@ -0,0 +1,243 @@
+import os
+import threading
+
+from dart_lambdas.common import circuit_breaker, concurrency_limit, document_buffer, http_utils, idempotency, s3_utils
+from dart_lambdas.common.secrets import resolve_secret
+from dart_lambdas.ladleSink.object_key import get_submission_routes
+
+# Engines records can be processed with (see PIPELINE_ENGINE and ladle_sink.handle_records)
+THREADS_ENGINE = 'threads'
+ASYNC_ENGINE = 'async'
+
+DEFAULT_MAX_CONCURRENT_RECORDS = 8
+DEFAULT_ASYNC_MAX_CONCURRENT_RECORDS = 64
+# Seconds kept back from the Lambda timeout to return a response
+DEFAULT_DEADLINE_RESERVE_SECONDS = 1
+# Seconds a record needs to move its objects to the processed bucket; no record starts a move without them
+DEFAULT_MOVE_TIME_BUDGET_SECONDS = 5
+# Seconds a document's metadata must be uploaded after it for the metadata's event to process them (see pairing)
+DEFAULT_PAIRING_WINDOW_SECONDS = 1
+# Seconds Ladle has to fetch a document submitted by URL (see URL_SUBMISSION_ENDPOINT)
+DEFAULT_PRESIGNED_URL_EXPIRY_SECONDS = 3600
+# Raw documents of at least this many bytes are fetched in ranges of RANGED_GET_PART_SIZE_BYTES, RANGED_GET_CONCURRENCY
+# at a time (see workers.open_created_object)
+DEFAULT_RANGED_GET_THRESHOLD_BYTES = 64 * 1024 ** 2
+DEFAULT_RANGED_GET_PART_SIZE_BYTES = 16 * 1024 ** 2
+DEFAULT_RANGED_GET_CONCURRENCY = 8
+# Tries a post to Ladle gets, and milliseconds between them (see workers.post_retrieved_object_and_metadata)
+DEFAULT_LADLE_POST_ATTEMPTS = 3
+DEFAULT_LADLE_POST_RETRY_PAUSE_MS = 250
+# Documents posted to BATCH_SUBMISSION_ENDPOINT together, at most, and how long a batch waits to fill up (see
+# workers.create_submitter); batching is off unless SUBMISSION_BATCH_SIZE is more than 1
+DEFAULT_SUBMISSION_BATCH_SIZE = 1
+DEFAULT_SUBMISSION_BATCH_MAX_BYTES = 32 * 1024 ** 2
+DEFAULT_SUBMISSION_BATCH_LINGER_MS = 50
+# Smallest timeout, in seconds, that leaves a request any time at all
+MIN_TIMEOUT_SECONDS = 0.001
+
+
+# Raised when the lambda's configuration is missing or invalid; it names every problem found
+class ConfigurationError(Exception):
+    pass
+
+
+# ladleSink's configuration, read from the environment and checked once (see get_config) rather than by every
+# record. Instances can't be changed.
+#
+# BAUTH_USERNAME and BAUTH_PASSWORD may reference secrets instead of holding them (see secrets.resolve_secret),
+# e.g. BAUTH_PASSWORD=ssm:/dart/ladle/password
+#
+# The settings of the shared clients and guards in common (the HTTP_*, S3_*, CIRCUIT_BREAKER_*, CONCURRENCY_LIMIT_*,
+# IDEMPOTENCY_* and DOCUMENT_BUFFER_* variables) are checked here too, and handed to them by get_config
+class LadleSinkConfig:
+    __slots__ = ('s3_bucket_in', 's3_bucket_processed', 'dart_url', 'submission_port', 'routes',
+                 'batch_submission_endpoint', 'url_submission_endpoint', 'presigned_url_expiry', 'basic_auth',
+                 'pipeline_engine', 'max_concurrent_records', 'async_max_concurrent_records', 'deadline_reserve',
+                 'move_time_budget', 'pairing_window', 'ranged_get_threshold', 'ranged_get_part_size',
+                 'ranged_get_concurrency', 'ladle_post_attempts', 'ladle_post_retry_pause', 'submission_batch_size',
+                 'submission_batch_max_bytes', 'submission_batch_linger', 'content_hash_field', 'journal',
+                 'http_max_pool_connections', 'http_connect_retries', 'http_connect_timeout', 'http_read_timeout',
+                 's3_max_pool_connections', 's3_connect_timeout', 's3_read_timeout', 'circuit_breaker_failure_rate',
+                 'circuit_breaker_min_calls', 'circuit_breaker_window', 'circuit_breaker_open_duration',
+                 'circuit_breaker_slow_call', 'concurrency_limit_min', 'concurrency_limit_max',
+                 'concurrency_limit_slow_call', 'idempotency_cache_size', 'idempotency_ttl', 'idempotency_bucket',
+                 'idempotency_prefix', 'document_buffer_memory_limit', 'document_buffer_directory')
+
+    def __init__(self, **settings):
+        for name in self.__slots__:
+            object.__setattr__(self, name, settings.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} can not be changed')
+
+    # Read the configuration from "environ"
+    #
+    # @raises ConfigurationError listing everything that is missing or invalid
+    @staticmethod
+    def from_environ(environ):
+        errors = []
+
+        def required(name):
+            value = environ.get(name)
+            if not value:
+                errors.append(f'{name} is not set')
+            return value
+
+        def number(name, parse, default, minimum, maximum=None):
+            if not environ.get(name):
+                return default
+            try:
+                value = parse(environ.get(name))
+            except ValueError:
+                errors.append(f'{name} must be a number: {environ.get(name)}')
+                return default
+            if value < minimum:
+                errors.append(f'{name} must be at least {minimum}: {value}')
+            if maximum is not None and value > maximum:
+                errors.append(f'{name} must be at most {maximum}: {value}')
+            return value
+
+        def endpoint(name, value, optional=True):
+            if value is None and optional:
+                return value
+            if not isinstance(value, str):
+                errors.append(f'{name} must be a string: {value!r}')
+            elif not value.startswith('/'):
+                errors.append(f'{name} must start with "/": {value}')
+            return value
+
+        submission_port = required('SUBMISSION_PORT')
+        if submission_port and not (submission_port.isdigit() and 0 < int(submission_port) < 65536):
+            errors.append(f'SUBMISSION_PORT must be a port number: {submission_port}')
+
+        try:
+            routes = get_submission_routes(environ)
+        except ValueError as e:
+            errors.append(f'SUBMISSION_ROUTES is invalid: {e}')
+            routes = None
+        if routes is not None:
+            endpoint('SUBMISSION_ENDPOINT', required('SUBMISSION_ENDPOINT'))
+            for extension, routed_endpoint in routes.endpoints.items():
+                endpoint(f'Endpoint for "{extension}" documents', routed_endpoint, optional=False)
+
+        pipeline_engine = environ.get('PIPELINE_ENGINE') or THREADS_ENGINE
+        if pipeline_engine not in (THREADS_ENGINE, ASYNC_ENGINE):
+            errors.append(f'PIPELINE_ENGINE must be "{THREADS_ENGINE}" or "{ASYNC_ENGINE}": {pipeline_engine}')
+
+        try:
+            basic_auth = (resolve_secret(environ.get('BAUTH_USERNAME')), resolve_secret(environ.get('BAUTH_PASSWORD')))
+        except Exception as e:
+            errors.append(f'Unable to resolve basic auth credentials: {e}')
+            basic_auth = (None, None)
+        if (basic_auth[0] is None) != (basic_auth[1] is None):
+            errors.append('BAUTH_USERNAME and BAUTH_PASSWORD must be set together')
+
+        concurrency_limit_min = number('CONCURRENCY_LIMIT_MIN', int, concurrency_limit.DEFAULT_CONCURRENCY_LIMIT_MIN, 1)
+        concurrency_limit_max = number('CONCURRENCY_LIMIT_MAX', int, concurrency_limit.DEFAULT_CONCURRENCY_LIMIT_MAX, 1)
+        if concurrency_limit_max < concurrency_limit_min:
+            errors.append(f'CONCURRENCY_LIMIT_MAX must be at least CONCURRENCY_LIMIT_MIN: {concurrency_limit_max}')
+
+        config = LadleSinkConfig(
+            s3_bucket_in=required('S3_BUCKET_IN'),
+            s3_bucket_processed=environ.get('S3_BUCKET_PROCESSED') or None,
+            dart_url=required('DART_URL'),
+            submission_port=submission_port,
+            routes=routes,
+            batch_submission_endpoint=endpoint('BATCH_SUBMISSION_ENDPOINT', environ.get('BATCH_SUBMISSION_ENDPOINT') or None),
+            url_submission_endpoint=endpoint('URL_SUBMISSION_ENDPOINT', environ.get('URL_SUBMISSION_ENDPOINT') or None),
+            presigned_url_expiry=number('PRESIGNED_URL_EXPIRY_SECONDS', int, DEFAULT_PRESIGNED_URL_EXPIRY_SECONDS, 1),
+            basic_auth=basic_auth,
+            pipeline_engine=pipeline_engine,
+            max_concurrent_records=number('MAX_CONCURRENT_RECORDS', int, DEFAULT_MAX_CONCURRENT_RECORDS, 1),
+            async_max_concurrent_records=number('ASYNC_MAX_CONCURRENT_RECORDS', int, DEFAULT_ASYNC_MAX_CONCURRENT_RECORDS, 1),
+            deadline_reserve=number('DEADLINE_RESERVE_SECONDS', float, DEFAULT_DEADLINE_RESERVE_SECONDS, 0),
+            move_time_budget=number('MOVE_TIME_BUDGET_SECONDS', float, DEFAULT_MOVE_TIME_BUDGET_SECONDS, 0),
+            pairing_window=number('PAIRING_WINDOW_SECONDS', float, DEFAULT_PAIRING_WINDOW_SECONDS, 0),
+            ranged_get_threshold=number('RANGED_GET_THRESHOLD_BYTES', int, DEFAULT_RANGED_GET_THRESHOLD_BYTES, 1),
+            ranged_get_part_size=number('RANGED_GET_PART_SIZE_BYTES', int, DEFAULT_RANGED_GET_PART_SIZE_BYTES, 1),
+            ranged_get_concurrency=number('RANGED_GET_CONCURRENCY', int, DEFAULT_RANGED_GET_CONCURRENCY, 1),
+            ladle_post_attempts=number('LADLE_POST_ATTEMPTS', int, DEFAULT_LADLE_POST_ATTEMPTS, 1),
+            ladle_post_retry_pause=number('LADLE_POST_RETRY_PAUSE_MS', float, DEFAULT_LADLE_POST_RETRY_PAUSE_MS, 0) / 1000,
+            submission_batch_size=number('SUBMISSION_BATCH_SIZE', int, DEFAULT_SUBMISSION_BATCH_SIZE, 1),
+            submission_batch_max_bytes=number('SUBMISSION_BATCH_MAX_BYTES', int, DEFAULT_SUBMISSION_BATCH_MAX_BYTES, 1),
+            submission_batch_linger=number('SUBMISSION_BATCH_LINGER_MS', float, DEFAULT_SUBMISSION_BATCH_LINGER_MS, 0) / 1000,
+            content_hash_field=environ.get('CONTENT_HASH_FIELD') or None,
+            journal=environ.get('JOURNAL') == 'ON',
+            http_max_pool_connections=number('HTTP_MAX_POOL_CONNECTIONS', int, http_utils.DEFAULT_HTTP_MAX_POOL_CONNECTIONS, 1),
+            http_connect_retries=number('HTTP_CONNECT_RETRIES', int, http_utils.DEFAULT_HTTP_CONNECT_RETRIES, 0),
+            http_connect_timeout=number('HTTP_CONNECT_TIMEOUT', float, http_utils.DEFAULT_HTTP_CONNECT_TIMEOUT, MIN_TIMEOUT_SECONDS),
+            http_read_timeout=number('HTTP_READ_TIMEOUT', float, http_utils.DEFAULT_HTTP_READ_TIMEOUT, MIN_TIMEOUT_SECONDS),
+            s3_max_pool_connections=number('S3_MAX_POOL_CONNECTIONS', int, s3_utils.DEFAULT_S3_MAX_POOL_CONNECTIONS, 1),
+            s3_connect_timeout=number('S3_CONNECT_TIMEOUT', float, s3_utils.DEFAULT_S3_CONNECT_TIMEOUT, MIN_TIMEOUT_SECONDS),
+            s3_read_timeout=number('S3_READ_TIMEOUT', float, s3_utils.DEFAULT_S3_READ_TIMEOUT, MIN_TIMEOUT_SECONDS),
+            circuit_breaker_failure_rate=number('CIRCUIT_BREAKER_FAILURE_RATE', float,
+                                                circuit_breaker.DEFAULT_CIRCUIT_BREAKER_FAILURE_RATE, 0, 1),
+            circuit_breaker_min_calls=number('CIRCUIT_BREAKER_MIN_CALLS', int, circuit_breaker.DEFAULT_CIRCUIT_BREAKER_MIN_CALLS, 1),
+            circuit_breaker_window=number('CIRCUIT_BREAKER_WINDOW_SECONDS', float,
+                                          circuit_breaker.DEFAULT_CIRCUIT_BREAKER_WINDOW_SECONDS, 0),
+            circuit_breaker_open_duration=number('CIRCUIT_BREAKER_OPEN_SECONDS', float,
+                                                 circuit_breaker.DEFAULT_CIRCUIT_BREAKER_OPEN_SECONDS, 0),
+            circuit_breaker_slow_call=number('CIRCUIT_BREAKER_SLOW_CALL_SECONDS', float,
+                                             circuit_breaker.DEFAULT_CIRCUIT_BREAKER_SLOW_CALL_SECONDS, 0),
+            concurrency_limit_min=concurrency_limit_min,
+            concurrency_limit_max=concurrency_limit_max,
+            concurrency_limit_slow_call=number('CONCURRENCY_LIMIT_SLOW_CALL_SECONDS', float,
+                                               concurrency_limit.DEFAULT_CONCURRENCY_LIMIT_SLOW_CALL_SECONDS, 0),
+            idempotency_cache_size=number('IDEMPOTENCY_CACHE_SIZE', int, idempotency.DEFAULT_IDEMPOTENCY_CACHE_SIZE, 1),
+            idempotency_ttl=number('IDEMPOTENCY_TTL_SECONDS', float, idempotency.DEFAULT_IDEMPOTENCY_TTL_SECONDS, 0),
+            idempotency_bucket=environ.get('IDEMPOTENCY_BUCKET') or None,
+            idempotency_prefix=environ.get('IDEMPOTENCY_PREFIX') or idempotency.DEFAULT_IDEMPOTENCY_PREFIX,
+            document_buffer_memory_limit=number('DOCUMENT_BUFFER_MEMORY_BYTES', int,
+                                                document_buffer.DEFAULT_DOCUMENT_BUFFER_MEMORY_BYTES, 0),
+            document_buffer_directory=environ.get('DOCUMENT_BUFFER_DIR') or None,
+        )
+
+        if len(errors) > 0:
+            raise ConfigurationError('Invalid ladleSink configuration: ' + '; '.join(errors))
+
+        return config
+
+    # Hand the settings of the shared clients and guards to the common modules that build them
+    def configure_common(self):
+        http_utils.configure_http(self.http_max_pool_connections, self.http_connect_retries, self.http_connect_timeout,
+                                  self.http_read_timeout)
+        s3_utils.configure_s3_client(self.s3_max_pool_connections, self.s3_connect_timeout, self.s3_read_timeout)
+        circuit_breaker.configure_circuit_breakers(self.circuit_breaker_failure_rate, self.circuit_breaker_min_calls,
+                                                   self.circuit_breaker_window, self.circuit_breaker_open_duration,
+                                                   self.circuit_breaker_slow_call)
+        concurrency_limit.configure_concurrency_limiters(self.concurrency_limit_min, self.concurrency_limit_max,
+                                                         self.concurrency_limit_slow_call)
+        idempotency.configure_idempotency_store(self.idempotency_cache_size, self.idempotency_ttl,
+                                                self.idempotency_bucket, self.idempotency_prefix)
+        document_buffer.configure_document_buffers(self.document_buffer_memory_limit, self.document_buffer_directory)
+
+
+_config = None
+_config_lock = threading.Lock()
+
+
+# Get the configuration shared by every worker in this container. It is read on first use (the cold start) and
+# kept across warm invocations, so secrets are only fetched once. The shared clients and guards in common are
+# configured with it before it is returned
+#
+# @raises ConfigurationError if the configuration is missing or invalid; nothing is cached then, so a fixed
+# configuration is picked up by the next invocation
+def get_config():
+    global _config
+
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                config = LadleSinkConfig.from_environ(os.environ)
+                config.configure_common()
+                _config = config
+
+    return _config
+
+
+# Drop the shared configuration so the next call to get_config reads it again (e.g. after changing the environment)
+def reset_config():
+    global _config
+
+    with _config_lock:
+        _config = None
@@ -0,0 +1,89 @@
+import botocore.exceptions
+
+from dart_lambdas.common.custom_logging import get_logger
+from dart_lambdas.common.s3_utils import get_s3_client
+from dart_lambdas.ladleSink.config import get_config
+
+log = get_logger('ladleSink.journal')
+
+# Steps of a document's processing that are worth not repeating, in order (fetching has no side effects)
+POSTED = 'posted'
+COPIED = 'copied'
+STEPS = (POSTED, COPIED)
+
+STEP_TAG = 'ladle-sink-step'
+DOCUMENT_ID_TAG = 'ladle-sink-document-id'
+
+
+# A document's progress through the pipeline, kept as tags on its raw object so that a redelivered event resumes at
+# the first step that isn't done rather than starting over:
+#   - no step: nothing worth keeping has been done; fetch and post the document
+#   - POSTED: Ladle accepted the document as "doc_id"; it only needs moving
+#   - COPIED: the document and its metadata were copied to the processed bucket as well; only the sources need
+#     removing
+# The journal goes away with the raw object at the end of the move; its copy gets the object's other tags only (see
+# copy_tags). Tags are only read and written with JOURNAL=ON; a journal that can't be read or written, whether S3
+# refuses or can't be reached, is worked without, since that only means a redelivery starts over
+class Journal:
+    def __init__(self, bucket, key, tags):
+        self.bucket = bucket
+        self.key = key
+        self._tags = tags
+        self.doc_id = tags.get(DOCUMENT_ID_TAG)
+        # A step is only any use with the document id it was done for
+        self.step = tags.get(STEP_TAG) if tags.get(STEP_TAG) in STEPS and self.doc_id else None
+
+    # Read the journal of raw object "key" in "bucket"
+    @staticmethod
+    def read(bucket, key):
+        try:
+            tagging = get_s3_client().get_object_tagging(Bucket=bucket, Key=key)
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            log.warning('unable to read journal of %s: %s', key, e)
+            return NO_JOURNAL
+
+        return Journal(bucket, key, {tag['Key']: tag['Value'] for tag in tagging.get('TagSet', [])})
+
+    # Record that "step" is done, for document "doc_id". The object's other tags are kept
+    def record(self, step, doc_id):
+        self._tags = {**self._tags, STEP_TAG: step, DOCUMENT_ID_TAG: doc_id}
+        try:
+            get_s3_client().put_object_tagging(
+                Bucket=self.bucket,
+                Key=self.key,
+                Tagging={'TagSet': [{'Key': name, 'Value': value} for name, value in self._tags.items()]},
+            )
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            log.warning('unable to record step %s of %s in its journal: %s', step, self.key, e)
+            return
+
+        self.step = step
+        self.doc_id = doc_id
+
+    # Tags to give the copy of the raw object when it is moved, for move_processed_objects: its tags other than the
+    # journal's, which are the pipeline's business and not the processed document's
+    def copy_tags(self):
+        return {self.key: {name: value for name, value in self._tags.items() if name not in (STEP_TAG, DOCUMENT_ID_TAG)}}
+
+
+# Journal that is never read or written: every document starts from the beginning
+class NullJournal:
+    step = None
+    doc_id = None
+
+    def record(self, step, doc_id):
+        pass
+
+    def copy_tags(self):
+        return None
+
+
+NO_JOURNAL = NullJournal()
+
+
+# The journal of the raw document in "record", whose parsed key is "object_key", if JOURNAL is ON; otherwise NO_JOURNAL
+def open_journal(record, object_key):
+    if not get_config().journal:
+        return NO_JOURNAL
+
+    return Journal.read(record['s3']['bucket']['name'], object_key.key)
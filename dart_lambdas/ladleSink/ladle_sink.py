@@ -1,17 +1,62 @@
+import importlib
 import json
 import os
 from json import JSONDecodeError
 
-from dart_lambdas.common.custom_logging import LOG, log_environment
-from dart_lambdas.ladleSink.workers import get_created_object, move_processed_object, get_key_from_ladle_doc_id, \
-    get_created_object_metadata, post_retrieved_object_and_metadata
+from dart_lambdas.common.batch import run_batch, run_concurrently
+from dart_lambdas.common.custom_logging import get_logger, log_environment, set_log_context
+from dart_lambdas.common.deadline import Deadline, NO_DEADLINE
+from dart_lambdas.common.http_utils import get_http_session
+from dart_lambdas.common.idempotency import get_idempotency_store, idempotency_key, content_hash_key
+from dart_lambdas.common.metrics import create_metrics, NULL_METRICS
+from dart_lambdas.common.s3_utils import get_s3_client
+from dart_lambdas.common.sqs_utils import is_sqs_event, s3_records_from_sqs_message, batch_item_failures
+from dart_lambdas.ladleSink.workers import open_created_object, move_processed_objects, get_ladle_doc_id, \
+    get_key_for_doc_id, get_metadata_key_for_doc_id, get_created_object_metadata, post_retrieved_object_and_metadata, \
+    add_content_hash_to_metadata, create_submitter, submits_by_url, post_presigned_url_and_metadata, \
+    is_url_submission_unsupported, remove_moved_objects
+from dart_lambdas.ladleSink.config import get_config, ConfigurationError, ASYNC_ENGINE
+from dart_lambdas.ladleSink.journal import open_journal, NO_JOURNAL, POSTED, COPIED
+from dart_lambdas.ladleSink.object_key import ObjectKey
+from dart_lambdas.ladleSink.pairing import pair_record, is_awaiting_metadata, MetadataNotUploadedError
+
+log = get_logger('ladleSink')
+
+# Prefix in the processed bucket under which documents with the same content as one already submitted are archived
+DUPLICATES_PREFIX = 'duplicates/'
 
 
 def lambda_handler(event, context):
+    set_log_context(aws_request_id=getattr(context, 'aws_request_id', None))
+
     # Debugging
     log_environment(event)
 
-    success, message = handle_records(event['Records'])
+    # Fail the whole invocation up front if the lambda is misconfigured, rather than every record at posting time
+    try:
+        config = get_config()
+    except ConfigurationError as e:
+        log.error('%s', e)
+        raise
+
+    deadline = Deadline.from_lambda_context(context, config.deadline_reserve)
+
+    if is_sqs_event(event['Records']):
+        return handle_sqs_messages(event['Records'], deadline)
+
+    results = handle_records(event['Records'], deadline)
+
+    # S3 invokes the lambda asynchronously, and Lambda only retries an asynchronous invocation that raises. A raw
+    # document whose metadata is still being uploaded must be retried, since its metadata's event may leave it to its
+    # own event (see pairing), so it raises. Records of the event that did succeed find nothing left to do on retry
+    awaiting_metadata = [message for success, message in results if not success and is_awaiting_metadata(message)]
+    if len(awaiting_metadata) > 0:
+        raise MetadataNotUploadedError('; '.join(awaiting_metadata))
+
+    success = all(record_success for record_success, _ in results)
+    messages = [record_message for _, record_message in results]
+    # Keep the single-record response identical to what it was before batching
+    message = messages[0] if len(messages) == 1 else messages
 
     if success:
         return {
@@ -25,88 +70,542 @@ def lambda_handler(event, context):
         }
 
 
-def handle_records(records_list):
-    # Fetch relevant environment variables
-    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
-    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
-    DART_URL = os.environ.get('DART_URL')
-    SUBMISSION_PORT = os.environ.get('SUBMISSION_PORT')
-    SUBMISSION_ENDPOINT = os.environ.get('SUBMISSION_ENDPOINT')
+# Do what every cold start needs before its first record, during the Lambda init phase rather than the first
+# invocation: read the configuration (and its secrets), build the shared S3 client and HTTP connection pool with it
+# and, with PIPELINE_ENGINE=async, import the async engine. Called by lambda_function.py when it is imported (see
+# scripts/deploy.sh). A misconfiguration is left for lambda_handler to report
+def warm_up():
+    try:
+        config = get_config()
+    except ConfigurationError as e:
+        log.warning('not warming up: %s', e)
+        return
+
+    get_s3_client()
+    get_http_session()
+
+    if config.pipeline_engine == ASYNC_ENGINE:
+        try:
+            importlib.import_module('dart_lambdas.ladleSink.async_ladle_sink')
+        except ImportError:
+            pass  # handle_records falls back to threads, and says so
+
+
+# Run the fetch -> post -> move pipeline for every record in the event, at most MAX_CONCURRENT_RECORDS at a time
+#
+# Records that can't be finished by "deadline" fail without starting the step they don't have time for, so they
+# can be retried. With PIPELINE_ENGINE=async the records are processed by coroutines instead of threads (see
+# async_ladle_sink); if its dependencies aren't installed the threaded engine is used.
+#
+# @returns a list of (success: Boolean, message: String), one per record, in the same order as "records_list"
+def handle_records(records_list, deadline=NO_DEADLINE):
+    config = get_config()
+    if config.pipeline_engine == ASYNC_ENGINE:
+        try:
+            # Imported here so that only containers running the async engine need aiobotocore and aiohttp, and pay
+            # for importing them and asyncio at cold start
+            import asyncio
+            from dart_lambdas.ladleSink import async_ladle_sink
+        except ImportError as e:
+            log.warning('async engine unavailable, processing records with threads: %s', e)
+        else:
+            return asyncio.run(async_ladle_sink.handle_records(records_list, deadline))
+
+    max_workers = config.max_concurrent_records
+    # Documents fetched at about the same time are posted to Ladle together, if batching is configured
+    submitter = create_submitter() if len(records_list) > 1 else None
+
+    return run_batch(lambda record: handle_record(record, deadline, submitter), records_list, max_workers)
 
-    for record in records_list:
-        bucket = record['s3']['bucket']['name']
-        key = record['s3']['object']['key']
-        if key.endswith( ".meta" ):
-            return succeed( f"metadata file ({key}): no need to pass to ladle" )
-        if not key.endswith( ".raw"):
-            LOG( f"not a raw document: {key} does not end with '.raw' extension" )
-            return succeed( f"not a raw document: {key} does not end with '.raw' extension" )
-        if len(key.split(".")) < 3:
-            LOG( f"raw document is missing extension: {key}" )
-            return fail( f"raw document is missing extension: {key}" )
 
-        # Make sure request is coming from correct bucket (should be impossible not to)
-        if bucket != S3_BUCKET_IN:
-            return fail(f'Create-Object event did not come from {S3_BUCKET_IN}')
+# Process the S3 events carried by a batch of SQS messages
+#
+# @returns a partial batch response listing only the messages with at least one failed record, so that
+# SQS redelivers those and deletes the rest (the trigger must have ReportBatchItemFailures enabled)
+def handle_sqs_messages(messages_list, deadline=NO_DEADLINE):
+    failed_message_ids = []
+    message_ids = []
+    records_list = []
 
-        LOG(f'GETTING METADATA OBJECT FROM {S3_BUCKET_IN}')
+    for message in messages_list:
+        message_id = message['messageId']
+        try:
+            message_records = s3_records_from_sqs_message(message)
+        except (JSONDecodeError, KeyError, TypeError, AttributeError) as e:
+            fail(f'Unable to read S3 event from SQS message {message_id}: {str(e)}')
+            failed_message_ids.append(message_id)
+            continue
 
-        # Get metadata for object referenced in event record
-        get_success_metadata, key_metadata, metadata, get_err_metadata = get_created_object_metadata(record, bucket)
+        for record in message_records:
+            message_ids.append(message_id)
+            records_list.append(record)
 
-        if not get_success_metadata:
-            return fail(f'Unable to retrieve {key_metadata} from {bucket}: {get_err_metadata}')
+    results = handle_records(records_list, deadline)
+
+    for message_id, (success, _) in zip(message_ids, results):
+        if not success and message_id not in failed_message_ids:
+            failed_message_ids.append(message_id)
+
+    return batch_item_failures(failed_message_ids)
+
+
+# Process one record, timing each stage of the pipeline and emitting the results as metrics (if METRICS is ON)
+def handle_record(record, deadline=NO_DEADLINE, submitter=None):
+    metrics = create_metrics(Function=os.environ.get('AWS_LAMBDA_FUNCTION_NAME') or 'ladleSink')
+
+    success = False
+    try:
+        with metrics.time('Record'):
+            success, message = process_record(record, deadline, metrics, submitter)
+        return success, message
+    finally:
+        metrics.add('RecordFailures', 0 if success else 1)
+        metrics.emit()
+
+
+# Fetch the document in "record" and its metadata, post them to Ladle (with "submitter", if given) and move them
+# to the processed bucket
+def process_record(record, deadline=NO_DEADLINE, metrics=NULL_METRICS, submitter=None):
+    config = get_config()
+
+    document, result = start_record(record, deadline, metrics)
+    if result is not None:
+        return result
+
+    record, bucket, key, post_key = document.record, document.bucket, document.key, document.post_key
+    work_deadline = work_deadline_for(deadline)
+    # Documents submitted by URL are fetched by Ladle, so only their metadata is read here. Those being batched
+    # with "submitter" are posted as usual
+    by_url = submitter is None and submits_by_url(config.routes.endpoint(post_key))
+
+    log.debug('getting metadata and raw objects from %s', bucket, key=key)
+
+    # Get metadata for object referenced in event record and open the object itself; neither depends on the other.
+    # (The raw document's body is read while posting, so FetchRaw only times opening it)
+    def fetch_metadata():
+        with metrics.time('FetchMetadata'):
+            return get_created_object_metadata(record, bucket, work_deadline, metrics, document.object_key)
+
+    def fetch_raw():
+        with metrics.time('FetchRaw'):
+            return open_created_object(record, bucket, work_deadline, metrics, document.object_key)
+
+    if by_url:
+        metadata_result, raw_doc_result = fetch_metadata(), None
+    else:
+        metadata_result, raw_doc_result = run_concurrently(fetch_metadata, fetch_raw)
+    get_success_metadata, key_metadata, metadata, get_err_metadata = metadata_result
 
-        # Get object referenced in event record
-        get_success, key, raw_doc, get_err = get_created_object(record, bucket)
+    if not get_success_metadata:
+        if raw_doc_result is not None and raw_doc_result[0]:
+            raw_doc_result[2].close()
+        return retrieval_failure(key_metadata, bucket, get_err_metadata)
 
+    content_md5 = None
+    posted_md5 = None
+    if by_url:
+        log.debug('posting url of file to ladle: %s ---> %s:%s%s', post_key, config.dart_url, config.submission_port, config.url_submission_endpoint, key=key)
+
+        with metrics.time('Post'):
+            post_success, post_response = post_presigned_url_and_metadata(post_key, bucket, key, metadata, work_deadline,
+                                                                          document.size)
+
+        if falls_back_to_posting(document, post_success, post_response, metrics):
+            by_url = False
+            raw_doc_result = fetch_raw()
+
+    if not by_url:
+        get_success, key, raw_doc, get_err = raw_doc_result
         if not get_success:
-            return fail(f'Unable to retrieve {key} from {bucket}: {get_err}')
+            return retrieval_failure(key, bucket, get_err)
+
+        # The same content may have been uploaded under another key
+        content_md5 = raw_doc.content_md5
+        duplicated_doc_id = find_duplicated_document(content_md5, metrics)
+        if duplicated_doc_id is not None:
+            raw_doc.close()
+            return archive_duplicate_document(record, document.object_key, duplicated_doc_id, deadline, metrics)
 
-        post_key = ".".join(key.split(".")[0:-1])
+        metadata = add_configured_content_hash(metadata, content_md5)
 
-        LOG(f'POSTING FILE TO LADLE: {post_key} ---> {DART_URL}:{SUBMISSION_PORT}{SUBMISSION_ENDPOINT}')
+        log.debug('posting file to ladle: %s ---> %s:%s%s', post_key, config.dart_url, config.submission_port, config.routes.endpoint(post_key), key=key)
 
         # Post object to Ladle using correct key as filename
-        post_success, post_response = post_retrieved_object_and_metadata(post_key, raw_doc, metadata)
+        try:
+            with metrics.time('Post'):
+                post = post_retrieved_object_and_metadata if submitter is None else submitter.post
+                post_success, post_response = post(post_key, raw_doc, metadata, work_deadline)
+        finally:
+            raw_doc.close()
+
+        posted_md5 = raw_doc.md5() if raw_doc.complete else None
+
+    if not post_success:
+        return submission_failure(document, post_response)
+
+    doc_id, final_key, final_key_metadata, result = finish_posting(document, post_response, content_md5, posted_md5,
+                                                                   deadline)
+    if result is not None:
+        return result
+
+    move_success, move_err = move_document(record, key, key_metadata, final_key, final_key_metadata, metrics,
+                                           lambda: document.journal.record(COPIED, doc_id), document.journal.copy_tags())
+    if not move_success:
+        return fail(move_err)
+
+    return posted_and_moved(document, final_key)
+
+
+# A record being processed whose document is still to be fetched and posted (see start_record): its raw document's
+# record and what process_record needs to know about it
+class PendingDocument:
+    __slots__ = ('record', 'object_key', 'bucket', 'key', 'post_key', 'etag', 'size', 'journal', 'submission_key')
+
+    def __init__(self, record, object_key, journal=NO_JOURNAL, submission_key=None):
+        self.record = record
+        self.object_key = object_key
+        self.bucket = record['s3']['bucket']['name']
+        self.key = object_key.key
+        self.post_key = object_key.post_key
+        self.etag = record['s3']['object'].get('eTag')
+        self.size = record['s3']['object'].get('size')
+        self.journal = journal
+        self.submission_key = submission_key
+
+
+# Deadline for fetching and posting a document, which must leave enough time before "deadline" for the move
+def work_deadline_for(deadline):
+    return deadline.minus(get_config().move_time_budget)
+
+
+# The steps of processing "record" that come before its document is fetched, the same for both pipelines (the async
+# one runs them on a thread): check and pair the record, resume a document a previous invocation got part way
+# through, finish one Ladle has already accepted, and make sure there is time left to post it
+#
+# @returns (PendingDocument, None) for a document to fetch and post, or (None, (success, message)) if the record
+# is finished. The record's key is parsed here once; every later step is handed the ObjectKey
+def start_record(record, deadline=NO_DEADLINE, metrics=NULL_METRICS):
+    object_key = ObjectKey.from_record(record)
+    rejection = check_record(record, object_key)
+    if rejection is not None:
+        return None, rejection
+    # A metadata event may hand over its raw document's record, and a raw document may not be ready yet
+    record, object_key, rejection = pair(record, object_key, metrics)
+    if rejection is not None:
+        return None, rejection
+
+    # A document a previous invocation got part way through resumes where that one stopped
+    journal = open_journal(record, object_key)
+    if journal.step is not None:
+        return None, resume_document(record, object_key, journal, deadline, metrics)
+
+    submission_key = get_submission_key(record, object_key)
+    submitted_doc_id = find_submitted_document(submission_key, metrics)
+    if submitted_doc_id is not None:
+        return None, move_submitted_document(record, object_key, submitted_doc_id, deadline, metrics,
+                                             'was already submitted', journal)
+
+    document = PendingDocument(record, object_key, journal, submission_key)
+    if work_deadline_for(deadline).expired():
+        return None, fail(f'Not enough time left to process {document.key}; leaving it for retry')
+
+    return document, None
+
+
+# Whether "document", whose URL Ladle turned down with "post_response", should be posted instead: Ladle doesn't take
+# documents by URL
+def falls_back_to_posting(document, post_success, post_response, metrics=NULL_METRICS):
+    if post_success or not is_url_submission_unsupported(post_response):
+        return False
+
+    log.warning('ladle does not take documents by url (%s); posting %s instead', post_response, document.key)
+    metrics.add('UrlSubmissionFallbacks', 1)
+    return True
+
+
+# "metadata" with "content_md5" added as CONTENT_HASH_FIELD, if that is set and the MD5 is known
+def add_configured_content_hash(metadata, content_md5):
+    content_hash_field = get_config().content_hash_field
+    if not content_hash_field or content_md5 is None:
+        return metadata
+
+    return add_content_hash_to_metadata(metadata, content_hash_field, content_md5)
+
+
+# Record that Ladle accepted "document" (see remember_posted_document), and work out where it is moved to
+#
+# @returns (doc_id, final_key, final_key_metadata, result), where "result" is the record's (success, message) if it
+# is finished without a move: there is no processed bucket, or not enough time left before "deadline" to move it
+def finish_posting(document, post_response, content_md5, posted_md5, deadline=NO_DEADLINE):
+    config = get_config()
+    doc_id = get_ladle_doc_id(post_response)
+    document.journal.record(POSTED, doc_id)
+    remember_posted_document(document.key, document.etag, document.submission_key, content_md5, posted_md5, doc_id)
+
+    # Change the filename to the document id generated by Ladle
+    final_key = get_key_for_doc_id(doc_id, document.key)
+    final_key_metadata = get_metadata_key_for_doc_id(doc_id)
+
+    if config.s3_bucket_processed is None or config.s3_bucket_processed == "":
+        return doc_id, final_key, final_key_metadata, succeed(f'Successfully posted {document.key} to {config.dart_url} as {document.post_key}. No secondary bucket set for processed documents')
+
+    if not deadline.has_at_least(config.move_time_budget):
+        return doc_id, final_key, final_key_metadata, fail(f'Posted {document.key} to {config.dart_url} as {document.post_key}, but not enough time left to move it to {config.s3_bucket_processed}; leaving it for retry')
+
+    return doc_id, final_key, final_key_metadata, None
+
+
+def retrieval_failure(key, bucket, err):
+    return fail(f'Unable to retrieve {key} from {bucket}: {err}')
+
+
+def submission_failure(document, post_response):
+    return fail(f"Unable to submit {document.key} to ladle as {document.post_key}: {post_response}")
+
+
+def posted_and_moved(document, final_key):
+    config = get_config()
+    return succeed(f'Successfully pulled {document.key} from {config.s3_bucket_in}, posted it to {config.dart_url} as {document.post_key}, and moved it to {config.s3_bucket_processed} as {final_key}')
+
+
+# Reasons not to process a record at all: it is neither a raw document nor metadata, or it comes from the wrong bucket.
+# "object_key" is the record's parsed key
+#
+# @returns (success, message) for a record that should not be processed, or None
+def check_record(record, object_key):
+    config = get_config()
+    S3_BUCKET_IN = config.s3_bucket_in
+
+    bucket = record['s3']['bucket']['name']
+    key = object_key.key
+    if not (object_key.is_raw() or object_key.is_metadata()):
+        return succeed( f"not a raw document: {key} does not end with '.raw' extension" )
+    if object_key.is_raw() and object_key.extension is None:
+        return fail( f"raw document is missing extension: {key}" )
+
+    # Make sure request is coming from correct bucket (should be impossible not to)
+    if bucket != S3_BUCKET_IN:
+        return fail(f'Create-Object event did not come from {S3_BUCKET_IN}')
+
+    return None
+
+
+# Pair "record", a raw document's or its metadata's, with the other half of the document (see pairing.pair_record)
+#
+# @returns (raw_record, raw_object_key, None) with the record of the raw document to process now and its parsed key,
+# or (None, None, (success, message)) if there is nothing to process now
+def pair(record, object_key, metrics=NULL_METRICS):
+    try:
+        raw_record, raw_object_key, result = pair_record(record, metrics, object_key)
+    except Exception as e:
+        bucket = record['s3']['bucket']['name']
+        return None, None, fail(f'Unable to look for the other half of {object_key.key} in {bucket}: {str(e)}')
+
+    if raw_record is None:
+        success, message = result
+        return None, None, succeed(message) if success else fail(message)
+
+    return raw_record, raw_object_key, None
+
+
+# Key under which the document in "record", whose parsed key is "object_key", is remembered once Ladle accepts it: its
+# idempotency key (bucket, key and ETag), or None if the record has no ETag
+def get_submission_key(record, object_key):
+    bucket = record['s3']['bucket']['name']
+    key = object_key.key
+    etag = record['s3']['object'].get('eTag')
+
+    return None if etag is None else idempotency_key(bucket, key, etag)
+
+
+# Look for the same upload as "submission_key" among the documents Ladle has already accepted (e.g. a redelivered
+# event). Such a document is not fetched or posted again; it only needs moving
+#
+# @returns its document id, or None
+def find_submitted_document(submission_key, metrics=NULL_METRICS):
+    if submission_key is None:
+        return None
+
+    submitted_doc_id = get_idempotency_store().get(submission_key)
+    if submitted_doc_id is not None:
+        metrics.add('DuplicatesSkipped', 1)
+    return submitted_doc_id
+
+
+# Look for a document with content MD5 "content_md5" among the documents Ladle has already accepted, i.e. the same
+# content uploaded under another key. Such a document is not posted again (see archive_duplicate_document). It isn't
+# remembered under its own submission key either: a redelivery would then be moved as the document it duplicates,
+# over that document's processed objects, rather than archived again
+#
+# @returns the document id of the one accepted, or None
+def find_duplicated_document(content_md5, metrics=NULL_METRICS):
+    if content_md5 is None:
+        return None
+
+    submitted_doc_id = get_idempotency_store().get(content_hash_key(content_md5))
+    if submitted_doc_id is not None:
+        metrics.add('ContentDuplicatesSkipped', 1)
+    return submitted_doc_id
+
+
+# Finish a record whose document Ladle already accepted as "doc_id": move it to the processed bucket (if any)
+# without posting it again
+def move_submitted_document(record, object_key, doc_id, deadline=NO_DEADLINE, metrics=NULL_METRICS,
+                            reason='was already submitted', journal=NO_JOURNAL):
+    config = get_config()
+    S3_BUCKET_PROCESSED = config.s3_bucket_processed
+    DART_URL = config.dart_url
+    MOVE_TIME_BUDGET_SECONDS = config.move_time_budget
+
+    key = object_key.key
+    key_metadata = object_key.metadata_key
+    final_key = get_key_for_doc_id(doc_id, key)
+    final_key_metadata = get_metadata_key_for_doc_id(doc_id)
+
+    if S3_BUCKET_PROCESSED is None or S3_BUCKET_PROCESSED == "":
+        return succeed(f'{key} {reason} to {DART_URL} as document {doc_id}. No secondary bucket set for processed documents')
+
+    if not deadline.has_at_least(MOVE_TIME_BUDGET_SECONDS):
+        return fail(f'{key} {reason} to {DART_URL} as document {doc_id}, but not enough time left to move it to {S3_BUCKET_PROCESSED}; leaving it for retry')
+
+    move_success, move_err = move_document(record, key, key_metadata, final_key, final_key_metadata, metrics,
+                                           lambda: journal.record(COPIED, doc_id), journal.copy_tags())
+    if not move_success:
+        return fail(move_err)
+
+    return succeed(f'{key} {reason} to {DART_URL} as document {doc_id}; moved it to {S3_BUCKET_PROCESSED} as {final_key}')
+
+
+# Finish a record whose document has the same content as document "doc_id", which Ladle already accepted under
+# another key: archive it in the processed bucket (if any) under DUPLICATES_PREFIX and its own keys, rather than
+# as "doc_id", whose processed objects are the original's
+def archive_duplicate_document(record, object_key, doc_id, deadline=NO_DEADLINE, metrics=NULL_METRICS):
+    config = get_config()
+    S3_BUCKET_PROCESSED = config.s3_bucket_processed
+    DART_URL = config.dart_url
+    MOVE_TIME_BUDGET_SECONDS = config.move_time_budget
+
+    key = object_key.key
+    key_metadata = object_key.metadata_key
+    archived_key = DUPLICATES_PREFIX + key
+    archived_key_metadata = DUPLICATES_PREFIX + key_metadata
+    log.info('%s has the same content as document %s', key, doc_id, key=key, doc_id=doc_id)
+
+    if S3_BUCKET_PROCESSED is None or S3_BUCKET_PROCESSED == "":
+        return succeed(f'{key} has the same content as document {doc_id} already submitted to {DART_URL}. No secondary bucket set for processed documents')
+
+    if not deadline.has_at_least(MOVE_TIME_BUDGET_SECONDS):
+        return fail(f'{key} has the same content as document {doc_id} already submitted to {DART_URL}, but not enough time left to archive it in {S3_BUCKET_PROCESSED}; leaving it for retry')
+
+    move_success, move_err = move_document(record, key, key_metadata, archived_key, archived_key_metadata, metrics)
+    if not move_success:
+        return fail(move_err)
+
+    return succeed(f'{key} has the same content as document {doc_id} already submitted to {DART_URL}; archived it in {S3_BUCKET_PROCESSED} as {archived_key}')
+
+
+# Finish a record whose journal (see journal.Journal) says a previous invocation got part way through it: move a
+# posted document without fetching or posting it again, and only remove the sources of a copied one
+def resume_document(record, object_key, journal, deadline=NO_DEADLINE, metrics=NULL_METRICS):
+    config = get_config()
+    S3_BUCKET_IN = config.s3_bucket_in
+    S3_BUCKET_PROCESSED = config.s3_bucket_processed
+    DART_URL = config.dart_url
+    MOVE_TIME_BUDGET_SECONDS = config.move_time_budget
+
+    metrics.add('ResumedFromJournal', 1)
+    if journal.step == POSTED or not S3_BUCKET_PROCESSED:
+        return move_submitted_document(record, object_key, journal.doc_id, deadline, metrics, 'was already posted',
+                                       journal)
+
+    key = object_key.key
+    final_key = get_key_for_doc_id(journal.doc_id, key)
+
+    if not deadline.has_at_least(MOVE_TIME_BUDGET_SECONDS):
+        return fail(f'{key} was already copied to {S3_BUCKET_PROCESSED} as {final_key}, but not enough time left to remove it from {S3_BUCKET_IN}; leaving it for retry')
+
+    with metrics.time('Move'):
+        remove_success, remove_message = remove_moved_objects(
+            [(object_key.metadata_key, get_metadata_key_for_doc_id(journal.doc_id)), (key, final_key)],
+            S3_BUCKET_IN,
+            S3_BUCKET_PROCESSED,
+        )
+
+    if not remove_success:
+        # The copies may have been undone since: move it all over again
+        log.warning('unable to finish moving %s: %s', key, remove_message)
+        return move_submitted_document(record, object_key, journal.doc_id, deadline, metrics, 'was already posted',
+                                       journal)
+
+    return succeed(f'{key} was already posted to {DART_URL} as document {journal.doc_id} and copied to {S3_BUCKET_PROCESSED} as {final_key}; removed it from {S3_BUCKET_IN}')
+
+
+# Move metadata and object from ingest bucket to processed bucket together: either both move or neither does.
+# "on_copied", if given, is called once both are copied, before either is removed; "tags" replaces some copies'
+# tags (see workers.move_processed_objects)
+#
+# @returns (success, error message)
+def move_document(record, key, key_metadata, final_key, final_key_metadata, metrics=NULL_METRICS, on_copied=None,
+                  tags=None):
+    config = get_config()
+    S3_BUCKET_IN = config.s3_bucket_in
+    S3_BUCKET_PROCESSED = config.s3_bucket_processed
+
+    log.debug('putting metadata and file in second bucket: %s, %s ---> %s as %s, %s',
+              key_metadata, key, S3_BUCKET_PROCESSED, final_key_metadata, final_key, key=key)
+
+    with metrics.time('Move'):
+        move_success, move_err = move_processed_objects(
+            [(key_metadata, final_key_metadata), (key, final_key, record['s3']['object'].get('size'))],
+            S3_BUCKET_IN,
+            S3_BUCKET_PROCESSED,
+            on_copied,
+            tags,
+        )
+
+    if not move_success:
+        return False, move_failure(key, key_metadata, final_key, final_key_metadata, move_err)
 
-        if not post_success:
-            return fail(f"Unable to submit {key} to ladle as {post_key}: {post_response}")
+    return True, None
 
-        # Change the filename to the document id generated by Ladle
-        final_key = get_key_from_ladle_doc_id(post_response, key)
-        final_key_metadata = final_key.split('.')[0] + '.meta'
 
-        if S3_BUCKET_PROCESSED is None or S3_BUCKET_PROCESSED == "":
-            return succeed(f'Successfully posted {key} to {DART_URL} as {post_key}. No secondary bucket set for processed documents')
+def move_failure(key, key_metadata, final_key, final_key_metadata, move_err):
+    config = get_config()
+    return f'Unable to move {key_metadata} and {key} from {config.s3_bucket_in} to {final_key_metadata} and {final_key} in {config.s3_bucket_processed}: {move_err}'
 
-        LOG(f'PUTTING METADATA IN SECOND S3_BUCKET: {key_metadata} ---> {S3_BUCKET_PROCESSED} as {final_key_metadata}')
 
-        move_success_metadata, move_err_metadata = move_processed_object(key_metadata, S3_BUCKET_IN, final_key_metadata, S3_BUCKET_PROCESSED)
+# Record that Ladle accepted document "key" as "doc_id", under its "submission_key" and under the MD5 of what was
+# posted, if known. A posted MD5 that doesn't match the one given by the ETag means the content changed on its way,
+# so it isn't recorded
+def remember_posted_document(key, etag, submission_key, content_md5, posted_md5, doc_id):
+    remember_submission(submission_key, doc_id)
+    if posted_md5 is None:
+        return
 
-        if not move_success_metadata:
-            return fail(f'Unable to move {key_metadata} from {S3_BUCKET_IN} to {final_key_metadata} in {S3_BUCKET_PROCESSED}: {move_err_metadata}')
+    if content_md5 is not None and posted_md5 != content_md5:
+        log.error('posted content of %s does not match its ETag %s', key, etag, md5=posted_md5)
+        return
 
-        LOG(f'PUTTING FILE IN SECOND S3_BUCKET: {key} ---> {S3_BUCKET_PROCESSED} as {final_key}')
+    remember_submission(content_hash_key(posted_md5), doc_id)
 
-        # Move object from ingest bucket to processed bucket
-        move_success, move_err = move_processed_object(key, S3_BUCKET_IN, final_key, S3_BUCKET_PROCESSED)
 
-        if not move_success:
-            return_meta_success, return_meta_err = move_processed_object(final_key_metadata, S3_BUCKET_PROCESSED, key_metadata, S3_BUCKET_IN)
-            if not return_meta_success:
-                return fail(f'Unable to move {key} from {S3_BUCKET_IN} to {final_key} in {S3_BUCKET_PROCESSED}: {move_err}\nand unable to return metadata ({final_key_metadata}) from ${S3_BUCKET_PROCESSED}')
-            else:
-                return fail(f'Unable to move {key} from {S3_BUCKET_IN} to {final_key} in {S3_BUCKET_PROCESSED}: {move_err}')
+# Record that the document identified by "submission_key" (if any) was accepted by Ladle as "doc_id". Failing to
+# record it only means a redelivery would post it again, so that doesn't fail the record
+def remember_submission(submission_key, doc_id):
+    if submission_key is None:
+        return
 
-        return succeed(f'Successfully pulled {key} from {S3_BUCKET_IN}, posted it to {DART_URL} as {post_key}, and moved it to {S3_BUCKET_PROCESSED} as {final_key}')
+    try:
+        get_idempotency_store().put(submission_key, doc_id)
+    except Exception as e:
+        log.warning('unable to record submission of %s: %s', submission_key, e)
 
 
 def fail(msg):
-    print(msg)
+    log.error(msg)
     return False, msg
 
 
 def succeed(msg):
-    LOG(msg)
+    log.info(msg)
     return True, msg
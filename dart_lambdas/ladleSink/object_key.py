@@ -0,0 +1,86 @@
+import functools
+import json
+import os
+import urllib.parse
+
+RAW_SUFFIX = 'raw'
+METADATA_SUFFIX = 'meta'
+
+PARSED_KEY_CACHE_SIZE = 1024
+
+
+# The key of an object in the ingest bucket, parsed once: "<name>.<extension>.raw" for a raw document (e.g.
+# "02fd...698a.pdf.raw") and "<name>.meta" for its metadata. Instances are shared (see parse), so treat them as
+# immutable.
+#
+# "key" is the decoded key (event records carry it URL-encoded), "suffix" its last part ("raw" or "meta"), and
+# "extension" the part before that (e.g. "pdf", or the source, e.g. "factiva"), None if there is none.
+# "post_key" is the filename a raw document is submitted to Ladle with, "metadata_key" the key of its metadata
+class ObjectKey:
+    __slots__ = ('key', 'suffix', 'extension', 'post_key', 'metadata_key')
+
+    def __init__(self, key):
+        parts = key.split('.')
+        self.key = key
+        self.suffix = parts[-1] if len(parts) > 1 else None
+        self.extension = parts[-2] if len(parts) > 2 else None
+        self.post_key = '.'.join(parts[0:-1])
+        self.metadata_key = '.'.join(parts[0:-2]) + '.' + METADATA_SUFFIX
+
+    # Parse "key" (already decoded). Keys are parsed once each: the same key is looked at by several steps of a
+    # record's processing, so the parsed key is cached and shared
+    @staticmethod
+    @functools.lru_cache(maxsize=PARSED_KEY_CACHE_SIZE)
+    def parse(key):
+        return ObjectKey(key)
+
+    # Parse the (URL-encoded) key of the object in S3 event record "record"
+    @staticmethod
+    def from_record(record):
+        return ObjectKey.parse(urllib.parse.unquote_plus(record['s3']['object']['key']))
+
+    def is_metadata(self):
+        return self.suffix == METADATA_SUFFIX
+
+    def is_raw(self):
+        return self.suffix == RAW_SUFFIX
+
+    def __repr__(self):
+        return f'ObjectKey({self.key!r})'
+
+
+# Routes documents to submission endpoints by their extension (e.g. "factiva"), with every other document going to
+# "default_endpoint"
+class SubmissionRoutes:
+    __slots__ = ('default_endpoint', 'endpoints')
+
+    def __init__(self, default_endpoint, endpoints):
+        self.default_endpoint = default_endpoint
+        self.endpoints = endpoints
+
+    # Endpoint for a document submitted as "post_key" (e.g. "02fd...698a.factiva")
+    def endpoint(self, post_key):
+        return self.endpoints.get(post_key.rpartition('.')[2], self.default_endpoint)
+
+
+# Routing table built from SUBMISSION_ENDPOINT (the default) and SUBMISSION_ROUTES, a JSON object mapping extensions
+# to endpoints, e.g. {"factiva": "/factiva/submit"}. FACTIVA_SUBMISSION_ENDPOINT, if set, routes "factiva" documents
+# unless SUBMISSION_ROUTES does. The table is only rebuilt when the configuration changes
+def get_submission_routes(environ=os.environ):
+    return _build_submission_routes(
+        environ.get('SUBMISSION_ENDPOINT'),
+        environ.get('SUBMISSION_ROUTES'),
+        environ.get('FACTIVA_SUBMISSION_ENDPOINT'),
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def _build_submission_routes(default_endpoint, routes_json, factiva_endpoint):
+    endpoints = {} if factiva_endpoint is None else {'factiva': factiva_endpoint}
+    if routes_json:
+        routes = json.loads(routes_json)
+        if not isinstance(routes, dict):
+            raise ValueError(f'SUBMISSION_ROUTES must be a JSON object mapping extensions to endpoints: {routes_json}')
+        endpoints.update(routes)
+
+    return SubmissionRoutes(default_endpoint, endpoints)
@@ -0,0 +1,114 @@
+import urllib.parse
+
+from dart_lambdas.common.metrics import NULL_METRICS
+from dart_lambdas.common.s3_utils import get_s3_client
+from dart_lambdas.ladleSink.config import get_config
+from dart_lambdas.ladleSink.object_key import ObjectKey, METADATA_SUFFIX
+
+# A document is uploaded as two objects, the raw document ("<name>.<extension>.raw") and its metadata
+# ("<name>.meta"), in either order, and each upload has its own event. Rather than the raw document's event polling
+# for its metadata, whichever event finds both halves in the bucket processes them:
+#   - a raw document's event leaves it for retry straight away if the metadata isn't there yet (S3 reads are
+#     consistent, so waiting wouldn't help); the metadata's event, or a retry, will find both. The metadata's event
+#     may leave the document to that retry (see below), so the retry has to happen: lambda_handler raises
+#     MetadataNotUploadedError for it rather than return a failure that an asynchronous invocation drops
+#   - a metadata event processes the raw document if it is there, unless its own event will
+#
+# When both halves are there, both events would find them, so each event decides from the objects' upload times
+# (which both see alike) whether it is the one: the metadata's event processes the pair only if the metadata was
+# uploaded more than the pairing window (PAIRING_WINDOW_SECONDS) after the raw document. Upload times only have
+# second resolution, so the usual case of metadata uploaded right after its document is left to the document's event.
+
+# Part of the failure message of a raw document whose metadata hasn't been uploaded yet (see is_awaiting_metadata)
+AWAITING_METADATA = "it hasn't been uploaded yet"
+
+
+# Raised for an event holding raw documents whose metadata hasn't been uploaded yet, so that Lambda retries it
+class MetadataNotUploadedError(Exception):
+    pass
+
+
+# Work out which raw document, if any, "record" should process now
+#
+# @returns (raw_record, raw_object_key, result): "raw_record" is the event record of the raw document to process and
+# "raw_object_key" its parsed key, or both are None, in which case "result" is a (success, message) to report instead.
+# "object_key" is the record's own parsed key, if already known. Listing or reading S3 may raise botocore's ClientError
+def pair_record(record, metrics=NULL_METRICS, object_key=None):
+    bucket = record['s3']['bucket']['name']
+    if object_key is None:
+        object_key = ObjectKey.from_record(record)
+    key = object_key.key
+
+    if object_key.is_metadata():
+        raw_object, metadata_object = _list_pair(bucket, key)
+        if raw_object is None:
+            return None, None, (True, f"metadata file ({key}): no need to pass to ladle")
+        if not _metadata_event_pairs(raw_object, metadata_object):
+            return None, None, (True, f"metadata file ({key}): {raw_object['Key']} is processed by its own event")
+
+        metrics.add('PairedByMetadata', 1)
+        # Already parsed while listing, so this comes from ObjectKey.parse's cache
+        return _raw_record(record, bucket, raw_object), ObjectKey.parse(raw_object['Key']), None
+
+    raw_object, metadata_object = _list_pair(bucket, object_key.metadata_key, key)
+    if raw_object is None:
+        return None, None, (True, f"{key} is no longer in {bucket}; it was processed with its metadata")
+    if metadata_object is None:
+        metrics.add('DeferredForMetadata', 1)
+        return None, None, (False, f"Unable to retrieve {object_key.metadata_key} from {bucket}: {AWAITING_METADATA}, leaving {key} for retry")
+    if _metadata_event_pairs(raw_object, metadata_object):
+        return None, None, (True, f"{key} is processed by the event for its metadata ({object_key.metadata_key})")
+
+    return record, object_key, None
+
+
+# Whether "message", a record's failure, means its raw document was left for retry until its metadata is uploaded
+def is_awaiting_metadata(message):
+    return f': {AWAITING_METADATA}, ' in message
+
+
+# Whether the metadata's event, rather than the raw document's, processes a pair (see above)
+def _metadata_event_pairs(raw_object, metadata_object):
+    uploaded_after = (metadata_object['LastModified'] - raw_object['LastModified']).total_seconds()
+    return uploaded_after > get_config().pairing_window
+
+
+# Find both halves of the document whose metadata is "metadata_key" with one LIST, since they share a prefix
+#
+# @returns (raw_object, metadata_object), the listing entries for each, or None for a half that isn't there. If
+# "raw_key" is given only that raw document is looked for, otherwise the latest one uploaded with this metadata
+def _list_pair(bucket, metadata_key, raw_key=None):
+    prefix = metadata_key[:-len(METADATA_SUFFIX)]
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+
+    raw_object = None
+    metadata_object = None
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for listed in page.get('Contents', []):
+            listed_key = ObjectKey.parse(listed['Key'])
+            if listed_key.key == metadata_key:
+                metadata_object = listed
+            elif raw_key is not None:
+                if listed_key.key == raw_key:
+                    raw_object = listed
+            elif listed_key.is_raw() and listed_key.extension is not None and listed_key.metadata_key == metadata_key:
+                if raw_object is None or listed['LastModified'] > raw_object['LastModified']:
+                    raw_object = listed
+
+    return raw_object, metadata_object
+
+
+# Build the event record the raw document's own upload would have had, so it goes through the usual pipeline
+def _raw_record(metadata_record, bucket, raw_object):
+    raw_record = dict(metadata_record)
+    raw_record['s3'] = {
+        **metadata_record['s3'],
+        'bucket': {**metadata_record['s3']['bucket'], 'name': bucket},
+        'object': {
+            'key': urllib.parse.quote_plus(raw_object['Key'], safe='/'),
+            'size': raw_object['Size'],
+            # Listings quote ETags, events don't; idempotency keys are built from the event's form
+            'eTag': raw_object['ETag'].strip('"'),
+        },
+    }
+    return raw_record
@@ -1,49 +1,344 @@
 import json
-import boto3
-import botocore
-import os
 import hashlib
-import urllib.parse
-from dart_lambdas.common.retry import retry
+import time
+from dart_lambdas.common.batch import run_concurrently, MicroBatcher
+from dart_lambdas.common.circuit_breaker import get_circuit_breaker
+from dart_lambdas.common.concurrency_limit import get_concurrency_limiter
+from dart_lambdas.common.custom_logging import get_logger
+from dart_lambdas.common.deadline import Deadline, NO_DEADLINE
+from dart_lambdas.common.document_buffer import DocumentBuffer, replayable_documents
+from dart_lambdas.common.http_utils import try_post, is_server_failure, POST_STATUS_FAILURE
+from dart_lambdas.common.idempotency import md5_from_etag
+from dart_lambdas.common.metrics import NULL_METRICS, BYTES
+from dart_lambdas.common.multipart import SizedStream
+from dart_lambdas.common.retry import retry, RetryPolicy
+from dart_lambdas.common.s3_utils import get_s3_client, copy_s3_object, is_retryable_s3_error, RangedStream
+from dart_lambdas.ladleSink.config import get_config, DEFAULT_SUBMISSION_BATCH_MAX_BYTES, DEFAULT_SUBMISSION_BATCH_LINGER_MS
+from dart_lambdas.ladleSink.object_key import ObjectKey, METADATA_SUFFIX
 
-from dart_lambdas.common.http_utils import try_post
+log = get_logger('ladleSink.workers')
 
+# Name of the circuit breaker and concurrency limiter guarding submissions to Ladle
+LADLE = 'ladle'
+CIRCUIT_OPEN_FAILURE = 'Ladle is failing (circuit breaker open); not posting, leaving it for retry'
+CONCURRENCY_LIMIT_FAILURE = 'Timed out waiting to post to Ladle, which is being sent fewer requests while it is slow or failing; leaving it for retry'
+# Statuses with which Ladle turns down a document submitted by URL because it doesn't take documents that way
+URL_SUBMISSION_UNSUPPORTED_STATUSES = {'404', '405', '415'}
+# Prefix in the processed bucket under which documents submitted by URL are kept for Ladle to fetch (see
+# stage_url_submission)
+URL_SUBMISSIONS_PREFIX = 'url-submissions/'
 
-def get_created_object(record_in, bucket_in):
-    key = urllib.parse.unquote_plus(record_in['s3']['object']['key'])
-    s3_client = boto3.client('s3')
+# GETs of throttled or failing requests keep retrying for up to 30 seconds, backing off with jitter so throttled
+# requests spread out. A missing object isn't retried: a document whose metadata hasn't been uploaded yet is paired
+# up by the metadata's event instead (see pairing)
+S3_GET_RETRY_POLICY = RetryPolicy(
+    max_attempts=300,
+    base_delay=100,
+    max_delay=2000,
+    max_elapsed=30000,
+    retryable=is_retryable_s3_error,
+)
 
+
+# Open the object referenced in "record_in" without reading it, so it can be streamed to Ladle
+#
+# @returns (success, key, stream, error) where "stream" is a readable HashingStream over the object's body, with
+# the content MD5 its ETag gives. The caller is responsible for closing the stream. Retries stop at "deadline".
+# "object_key" is the record's parsed key, if the caller already has it; the same goes for the other getters here
+def open_created_object(record_in, bucket_in, deadline=NO_DEADLINE, metrics=NULL_METRICS, object_key=None):
+    if object_key is None:
+        object_key = ObjectKey.from_record(record_in)
+    key = object_key.key
+    s3_client = get_s3_client()
+
+    size = record_in['s3']['object'].get('size')
+    if size is not None and size >= get_config().ranged_get_threshold:
+        return open_created_object_in_ranges(record_in, bucket_in, size, deadline, metrics, object_key)
+
+    try:
+        get_response = retry(s3_client.get_object, {'Bucket': bucket_in, 'Key': key}, policy=S3_GET_RETRY_POLICY, deadline=deadline,
+                             on_retry=on_get_retry(metrics, 'FetchRawRetries', bucket_in, key))
+    except Exception as e:
+        return False, key, None, f'Exception: {str(e)}'  # Deliver what we can, send exception message
+
+    log.debug('opened %s in %s', key, bucket_in, size=get_response['ContentLength'])
+    metrics.add('RawBytes', get_response['ContentLength'], BYTES)
+    return True, key, HashingStream(SizedStream(get_response['Body'], get_response['ContentLength']), md5_from_etag(get_response)), None
+
+
+# Stream that hashes what is read through it, so a document can be hashed on its way to Ladle without being read
+# twice. The digest only covers the whole document once "complete" is True. "content_md5" is the MD5 the object's
+# ETag gives for its content, if it gives one (see idempotency.md5_from_etag), so it is known before reading
+class HashingStream:
+    def __init__(self, stream, content_md5=None):
+        self._stream = stream
+        self._md5 = hashlib.md5()
+        self._bytes_read = 0
+        self.content_md5 = content_md5
+
+    def __len__(self):
+        return len(self._stream)
+
+    def read(self, size=-1):
+        chunk = self._stream.read(size)
+        self._md5.update(chunk)
+        self._bytes_read += len(chunk)
+        return chunk
+
+    def close(self):
+        self._stream.close()
+
+    @property
+    def complete(self):
+        return self._bytes_read == len(self._stream)
+
+    def md5(self):
+        return self._md5.hexdigest()
+
+
+# Open a raw document of "size" bytes (at least RANGED_GET_THRESHOLD_BYTES) as a RangedStream, so that it is fetched
+# over RANGED_GET_CONCURRENCY connections at once rather than one (S3_MAX_POOL_CONNECTIONS should leave room for
+# them). Each range is retried on its own, so a failure doesn't restart the whole download. Ranges are requested
+# with the event's ETag, if it has one, so they all come from the same upload even if the object is replaced.
+#
+# @returns the same as open_created_object, with a RangedStream instead of a SizedStream. Its content MD5 is
+# unknown, since ranged responses aren't checked for how the object is encrypted
+def open_created_object_in_ranges(record_in, bucket_in, size, deadline=NO_DEADLINE, metrics=NULL_METRICS,
+                                  object_key=None):
+    config = get_config()
+    if object_key is None:
+        object_key = ObjectKey.from_record(record_in)
+    key = object_key.key
+    etag = record_in['s3']['object'].get('eTag')
+    s3_client = get_s3_client()
+    on_retry = on_get_retry(metrics, 'FetchRawRetries', bucket_in, key)
+
+    def get_range_once(start, end):
+        get_args = {'Bucket': bucket_in, 'Key': key, 'Range': f'bytes={start}-{end}'}
+        if etag:
+            get_args['IfMatch'] = etag
+        # Reading is retried along with the request, since the connection may drop mid-range
+        return s3_client.get_object(**get_args)['Body'].read()
+
+    def get_range(start, end):
+        return retry(get_range_once, [start, end], policy=S3_GET_RETRY_POLICY, deadline=deadline, on_retry=on_retry)
+
+    stream = RangedStream(get_range, size, config.ranged_get_part_size, config.ranged_get_concurrency)
     try:
-        get_response = retry(s3_client.get_object, {'Bucket': bucket_in, 'Key': key}, 300, None, 100)
+        stream.wait_for_first_range()
     except Exception as e:
+        stream.close()
         return False, key, None, f'Exception: {str(e)}'  # Deliver what we can, send exception message
 
-    raw_doc_out = get_response['Body'].read()
+    log.debug('opened %s in %s in ranges', key, bucket_in, size=size)
+    metrics.add('RawBytes', size, BYTES)
+    metrics.add('RangedFetches', 1)
+    return True, key, HashingStream(stream), None
+
+
+# Called before a GET of "key" from "bucket_in" is retried: counts the retry as "metric_name" and logs it. Shared
+# by the async workers
+def on_get_retry(metrics, metric_name, bucket_in, key):
+    count_retry = metrics.counter(metric_name)
+
+    def on_retry(attempt):
+        count_retry(attempt)
+        log.debug('retrying get of %s from %s after attempt %s', key, bucket_in, attempt)
+
+    return on_retry
+
+
+# Fetch the whole object referenced in "record_in" into a DocumentBuffer, which keeps large objects on disk
+#
+# @returns (success, key, buffer, error). The caller is responsible for closing the buffer
+def get_created_object(record_in, bucket_in, deadline=NO_DEADLINE):
+    success, key, raw_doc_stream, err = open_created_object(record_in, bucket_in, deadline)
+
+    if not success:
+        return False, key, None, err
+
+    try:
+        raw_doc_out = DocumentBuffer.from_stream(raw_doc_stream)
+    except Exception as e:
+        return False, key, None, f'Exception: {str(e)}'
+
     return True, key, raw_doc_out, None
 
-def get_created_object_metadata(record_in, bucket_in):
-    key = urllib.parse.unquote_plus(record_in['s3']['object']['key'])
-    key_metadata = ".".join( key.split('.')[0:-2] ) + '.meta'
-    s3_client = boto3.client('s3')
+def get_created_object_metadata(record_in, bucket_in, deadline=NO_DEADLINE, metrics=NULL_METRICS, object_key=None):
+    if object_key is None:
+        object_key = ObjectKey.from_record(record_in)
+    key_metadata = object_key.metadata_key
+    s3_client = get_s3_client()
 
     try:
-        get_response = retry(s3_client.get_object, {'Bucket': bucket_in, 'Key': key_metadata}, 300, None, 100)
+        get_response = retry(s3_client.get_object, {'Bucket': bucket_in, 'Key': key_metadata}, policy=S3_GET_RETRY_POLICY, deadline=deadline,
+                             on_retry=on_get_retry(metrics, 'FetchMetadataRetries', bucket_in, key_metadata))
     except Exception as e:
         return False, key_metadata, None, f'Exception: {str(e)}'  # Deliver what we can, send exception message
 
     metadata_out = get_response['Body'].read().decode('utf-8')
+    metrics.add('MetadataBytes', get_response['ContentLength'], BYTES)
     return True, key_metadata, metadata_out, None
 
 
-def post_retrieved_object_and_metadata(key_in, raw_doc_in, metadata_in):
-    DART_URL = os.environ.get('DART_URL')
-    SUBMISSION_PORT = os.environ.get('SUBMISSION_PORT')
-    SUBMISSION_ENDPOINT = os.environ.get('SUBMISSION_ENDPOINT')
-    FACTIVA_SUBMISSION_ENDPOINT = os.environ.get('FACTIVA_SUBMISSION_ENDPOINT')
-    BAUTH_PASSWORD = os.environ.get('BAUTH_PASSWORD')
-    BAUTH_USERNAME = os.environ.get('BAUTH_USERNAME')
+# Add "content_hash" to JSON "metadata_in" as field "field". Metadata that isn't a JSON object is returned as is
+def add_content_hash_to_metadata(metadata_in, field, content_hash):
+    try:
+        parsed_metadata = json.loads(metadata_in)
+    except (TypeError, ValueError):
+        return metadata_in
+
+    if not isinstance(parsed_metadata, dict):
+        return metadata_in
+
+    parsed_metadata[field] = content_hash
+    return json.dumps(parsed_metadata)
+
+
+# Post document "key_in" to Ladle with its metadata. A post that fails to connect or gets a retryable status is
+# tried up to LADLE_POST_ATTEMPTS times, LADLE_POST_RETRY_PAUSE_MS apart (see post_attempts)
+def post_retrieved_object_and_metadata(key_in, raw_doc_in, metadata_in, deadline=NO_DEADLINE):
+    (raw_doc,), attempts = post_attempts([raw_doc_in])
+    try:
+        return guarded_post(lambda: try_post(
+                **submission_arguments(key_in, raw_doc, metadata_in),
+                post_data=None,
+                **attempts,
+                deadline=deadline,
+            ), deadline, document_size(raw_doc_in))
+    finally:
+        if raw_doc is not raw_doc_in:
+            raw_doc.close()
+
+
+# How to post documents "raw_docs_in" to Ladle: up to LADLE_POST_ATTEMPTS times if they can be sent more than once,
+# which streams can if they are kept in DocumentBuffers as they are sent, and there is room for them (see
+# document_buffer.replayable_documents). Otherwise they are streamed once, without keeping them anywhere.
+#
+# @returns (raw_docs, attempts) where "raw_docs" are the documents to post, which the caller closes if they aren't
+# the ones given, and "attempts" is try_post's "sleep_time" and "numtimes"
+def post_attempts(raw_docs_in):
+    config = get_config()
+    if config.ladle_post_attempts > 1:
+        raw_docs = replayable_documents(raw_docs_in)
+        if raw_docs is not None:
+            return raw_docs, {'sleep_time': config.ladle_post_retry_pause, 'numtimes': config.ladle_post_attempts}
+
+    return list(raw_docs_in), {'sleep_time': 0, 'numtimes': 1}
+
+
+# Whether documents bound for endpoint "endpoint" are submitted by URL (see post_presigned_url_and_metadata): only
+# if URL_SUBMISSION_ENDPOINT is set, and only those that would go to SUBMISSION_ENDPOINT
+def submits_by_url(endpoint):
+    config = get_config()
+    return config.url_submission_endpoint is not None and endpoint == config.routes.default_endpoint
+
+
+# Submit document "key_in" to Ladle's URL_SUBMISSION_ENDPOINT by reference rather than by content: Ladle is sent a
+# presigned GET URL for object "raw_key" in "bucket_in" (or rather its copy, see stage_url_submission) along with
+# the metadata, and fetches the document itself, so none of its bytes go through the lambda. "size" is the
+# object's size, if known. The URL is signed locally (no request to S3) and is valid for
+# PRESIGNED_URL_EXPIRY_SECONDS, or until the lambda's role credentials expire if that is sooner.
+#
+# @returns the same as post_retrieved_object_and_metadata. A failure for which is_url_submission_unsupported
+# holds means the document has to be posted as usual
+def post_presigned_url_and_metadata(key_in, bucket_in, raw_key, metadata_in, deadline=NO_DEADLINE, size=None):
+    config = get_config()
+    try:
+        url_bucket, url_key = stage_url_submission(bucket_in, raw_key, size)
+    except Exception as e:
+        return False, f'Unable to copy {raw_key} for Ladle to fetch: {str(e)}'
+
+    document_url = get_s3_client().generate_presigned_url(
+        'get_object',
+        Params={'Bucket': url_bucket, 'Key': url_key},
+        ExpiresIn=config.presigned_url_expiry,
+    )
+
+    post_success, post_response = guarded_post(lambda: try_post(
+            url=config.dart_url,
+            port=config.submission_port,
+            endpoint=config.url_submission_endpoint,
+            basic_auth=config.basic_auth,
+            post_files={'metadata': (None, metadata_in, 'application/json')},
+            post_data={'url': document_url, 'filename': key_in},
+            sleep_time=0,
+            numtimes=1,
+            deadline=deadline,
+        ), deadline)
+
+    # Ladle won't be fetching a copy it didn't accept: the document is either posted instead or staged afresh when
+    # it is retried, so the copy is removed rather than left for the lifecycle rule
+    if not post_success and url_key != raw_key:
+        delete_err = _delete_objects(get_s3_client(), url_bucket, [url_key])
+        if delete_err is not None:
+            log.warning('unable to remove %s from %s: %s', url_key, url_bucket, delete_err)
+
+    return post_success, post_response
+
+
+# Object Ladle fetches document "raw_key" in "bucket_in" (of "size" bytes, if known) from when it is submitted by
+# URL. The document itself is moved to the processed bucket once Ladle accepts its URL, which may well be before
+# Ladle has fetched it, so it is copied server-side to the processed bucket under URL_SUBMISSIONS_PREFIX first,
+# where it stays put once Ladle accepts its URL: the processed bucket should expire objects under that prefix with a
+# lifecycle rule, no sooner than PRESIGNED_URL_EXPIRY_SECONDS. Without a processed bucket, documents are never moved, so Ladle fetches the
+# document itself
+#
+# @returns (bucket, key) of the object to sign a URL for
+def stage_url_submission(bucket_in, raw_key, size=None):
+    config = get_config()
+    if config.s3_bucket_processed is None or config.s3_bucket_processed == "":
+        return bucket_in, raw_key
+
+    url_key = URL_SUBMISSIONS_PREFIX + raw_key
+    copy_s3_object(get_s3_client(), raw_key, bucket_in, url_key, config.s3_bucket_processed, size)
+    return config.s3_bucket_processed, url_key
+
+
+# Whether "post_response", from a failed post_presigned_url_and_metadata, means Ladle doesn't take documents by URL
+def is_url_submission_unsupported(post_response):
+    return post_response.startswith(POST_STATUS_FAILURE) and \
+        post_response[len(POST_STATUS_FAILURE):] in URL_SUBMISSION_UNSUPPORTED_STATUSES
+
 
-    is_not_factiva = False if key_in.split('.')[-1] == 'factiva' else True
+# Make a request to Ladle with "post" (which returns try_post's result) through Ladle's circuit breaker and
+# concurrency limiter, so that a Ladle that is struggling is sent fewer requests, and none at all while the
+# circuit is open. Both are kept across warm invocations. "size", the number of bytes posted if known, lets them
+# tell a slow Ladle from a large upload.
+#
+# @returns the result of "post", or a failure without posting if the circuit is open or no slot to post became
+# free before "deadline"
+def guarded_post(post, deadline=NO_DEADLINE, size=None):
+    limiter = get_concurrency_limiter(LADLE)
+    if not limiter.acquire(deadline):
+        return [False, CONCURRENCY_LIMIT_FAILURE]
+
+    breaker = get_circuit_breaker(LADLE)
+    if not breaker.allow():
+        limiter.release()
+        return [False, CIRCUIT_OPEN_FAILURE]
+
+    start = time.monotonic()
+    healthy = False
+    try:
+        post_success, post_response = post()
+        healthy = post_success or not is_server_failure(post_response)
+        return post_success, post_response
+    finally:
+        duration = time.monotonic() - start
+        breaker.record(healthy, duration, size)
+        limiter.release(healthy, duration, size)
+
+
+# Size of document "raw_doc" (bytes or a sized stream), or None if it isn't known
+def document_size(raw_doc):
+    return len(raw_doc) if hasattr(raw_doc, '__len__') else None
+
+
+# Where and how to submit document "key_in" to Ladle: the url, port, endpoint (see get_submission_routes),
+# credentials and files to post
+def submission_arguments(key_in, raw_doc_in, metadata_in):
+    config = get_config()
 
     file_dict = \
         {
@@ -53,46 +348,283 @@ def post_retrieved_object_and_metadata(key_in, raw_doc_in, metadata_in):
             'metadata': (None, metadata_in, 'application/json'),
         }
 
-    return try_post(
-            url=DART_URL,
-            port=SUBMISSION_PORT,
-            endpoint=SUBMISSION_ENDPOINT if is_not_factiva else FACTIVA_SUBMISSION_ENDPOINT,
-            basic_auth=(BAUTH_USERNAME, BAUTH_PASSWORD),
-            post_files=file_dict,
-            post_data=None,
-            sleep_time=0,
-            numtimes=1
-        )
+    return {
+        'url': config.dart_url,
+        'port': config.submission_port,
+        'endpoint': config.routes.endpoint(key_in),
+        'basic_auth': config.basic_auth,
+        'post_files': file_dict,
+    }
+
+
+# Submit several documents, each a (key, raw document, metadata, deadline), to Ladle in one multipart request to
+# BATCH_SUBMISSION_ENDPOINT, as consecutive file and metadata parts. Ladle answers with a JSON list holding one
+# result per document, in the same order; a result without a "document_id" is a rejection of that document alone.
+# The request must be finished by the earliest of the documents' deadlines
+#
+# @returns a list of (success, response) per document, where "response" is that document's result as JSON (which
+# get_ladle_doc_id can read), or the reason it failed
+def post_retrieved_objects_and_metadata(documents):
+    BATCH_SUBMISSION_ENDPOINT = get_config().batch_submission_endpoint
+
+    arguments = submission_arguments(*documents[0][0:3])
+    raw_docs, attempts = post_attempts([raw_doc_in for _, raw_doc_in, _, _ in documents])
+    post_files = []
+    for (key_in, _, metadata_in, _), raw_doc in zip(documents, raw_docs):
+        post_files.append(('file', (key_in, raw_doc)))
+        post_files.append(('metadata', (None, metadata_in, 'application/json')))
+    deadline = Deadline.earliest(deadline for _, _, _, deadline in documents)
+
+    try:
+        post_success, post_response = guarded_post(lambda: try_post(
+                url=arguments['url'],
+                port=arguments['port'],
+                endpoint=BATCH_SUBMISSION_ENDPOINT,
+                basic_auth=arguments['basic_auth'],
+                post_files=post_files,
+                post_data=None,
+                **attempts,
+                deadline=deadline,
+            ), deadline, sum(document_size(raw_doc_in) or 0 for _, raw_doc_in, _, _ in documents))
+    finally:
+        for (_, raw_doc_in, _, _), raw_doc in zip(documents, raw_docs):
+            if raw_doc is not raw_doc_in:
+                raw_doc.close()
+
+    if not post_success:
+        return [(False, post_response)] * len(documents)
+
+    try:
+        results = json.loads(post_response)
+    except ValueError:
+        results = None
+    if not isinstance(results, list) or len(results) != len(documents):
+        return [(False, f'Unexpected response to batch of {len(documents)} documents: {post_response}')] * len(documents)
+
+    return [(True, json.dumps(result)) if isinstance(result, dict) and 'document_id' in result
+            else (False, f'Ladle rejected {key_in}: {json.dumps(result)}')
+            for (key_in, _, _, _), result in zip(documents, results)]
+
+
+# Submits the documents of one invocation to Ladle in batches (see post_retrieved_objects_and_metadata), so that
+# Ladle handles one request per batch rather than one per document. Documents are gathered for up to
+# "linger" seconds, into batches of at most "max_documents" documents and (roughly) "max_bytes" bytes.
+#
+# Only documents bound for SUBMISSION_ENDPOINT with metadata are batched; others, and batches that end up
+# holding a single document, are posted as usual
+class BatchSubmitter:
+    def __init__(self, max_documents, max_bytes=DEFAULT_SUBMISSION_BATCH_MAX_BYTES, linger=DEFAULT_SUBMISSION_BATCH_LINGER_MS / 1000):
+        self._batcher = MicroBatcher(self._post_batch, max_documents, max_bytes, linger)
+
+    # Same as post_retrieved_object_and_metadata, returning once the document's batch has been posted
+    def post(self, key_in, raw_doc_in, metadata_in, deadline=NO_DEADLINE):
+        routes = get_config().routes
+        if metadata_in is None or routes.endpoint(key_in) != routes.default_endpoint:
+            return post_retrieved_object_and_metadata(key_in, raw_doc_in, metadata_in, deadline)
+
+        size = len(raw_doc_in) + len(metadata_in) if hasattr(raw_doc_in, '__len__') else 0
+        return self._batcher.submit((key_in, raw_doc_in, metadata_in, deadline), size)
+
+    @staticmethod
+    def _post_batch(documents):
+        if len(documents) == 1:
+            return [post_retrieved_object_and_metadata(*documents[0])]
+
+        log.debug('posting batch of %s documents to ladle', len(documents))
+        return post_retrieved_objects_and_metadata(documents)
+
+
+# A BatchSubmitter if SUBMISSION_BATCH_SIZE is more than 1 and BATCH_SUBMISSION_ENDPOINT is set (with
+# SUBMISSION_BATCH_MAX_BYTES and SUBMISSION_BATCH_LINGER_MS); otherwise None, and documents are posted one by one
+def create_submitter():
+    config = get_config()
+    if config.submission_batch_size <= 1 or not config.batch_submission_endpoint:
+        return None
+
+    return BatchSubmitter(config.submission_batch_size, config.submission_batch_max_bytes, config.submission_batch_linger)
 
 
 def get_key_from_ladle_doc_id(json_in, old_key):
-    parsed_json = json.loads(json_in)
-    suffix = old_key.split('.')[-2].lower()
-    return f'{parsed_json["document_id"]}.{suffix}'
+    return get_key_for_doc_id(get_ladle_doc_id(json_in), old_key)
+
+
+def get_ladle_doc_id(json_in):
+    return json.loads(json_in)["document_id"]
+
+
+def get_key_for_doc_id(doc_id, old_key):
+    suffix = ObjectKey.parse(old_key).extension.lower()
+    return f'{doc_id}.{suffix}'
+
+
+# Key of the metadata of a document moved to "doc_id"
+def get_metadata_key_for_doc_id(doc_id):
+    return f'{doc_id}.{METADATA_SUFFIX}'
 
 
+# Move "input_key" in "input_bucket" to "output_key" in "output_bucket" (see move_processed_objects)
 def move_processed_object(input_key, input_bucket, output_key, output_bucket):
-    s3_client = boto3.client('s3')
+    return move_processed_objects([(input_key, output_key)], input_bucket, output_bucket)
 
-    try:
-        s3_client.copy_object(
-            Bucket=output_bucket,
-            Key=output_key,
-            CopySource={
-                "Bucket": input_bucket,
-                "Key": input_key,
-            }
-        )
-    except botocore.exceptions.ClientError as e:
-        return False, f"Unable to copy {input_key} from {input_bucket} to {output_key} in {output_bucket}: {str(e)}"
 
-    try:
-        s3_client.delete_object(Bucket=input_bucket, Key=input_key)
-    except botocore.exceptions.ClientError as e:
+# Move several objects from "input_bucket" to "output_bucket" as a unit. "moves" is a list of
+# (input_key, output_key) or (input_key, output_key, size) where "size" is the size of the input object
+# if it is already known.
+#
+# All objects are copied concurrently, then every source is removed with a single delete_objects call
+# ("on_copied", if given, is called in between). If anything fails, whether S3 refuses a request or can't be
+# reached, the move is rolled back so that all objects remain in "input_bucket" and none in "output_bucket".
+# Copies keep their source's tags, except for the input keys in "tags", which maps them to the tags to use instead
+#
+# @returns (success: Boolean, message: String)
+def move_processed_objects(moves, input_bucket, output_bucket, on_copied=None, tags=None):
+    s3_client = get_s3_client()
+    moves = ObjectMoves(moves, input_bucket, output_bucket, tags)
+
+    def copy(move):
+        input_key, output_key, size = move
         try:
-            s3_client.delete_object(Bucket=output_bucket, Key=output_key)
-            return False, f"Unable to remove {input_key} from {input_bucket}. Undid copy to {output_bucket}.\n\nException {str(e)}"
-        except botocore.exceptions.ClientError as e2:
-            return False, f"Unable to remove {input_key} from {input_bucket}. Unable to undo copy to {output_bucket}.\n\nRemoval of original Exception: {str(e)}\n\nRemoval of copy Exception: {str(e2)}"
+            copy_s3_object(s3_client, input_key, input_bucket, output_key, output_bucket, size, moves.tags_for(input_key))
+            return None
+        except Exception as e:
+            return moves.copy_error(input_key, output_key, e)
+
+    copy_errors = run_concurrently(*[lambda move=move: copy(move) for move in moves.moves])
+
+    if moves.any_failed(copy_errors):
+        undo_err = _delete_objects(s3_client, output_bucket, moves.copied_keys(copy_errors))
+        return moves.copy_failure(copy_errors, undo_err)
+
+    if on_copied is not None:
+        on_copied()
+
+    delete_err = _delete_objects(s3_client, input_bucket, moves.input_keys)
+
+    if delete_err is not None:
+        moves.log_rollback(delete_err)
+        # Some sources may be gone already: put those back before removing the copies
+        restore_errors = []
+        for input_key, output_key, size in moves.moves:
+            try:
+                s3_client.head_object(Bucket=input_bucket, Key=input_key)
+            except Exception:
+                try:
+                    copy_s3_object(s3_client, output_key, output_bucket, input_key, input_bucket, size)
+                except Exception as e:
+                    restore_errors.append(moves.restore_error(input_key, e))
+
+        undo_err = None if len(restore_errors) > 0 else _delete_objects(s3_client, output_bucket, moves.output_keys)
+        return moves.removal_failure(delete_err, restore_errors, undo_err)
+
+    return moves.success()
+
+
+# What move_processed_objects decides, apart from the S3 calls it makes: which objects are copied, removed and
+# restored, with which tags, and how each outcome is reported. Shared by the threaded and async workers, so that
+# both move objects the same way. "moves" and "tags" are as for move_processed_objects
+class ObjectMoves:
+    def __init__(self, moves, input_bucket, output_bucket, tags=None):
+        self.moves = [move if len(move) == 3 else (move[0], move[1], None) for move in moves]
+        self.input_bucket = input_bucket
+        self.output_bucket = output_bucket
+        self.input_keys = [input_key for input_key, _, _ in self.moves]
+        self.output_keys = [output_key for _, output_key, _ in self.moves]
+        self._tags = tags or {}
+
+    # Tags to give the copy of "input_key" in place of its source's, or None to keep the source's
+    def tags_for(self, input_key):
+        return self._tags.get(input_key)
+
+    def copy_error(self, input_key, output_key, exception):
+        return f"Unable to copy {input_key} from {self.input_bucket} to {output_key} in {self.output_bucket}: {str(exception)}"
+
+    def restore_error(self, input_key, exception):
+        return f"Unable to restore {input_key} to {self.input_bucket}: {str(exception)}"
+
+    # Whether any of "copy_errors", one per move (None for a copy that was made), is an error
+    @staticmethod
+    def any_failed(copy_errors):
+        return any(copy_error is not None for copy_error in copy_errors)
+
+    # Output keys of the copies that were made, which a failed move removes
+    def copied_keys(self, copy_errors):
+        return [output_key for output_key, copy_error in zip(self.output_keys, copy_errors) if copy_error is None]
+
+    # (False, message) for a move whose copies failed ("undo_err" says why the copies made couldn't be removed)
+    def copy_failure(self, copy_errors, undo_err):
+        log.warning('copy to %s failed; removed copies of %s', self.output_bucket, ', '.join(self.input_keys))
+        return False, "\n".join([copy_error for copy_error in copy_errors if copy_error is not None] +
+                                 ([] if undo_err is None else [f"Unable to undo copy to {self.output_bucket}: {undo_err}"]))
+
+    def log_rollback(self, delete_err):
+        log.warning('unable to remove %s from %s; rolling back move: %s', ', '.join(self.input_keys), self.input_bucket,
+                    delete_err)
+
+    # (False, message) for a move whose sources couldn't be removed ("delete_err"). It was rolled back unless some
+    # sources couldn't be restored ("restore_errors") or the copies couldn't be removed ("undo_err")
+    def removal_failure(self, delete_err, restore_errors, undo_err):
+        input_keys = ', '.join(self.input_keys)
+        if len(restore_errors) > 0:
+            return False, f"Unable to remove {input_keys} from {self.input_bucket}. Unable to undo copy to {self.output_bucket}.\n\nRemoval of original Exception: {delete_err}\n\n" + "\n".join(restore_errors)
+
+        if undo_err is not None:
+            return False, f"Unable to remove {input_keys} from {self.input_bucket}. Unable to undo copy to {self.output_bucket}.\n\nRemoval of original Exception: {delete_err}\n\nRemoval of copy Exception: {undo_err}"
+
+        return False, f"Unable to remove {input_keys} from {self.input_bucket}. Undid copy to {self.output_bucket}.\n\nException {delete_err}"
+
+    def success(self):
+        input_keys = ', '.join(self.input_keys)
+        output_keys = ', '.join(self.output_keys)
+        log.debug('moved %s from %s to %s in %s', input_keys, self.input_bucket, output_keys, self.output_bucket)
+        return True, f"Successfully moved {input_keys} from {self.input_bucket} to {output_keys} in {self.output_bucket}"
+
+
+# Finish a move (see move_processed_objects) whose copies were all made earlier, e.g. by an invocation that timed out
+# before removing the sources: remove the sources from "input_bucket", but only if every copy is in "output_bucket"
+#
+# @returns (success: Boolean, message: String); no source is removed if any copy is missing
+def remove_moved_objects(moves, input_bucket, output_bucket):
+    s3_client = get_s3_client()
+    input_keys = ', '.join(input_key for input_key, _ in moves)
+    output_keys = ', '.join(output_key for _, output_key in moves)
+
+    for _, output_key in moves:
+        try:
+            s3_client.head_object(Bucket=output_bucket, Key=output_key)
+        except Exception as e:
+            return False, f"Copy {output_key} is not in {output_bucket}: {str(e)}"
+
+    delete_err = _delete_objects(s3_client, input_bucket, [input_key for input_key, _ in moves])
+    if delete_err is not None:
+        return False, f"Unable to remove {input_keys} from {input_bucket}: {delete_err}"
+
+    return True, f"Successfully moved {input_keys} from {input_bucket} to {output_keys} in {output_bucket}"
+
+
+# Remove "keys" from "bucket" in one request
+#
+# @returns None on success, or a description of what could not be removed
+def _delete_objects(s3_client, bucket, keys):
+    if len(keys) == 0:
+        return None
+
+    try:
+        delete_response = s3_client.delete_objects(**delete_objects_arguments(bucket, keys))
+    except Exception as e:
+        return str(e)
+
+    return delete_objects_error(delete_response)
+
+
+# Arguments to delete_objects that remove "keys" from "bucket" (see _delete_objects)
+def delete_objects_arguments(bucket, keys):
+    return {'Bucket': bucket, 'Delete': {'Objects': [{'Key': key} for key in keys], 'Quiet': True}}
+
+
+# What a delete_objects response says could not be removed, or None if everything was
+def delete_objects_error(delete_response):
+    errors = delete_response.get('Errors', [])
+    if len(errors) > 0:
+        return '; '.join(f"{error.get('Key')}: {error.get('Code')} {error.get('Message')}" for error in errors)
 
-    return True, f"Successfully moved {input_key} from {input_bucket} to {output_key} in {output_bucket}"
+    return None
@@ -1,31 +1,73 @@
 #!/bin/bash
 
 # This script is meant to be run *locally*; it expects to find credentials in ~/.aws/ for profile "hungerford"
+#
+# The artifact is kept small so that cold starts stay fast: boto3 and botocore are left out since the Lambda runtime
+# provides them (set INCLUDE_BOTO3=true to ship a pinned version instead), tests and packaging metadata are removed,
+# and everything is compiled to bytecode ahead of time, since a function can't write its own. PYTHON must run the
+# same Python version as the function's runtime, or the bytecode is ignored. Set BUILD_ONLY=true to build and report
+# on the artifact without uploading it
 
 if [ -z "$1" ]; then
     echo "Missing parameter: lambda function name"
     exit 1
 fi
 
-function deploy {
-    rm -rf lamda
+PYTHON=${PYTHON:-python3}
+RUNTIME_PROVIDED_PACKAGES="boto3 botocore s3transfer jmespath"
+
+function build {
+    rm -rf lambda
     rm -rf lambda.zip
 
     mkdir lambda
 
-    pip3 install --target lambda/ .
+    ${PYTHON} -m pip install --quiet --no-compile --target lambda/ . || exit 1
+
+    if [ "${INCLUDE_BOTO3}" != "true" ]; then
+        for package in ${RUNTIME_PROVIDED_PACKAGES}; do
+            rm -rf lambda/${package} lambda/${package}-*.dist-info
+        done
+    fi
+
+    find lambda -depth -type d \( -name tests -o -name __pycache__ \) -exec rm -rf {} +
+    rm -rf lambda/*.dist-info lambda/*.egg-info lambda/bin
+
+    # Clients and configuration are set up while the module is imported, during the init phase (see warm_up)
+    cat > lambda/lambda_function.py <<EOF
+import dart_lambdas.${1} as function
+
+lambda_handler = function.lambda_handler
 
-    echo "from dart_lambdas.${1} import lambda_handler" > lambda/lambda_function.py
+if hasattr(function, 'warm_up'):
+    function.warm_up()
+EOF
+
+    # Files are unpacked with new timestamps, so the bytecode must not be checked against them
+    ${PYTHON} -m compileall -q --invalidation-mode unchecked-hash lambda/
 
     # Zip lambda function from inside package directory to produce appropriate structure
     cd lambda
-    zip -r ../lambda.zip *
+    zip -q -r -9 ../lambda.zip .
     cd ..
+}
+
+function report {
+    # Time to import the handler's package, most of a cold start's init phase (without warm_up's network calls)
+    import_time=$(cd lambda && ${PYTHON} -X importtime -c "import dart_lambdas.${1}" 2>&1 | tail -1 | awk -F'|' '{ print $2 / 1000 }')
+    echo "${1}: import time ${import_time} ms, zip size $(du -h lambda.zip | cut -f1), unpacked size $(du -sh lambda | cut -f1)"
+}
+
+function deploy {
+    build ${1}
+    report ${1}
 
     # Upload to aws
-    aws --profile dart lambda update-function-code --function-name $1 --zip-file fileb://lambda.zip
+    if [ "${BUILD_ONLY}" != "true" ]; then
+        aws --profile dart lambda update-function-code --function-name $1 --zip-file fileb://lambda.zip
+    fi
 
-    rm -rf lamda
+    rm -rf lambda
     rm -rf lambda.zip
 }
 
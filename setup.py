@@ -12,7 +12,7 @@ def get_dependencies(req_path, header):
             else:
                 if line.startswith('#'):
                     return deps
-                if len(line) > 0 and line[0] != '#':
+                if len(line.strip()) > 0 and line[0] != '#':
                     deps.append(line.strip())
 
         return deps
@@ -21,10 +21,14 @@ def get_dependencies(req_path, header):
 REQUIREMENTS_FILENAME = 'requirements.txt'
 INSTALL_DEPS_HEADER = 'INSTALL_DEPENDENCIES'
 TEST_DEPS_HEADER = 'TEST_DEPENDENCIES'
+ASYNC_DEPS_HEADER = 'ASYNC_DEPENDENCIES'
+BENCHMARK_DEPS_HEADER = 'BENCHMARK_DEPENDENCIES'
 
 requirements_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), REQUIREMENTS_FILENAME)
 test_deps = get_dependencies(requirements_path, TEST_DEPS_HEADER)
 install_deps = get_dependencies(requirements_path, INSTALL_DEPS_HEADER)
+async_deps = get_dependencies(requirements_path, ASYNC_DEPS_HEADER)
+benchmark_deps = get_dependencies(requirements_path, BENCHMARK_DEPS_HEADER)
 
 setup(
     name='dart_lambdas',
@@ -32,10 +36,10 @@ setup(
     description='Send files from S3 ingest bucket to Ladle, and then move to S3 processed bucket',
     author='John Hungerford',
     author_email='john.hungerford@twosixlabs.com',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     install_requires=install_deps,
     setup_requires=['pytest-runner'],
     tests_require=test_deps,
-    extras_require={'test': test_deps},
+    extras_require={'test': test_deps, 'async': async_deps, 'benchmark': benchmark_deps},
     include_package_data=True,
 )
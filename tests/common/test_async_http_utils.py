@@ -0,0 +1,83 @@
+import asyncio
+import email
+
+import pytest
+
+from dart_lambdas.common.deadline import Deadline
+from .test_http_utils import RecordingHandler, http_server
+
+aiohttp = pytest.importorskip('aiohttp')
+from dart_lambdas.common.async_http_utils import try_post, create_http_session  # noqa: E402
+
+
+def post(port, post_files, basic_auth=None, numtimes=1, deadline=Deadline()):
+    async def run():
+        async with create_http_session() as http_session:
+            return await try_post(http_session, 'http://127.0.0.1', port, '/submit', post_files, None, basic_auth, 0,
+                                  numtimes, deadline=deadline)
+
+    return asyncio.run(run())
+
+
+def test_try_post_sends_the_same_form_as_the_sync_try_post(http_server):
+    port = http_server.server_address[1]
+    post_files = {
+        'file': ('doc.pdf', b'data'),
+        'metadata': (None, '{"a": 1}', 'application/json'),
+    }
+
+    success, response = post(port, post_files, ('user', 'pass'))
+
+    assert success is True
+    assert response == '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+    headers, body = RecordingHandler.requests[0]
+    assert headers['Authorization'].startswith('Basic ')
+    message = email.message_from_bytes(f"Content-Type: {headers['Content-Type']}\r\n\r\n".encode() + body)
+    parts = {part.get_param('name', header='content-disposition'): part for part in message.get_payload()}
+    assert parts['file'].get_filename() == 'doc.pdf'
+    assert parts['file'].get_payload(decode=True) == b'data'
+    assert parts['metadata'].get_content_type() == 'application/json'
+    assert parts['metadata'].get_payload(decode=True) == b'{"a": 1}'
+
+
+def test_try_post_retries_retryable_statuses_and_resends_the_body(http_server):
+    port = http_server.server_address[1]
+    RecordingHandler.statuses = [503]
+
+    success, _ = post(port, {'file': ('doc.pdf', b'data')}, numtimes=2)
+
+    assert success is True
+    assert len(RecordingHandler.requests) == 2
+    assert RecordingHandler.requests[0][1] and RecordingHandler.requests[1][1]
+
+
+def test_try_post_does_not_retry_client_errors(http_server):
+    port = http_server.server_address[1]
+    RecordingHandler.statuses = [400]
+
+    success, response = post(port, {'file': ('doc.pdf', b'data')}, numtimes=3)
+
+    assert success is False
+    assert response == 'FAILED TO POST. Response status-code: 400'
+    assert len(RecordingHandler.requests) == 1
+
+
+def test_try_post_does_not_resend_a_post_that_failed_on_the_server(http_server):
+    port = http_server.server_address[1]
+    RecordingHandler.statuses = [500]
+
+    success, response = post(port, {'file': ('doc.pdf', b'data')}, numtimes=3)
+
+    assert success is False
+    assert response == 'FAILED TO POST. Response status-code: 500'
+    assert len(RecordingHandler.requests) == 1
+
+
+def test_try_post_does_not_send_anything_after_the_deadline(http_server):
+    port = http_server.server_address[1]
+
+    success, response = post(port, {'file': ('doc.pdf', b'data')}, deadline=Deadline.after(-1))
+
+    assert success is False
+    assert 'Deadline exceeded' in response
+    assert len(RecordingHandler.requests) == 0
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+from dart_lambdas.common.batch import run_batch, run_concurrently, MicroBatcher
+
+
+def test_run_batch_returns_results_in_input_order():
+    def batch_function(item):
+        time.sleep(0.01 * (5 - item))
+        return True, item * 2
+
+    assert run_batch(batch_function, [1, 2, 3, 4], 4) == [(True, 2), (True, 4), (True, 6), (True, 8)]
+
+
+def test_run_batch_reports_exceptions_per_item():
+    def batch_function(item):
+        if item == 2:
+            raise Exception("bad item")
+        return True, item
+
+    assert run_batch(batch_function, [1, 2, 3], 2) == [(True, 1), (False, 'Exception: bad item'), (True, 3)]
+
+
+def test_run_batch_never_exceeds_max_workers():
+    lock = threading.Lock()
+    active = [0]
+    max_active = [0]
+
+    def batch_function(item):
+        with lock:
+            active[0] += 1
+            max_active[0] = max(max_active[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return True, item
+
+    assert len(run_batch(batch_function, range(12), 3)) == 12
+    assert 1 < max_active[0] <= 3
+
+
+def test_run_batch_requires_at_least_one_worker():
+    with pytest.raises(Exception) as excinfo:
+        run_batch(lambda item: (True, item), [1], 0)
+
+    assert "max_workers must be greater than 0" in str(excinfo.value)
+
+
+def test_run_concurrently_overlaps_calls_and_returns_results_in_order():
+    # Each call waits for the other, so this only completes if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+
+    def call(result):
+        barrier.wait()
+        return result
+
+    assert run_concurrently(lambda: call('first'), lambda: call('second')) == ['first', 'second']
+
+
+def test_run_concurrently_reraises_the_first_exception_after_all_calls_finish():
+    finished = []
+
+    def failing_call():
+        raise Exception("first failure")
+
+    def slow_call():
+        time.sleep(0.05)
+        finished.append(True)
+        return True
+
+    with pytest.raises(Exception) as excinfo:
+        run_concurrently(failing_call, slow_call)
+
+    assert "first failure" in str(excinfo.value)
+    assert finished == [True]
+
+
+def submit_concurrently(batcher, items, sizes=None):
+    sizes = sizes or [0] * len(items)
+    return run_batch(lambda item: batcher.submit(item[0], item[1]), list(zip(items, sizes)), len(items))
+
+
+def test_micro_batcher_flushes_full_batches_and_returns_each_item_its_result():
+    batches = []
+
+    def flush(items):
+        batches.append(sorted(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(flush, max_items=2, linger=5)
+
+    start = time.monotonic()
+    assert submit_concurrently(batcher, [1, 2, 3, 4]) == [2, 4, 6, 8]
+
+    # Full batches don't wait for the linger to run out
+    assert time.monotonic() - start < 5
+    assert sorted(len(batch) for batch in batches) == [2, 2]
+
+
+def test_micro_batcher_flushes_a_partial_batch_after_the_linger():
+    batches = []
+
+    def flush(items):
+        batches.append(items)
+        return items
+
+    batcher = MicroBatcher(flush, max_items=10, linger=0.05)
+
+    assert batcher.submit('only') == 'only'
+    assert batches == [['only']]
+
+
+def test_micro_batcher_starts_a_new_batch_rather_than_exceed_max_bytes():
+    batches = []
+
+    def flush(items):
+        batches.append(items)
+        return items
+
+    batcher = MicroBatcher(flush, max_items=10, max_bytes=100, linger=0.05)
+
+    assert submit_concurrently(batcher, ['a', 'b', 'c'], [60, 60, 60]) == ['a', 'b', 'c']
+    assert sorted(len(batch) for batch in batches) == [1, 1, 1]
+
+
+def test_micro_batcher_raises_flush_failures_for_every_item_in_the_batch():
+    def flush(items):
+        raise Exception("batch failed")
+
+    batcher = MicroBatcher(flush, max_items=2, linger=5)
+
+    assert submit_concurrently(batcher, [1, 2]) == [(False, 'Exception: batch failed')] * 2
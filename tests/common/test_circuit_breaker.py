@@ -0,0 +1,83 @@
+import mock
+
+from dart_lambdas.common.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+def fake_clock():
+    now = [1000.0]
+    return now, mock.patch('dart_lambdas.common.circuit_breaker.time.monotonic', side_effect=lambda: now[0])
+
+
+def test_circuit_opens_once_enough_calls_fail():
+    breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=4)
+
+    for success in [True, False, True]:
+        assert breaker.allow()
+        breaker.record(success)
+    assert breaker.state == CLOSED
+
+    assert breaker.allow()
+    breaker.record(False)
+
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_circuit_counts_slow_calls_as_failures():
+    breaker = CircuitBreaker('test', min_calls=2, slow_call=1)
+
+    breaker.record(True, duration=5)
+    breaker.record(True, duration=5)
+
+    assert breaker.state == OPEN
+
+
+def test_circuit_measures_slowness_per_mib_sent_and_ignores_it_by_default():
+    breaker = CircuitBreaker('test', min_calls=2, slow_call=1)
+
+    breaker.record(True, duration=50, size=100 * 1024 ** 2)
+    breaker.record(True, duration=50, size=100 * 1024 ** 2)
+    assert breaker.state == CLOSED
+
+    breaker = CircuitBreaker('test', min_calls=2)
+
+    breaker.record(True, duration=3600)
+    breaker.record(True, duration=3600)
+    assert breaker.state == CLOSED
+
+
+def test_circuit_forgets_outcomes_older_than_the_window():
+    now, clock = fake_clock()
+    with clock:
+        breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=2, window=10)
+        breaker.record(False)
+
+        now[0] += 11
+        breaker.record(True)
+        breaker.record(True)
+
+        assert breaker.state == CLOSED
+
+
+def test_circuit_lets_one_trial_call_through_after_open_duration():
+    now, clock = fake_clock()
+    with clock:
+        breaker = CircuitBreaker('test', min_calls=1, open_duration=30)
+        breaker.record(False)
+        assert not breaker.allow()
+
+        now[0] += 30
+        assert breaker.allow()
+        assert breaker.state == HALF_OPEN
+        assert not breaker.allow()
+
+        # A failed trial reopens the circuit for another open duration
+        breaker.record(False)
+        assert breaker.state == OPEN
+        assert not breaker.allow()
+
+        now[0] += 30
+        assert breaker.allow()
+        breaker.record(True)
+        assert breaker.state == CLOSED
+        assert breaker.allow()
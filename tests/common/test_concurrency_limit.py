@@ -0,0 +1,96 @@
+import threading
+
+import mock
+
+from dart_lambdas.common.concurrency_limit import AimdLimiter
+from dart_lambdas.common.deadline import Deadline
+
+
+def fake_clock():
+    now = [1000.0]
+    return now, mock.patch('dart_lambdas.common.concurrency_limit.time.monotonic', side_effect=lambda: now[0])
+
+
+def test_limiter_halves_the_limit_on_failure_and_grows_it_back_slowly():
+    limiter = AimdLimiter(min_limit=1, max_limit=8)
+
+    assert limiter.acquire()
+    limiter.release(False)
+    assert limiter.limit == 4
+
+    for _ in range(4):
+        assert limiter.acquire()
+        limiter.release(True)
+    assert 4.9 < limiter.limit < 5
+
+
+def test_limiter_treats_slow_calls_as_failures_and_never_goes_below_min():
+    now, clock = fake_clock()
+    with clock:
+        limiter = AimdLimiter(min_limit=2, max_limit=8, slow_call=1)
+
+        for _ in range(5):
+            assert limiter.acquire()
+            now[0] += 2
+            limiter.release(True, duration=2)
+
+        assert limiter.limit == 2
+
+
+def test_limiter_allows_slow_calls_more_time_per_mib_sent_and_ignores_them_by_default():
+    limiter = AimdLimiter(max_limit=8, slow_call=1)
+
+    assert limiter.acquire()
+    limiter.release(True, duration=50, size=100 * 1024 ** 2)
+    assert limiter.limit > 8 - 1
+
+    limiter = AimdLimiter(max_limit=8)
+
+    assert limiter.acquire()
+    limiter.release(True, duration=3600)
+    assert limiter.limit == 8
+
+
+def test_limiter_backs_off_once_for_failures_of_calls_in_flight_together():
+    now, clock = fake_clock()
+    with clock:
+        limiter = AimdLimiter(min_limit=1, max_limit=8)
+        for _ in range(4):
+            assert limiter.acquire()
+
+        now[0] += 1
+        for _ in range(4):
+            limiter.release(False, duration=1)
+        assert limiter.limit == 4
+
+        # A call made after backing off that fails too backs off again
+        assert limiter.acquire()
+        now[0] += 1
+        limiter.release(False, duration=1)
+        assert limiter.limit == 2
+
+
+def test_limiter_leaves_the_limit_alone_for_unused_slots():
+    limiter = AimdLimiter(max_limit=8)
+
+    assert limiter.acquire()
+    limiter.release()
+
+    assert limiter.limit == 8
+    assert limiter.in_flight == 0
+
+
+def test_limiter_makes_callers_wait_for_a_free_slot_until_the_deadline():
+    limiter = AimdLimiter(min_limit=1, max_limit=1)
+    assert limiter.acquire()
+
+    assert not limiter.acquire(Deadline.after(0.05))
+
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(limiter.acquire(Deadline.after(5))))
+    waiter.start()
+    limiter.release(True)
+    waiter.join()
+
+    assert acquired == [True]
+    assert limiter.in_flight == 1
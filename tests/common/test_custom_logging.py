@@ -0,0 +1,112 @@
+import json
+
+import pytest
+from dart_lambdas.common import custom_logging
+from dart_lambdas.common.custom_logging import get_logger, log_environment, set_log_context, LOG, REDACTED
+
+
+@pytest.fixture(scope='function', autouse=True)
+def clean_logging(monkeypatch):
+    monkeypatch.delenv('LOG_LEVEL', raising=False)
+    monkeypatch.delenv('LOGGING', raising=False)
+    monkeypatch.delenv('LOG_EVENT_SAMPLE_RATE', raising=False)
+    monkeypatch.setattr(custom_logging, '_environment_logged', False)
+    set_log_context()
+    yield
+    set_log_context()
+
+
+def log_lines(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+class CountingFormat:
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "formatted"
+
+
+def test_logger_writes_structured_json_lines(monkeypatch, capsys):
+    monkeypatch.setenv('LOG_LEVEL', 'INFO')
+    set_log_context(aws_request_id='request-1')
+
+    get_logger('test').info('posting %s to %s', 'doc.pdf', 'ladle', key='doc.pdf.raw')
+
+    [line] = log_lines(capsys)
+    assert line['level'] == 'INFO'
+    assert line['logger'] == 'test'
+    assert line['message'] == 'posting doc.pdf to ladle'
+    assert line['key'] == 'doc.pdf.raw'
+    assert line['aws_request_id'] == 'request-1'
+    assert 'timestamp' in line
+
+
+def test_logger_does_not_format_messages_below_its_level(monkeypatch, capsys):
+    monkeypatch.setenv('LOG_LEVEL', 'WARNING')
+    argument = CountingFormat()
+    logger = get_logger('test')
+
+    logger.debug('value: %s', argument)
+    logger.info('value: %s', argument)
+    assert argument.formatted == 0
+    assert capsys.readouterr().out == ''
+
+    logger.warning('value: %s', argument)
+    assert argument.formatted == 1
+    assert log_lines(capsys)[0]['message'] == 'value: formatted'
+
+
+def test_logging_on_enables_debug_and_off_logs_only_warnings(monkeypatch, capsys):
+    LOG("hidden")
+    get_logger('test').error("shown")
+    assert [line['message'] for line in log_lines(capsys)] == ['shown']
+
+    monkeypatch.setenv('LOGGING', 'ON')
+    LOG("shown")
+    assert [line['message'] for line in log_lines(capsys)] == ['shown']
+
+
+def test_logger_redacts_secret_fields(monkeypatch, capsys):
+    monkeypatch.setenv('LOG_LEVEL', 'DEBUG')
+
+    get_logger('test').debug('auth', BAUTH_PASSWORD='hunter2', config={'api_token': 'abc', 'url': 'http://ladle'})
+
+    [line] = log_lines(capsys)
+    assert line['BAUTH_PASSWORD'] == REDACTED
+    assert line['config'] == {'api_token': REDACTED, 'url': 'http://ladle'}
+
+
+def test_log_environment_logs_event_and_redacted_environment_once(monkeypatch, capsys):
+    monkeypatch.setenv('LOGGING', 'ON')
+    monkeypatch.setenv('BAUTH_PASSWORD', 'hunter2')
+    monkeypatch.setenv('DART_URL', 'http://ladle')
+
+    log_environment({'Records': []})
+    log_environment({'Records': [1]})
+
+    lines = log_lines(capsys)
+    assert [line['message'] for line in lines] == ['event', 'environment', 'event']
+    assert lines[0]['event'] == {'Records': []}
+    assert lines[1]['environment']['BAUTH_PASSWORD'] == REDACTED
+    assert lines[1]['environment']['DART_URL'] == 'http://ladle'
+    assert 'hunter2' not in json.dumps(lines)
+
+
+def test_log_environment_samples_event_dumps(monkeypatch, capsys):
+    monkeypatch.setenv('LOGGING', 'ON')
+    monkeypatch.setenv('LOG_EVENT_SAMPLE_RATE', '0')
+    monkeypatch.setattr(custom_logging, '_environment_logged', True)
+
+    for _ in range(20):
+        log_environment({'Records': []})
+
+    assert capsys.readouterr().out == ''
+
+
+def test_log_environment_does_nothing_unless_debugging(capsys):
+    log_environment({'Records': []})
+
+    assert capsys.readouterr().out == ''
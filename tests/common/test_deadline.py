@@ -0,0 +1,61 @@
+import time
+
+import pytest
+from dart_lambdas.common.deadline import Deadline, DeadlineExceeded, NO_DEADLINE
+
+
+class FakeLambdaContext:
+    def __init__(self, remaining_millis):
+        self.remaining_millis = remaining_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis
+
+
+def test_deadline_from_lambda_context_keeps_a_reserve():
+    deadline = Deadline.from_lambda_context(FakeLambdaContext(10000), reserve=2)
+
+    assert 7.9 < deadline.remaining() <= 8
+    assert not deadline.expired()
+
+
+def test_deadline_without_lambda_context_never_expires():
+    deadline = Deadline.from_lambda_context(None, reserve=2)
+
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    assert deadline.has_at_least(1000000)
+    assert deadline.timeout(60) == 60
+    assert deadline.minus(10).remaining() is None
+
+
+def test_deadline_shrinks_timeouts_to_the_time_remaining():
+    deadline = Deadline.after(2)
+
+    assert deadline.timeout(1) == 1
+    assert 1.9 < deadline.timeout(60) <= 2
+    assert 0.9 < deadline.minus(1).remaining() <= 1
+
+
+def test_deadline_expires():
+    deadline = Deadline.after(0.01)
+    time.sleep(0.02)
+
+    assert deadline.expired()
+    assert deadline.remaining() == 0
+    assert deadline.timeout(60) == 0
+    assert not deadline.has_at_least(0.001)
+
+    with pytest.raises(DeadlineExceeded) as excinfo:
+        deadline.check('posting')
+
+    assert "Deadline exceeded before posting" in str(excinfo.value)
+    NO_DEADLINE.check('posting')
+
+
+def test_earliest_deadline_ignores_deadlines_without_expiry():
+    soon = Deadline.after(1)
+    later = Deadline.after(10)
+
+    assert Deadline.earliest([later, NO_DEADLINE, soon]).expires_at == soon.expires_at
+    assert Deadline.earliest([NO_DEADLINE]).remaining() is None
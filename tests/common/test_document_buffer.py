@@ -0,0 +1,97 @@
+import io
+import mmap
+import tempfile
+
+import mock
+import pytest
+
+from dart_lambdas.common.document_buffer import DocumentBuffer, replayable, replayable_documents, configure_document_buffers
+from dart_lambdas.common.multipart import SizedStream
+
+TEST_DATA = bytes(range(256)) * 100
+
+
+def sized_stream(data=TEST_DATA):
+    return SizedStream(io.BytesIO(data), len(data))
+
+
+def test_document_buffer_keeps_small_documents_in_memory_and_can_be_read_again():
+    with mock.patch('dart_lambdas.common.document_buffer.tempfile.TemporaryFile') as temporary_file_mocker:
+        with DocumentBuffer(sized_stream()) as buffer:
+            assert len(buffer) == len(TEST_DATA)
+            assert buffer.read(1000) == TEST_DATA[:1000]
+
+            buffer.seek(0)
+            assert buffer.read() == TEST_DATA
+            assert buffer.read() == b''
+            assert buffer.complete is True
+
+            buffer.seek(10)
+            assert buffer.read_view(20) == TEST_DATA[10:30]
+
+    assert not temporary_file_mocker.called
+
+
+def test_document_buffer_spills_large_documents_to_a_memory_mapped_file(tmp_path):
+    with mock.patch('dart_lambdas.common.document_buffer.tempfile.TemporaryFile', wraps=tempfile.TemporaryFile) as temporary_file_mocker:
+        buffer = DocumentBuffer.from_stream(sized_stream(), memory_limit=1000, directory=str(tmp_path))
+
+    temporary_file_mocker.assert_called_once_with(dir=str(tmp_path))
+    assert buffer.view() == TEST_DATA
+    # Reads of a complete document are views of the mapped file, not copies
+    assert isinstance(buffer.read_view(100).obj, mmap.mmap)
+    buffer.seek(0)
+    assert buffer.read() == TEST_DATA
+    buffer.close()
+
+
+def test_document_buffer_rereads_what_it_spilled_before_the_document_is_complete(tmp_path):
+    large_data = TEST_DATA * 100
+    buffer = DocumentBuffer(sized_stream(large_data), memory_limit=1000, directory=str(tmp_path))
+
+    assert buffer.read(5000) == large_data[:5000]
+    buffer.seek(500)
+    assert buffer.read(1000) == large_data[500:1500]
+    assert buffer.complete is False
+    buffer.seek(4000)
+    assert buffer.read() == large_data[4000:]
+    assert buffer.complete is True
+    buffer.close()
+
+
+def test_document_buffer_raises_when_the_source_is_shorter_than_declared():
+    with pytest.raises(Exception, match='Document ended 10 bytes before its declared length of 20'):
+        DocumentBuffer.from_stream(io.BytesIO(b'x' * 10), length=20)
+
+
+def test_replayable_only_buffers_streams_that_can_not_be_rewound():
+    assert replayable(b'data') == b'data'
+    seekable = io.BytesIO(b'data')
+    assert replayable(seekable) is seekable
+
+    buffer = replayable(sized_stream())
+    assert isinstance(buffer, DocumentBuffer)
+    buffer.close()
+
+
+def test_replayable_documents_are_only_kept_if_there_is_room_for_all_of_them(tmp_path):
+    configure_document_buffers(memory_limit=1024, directory=str(tmp_path))
+    free = len(TEST_DATA) * 3 // 2
+
+    with mock.patch('dart_lambdas.common.document_buffer.shutil.disk_usage', return_value=mock.Mock(free=free)):
+        first = replayable(sized_stream())
+        assert isinstance(first, DocumentBuffer)
+
+        # The first document's space is promised until it is closed
+        assert replayable_documents([b'data', sized_stream()]) is None
+        first.close()
+
+        buffers = replayable_documents([b'data', sized_stream()])
+        assert buffers[0] == b'data'
+        assert isinstance(buffers[1], DocumentBuffer)
+        buffers[1].close()
+
+        assert replayable_documents([sized_stream(), sized_stream()]) is None
+
+    assert replayable_documents([io.RawIOBase()]) is None
+    configure_document_buffers()
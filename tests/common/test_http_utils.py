@@ -0,0 +1,226 @@
+import io
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from dart_lambdas.common.deadline import Deadline
+from dart_lambdas.common.document_buffer import DocumentBuffer
+from dart_lambdas.common.http_utils import try_post, try_get, get_http_session, reset_http_session, request_timeout, \
+    is_server_failure, is_connect_failure, configure_http
+from dart_lambdas.common.multipart import SizedStream
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    client_ports = []
+    requests = []
+    statuses = []
+    delays = []
+
+    def do_POST(self):
+        RecordingHandler.requests.append((dict(self.headers), self.rfile.read(int(self.headers['Content-Length']))))
+        self.respond()
+
+    def do_GET(self):
+        self.respond()
+
+    def respond(self):
+        RecordingHandler.client_ports.append(self.client_address[1])
+        if RecordingHandler.delays:
+            time.sleep(RecordingHandler.delays.pop(0))
+        body = b'{ "document_id": "02fda3137e912f948c337263d790698a" }'
+        self.send_response(RecordingHandler.statuses.pop(0) if RecordingHandler.statuses else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='function')
+def http_server():
+    RecordingHandler.client_ports = []
+    RecordingHandler.requests = []
+    RecordingHandler.statuses = []
+    RecordingHandler.delays = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RecordingHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    reset_http_session()
+    yield server
+    reset_http_session()
+    server.shutdown()
+    server.server_close()
+
+
+def test_try_post_and_try_get_reuse_the_same_connection(http_server):
+    port = http_server.server_address[1]
+
+    for _ in range(3):
+        success, response = try_post('http://127.0.0.1', port, '/submit', {'file': ('doc.pdf', b'data')}, None, None, 0, 1)
+        assert success is True
+        assert response == '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+    success, response = try_get('http://127.0.0.1', port, '/status', None, 0, 1)
+    assert success is True
+
+    assert len(RecordingHandler.client_ports) == 4
+    assert len(set(RecordingHandler.client_ports)) == 1
+
+
+def test_try_post_streams_file_contents_with_a_content_length(http_server):
+    port = http_server.server_address[1]
+    test_data = b"0123456789" * 100000
+    post_files = {
+        'file': ('doc.pdf', SizedStream(io.BytesIO(test_data), len(test_data))),
+        'metadata': (None, '{"a": 1}', 'application/json'),
+    }
+
+    success, response = try_post('http://127.0.0.1', port, '/submit', post_files, None, ('user', 'pass'), 0, 1)
+
+    assert success is True
+    headers, body = RecordingHandler.requests[0]
+    assert headers['Content-Type'].startswith('multipart/form-data; boundary=')
+    assert 'Transfer-Encoding' not in headers
+    assert int(headers['Content-Length']) == len(body)
+    assert headers['Authorization'].startswith('Basic ')
+    assert test_data in body
+    assert b'{"a": 1}' in body
+
+
+def test_try_post_retries_retryable_statuses_and_replays_the_body(http_server):
+    port = http_server.server_address[1]
+    RecordingHandler.statuses = [503, 429]
+
+    success, response = try_post('http://127.0.0.1', port, '/submit', {'file': ('doc.pdf', b'data')}, None, None, 0, 3)
+
+    assert success is True
+    assert len(RecordingHandler.requests) == 3
+    assert len(set(body for _, body in RecordingHandler.requests)) == 1
+
+
+def test_try_post_replays_a_streamed_document_kept_in_a_document_buffer(http_server, tmp_path):
+    port = http_server.server_address[1]
+    RecordingHandler.statuses = [503]
+    test_data = b"0123456789" * 100000
+    document = DocumentBuffer(SizedStream(io.BytesIO(test_data), len(test_data)), memory_limit=1024, directory=str(tmp_path))
+
+    success, response = try_post('http://127.0.0.1', port, '/submit', {'file': ('doc.pdf', document)}, None, None, 0, 2)
+    document.close()
+
+    assert success is True
+    assert len(RecordingHandler.requests) == 2
+    assert len(set(body for _, body in RecordingHandler.requests)) == 1
+    assert test_data in RecordingHandler.requests[1][1]
+
+
+def test_try_post_does_not_retry_client_errors(http_server):
+    port = http_server.server_address[1]
+    RecordingHandler.statuses = [400]
+
+    success, response = try_post('http://127.0.0.1', port, '/submit', {'file': ('doc.pdf', b'data')}, None, None, 0, 3)
+
+    assert success is False
+    assert response == "FAILED TO POST. Response status-code: 400"
+    assert len(RecordingHandler.requests) == 1
+
+
+def test_try_post_does_not_resend_a_post_that_failed_on_the_server(http_server):
+    port = http_server.server_address[1]
+
+    for status in [500, 502, 504]:
+        RecordingHandler.requests = []
+        RecordingHandler.statuses = [status]
+
+        success, response = try_post('http://127.0.0.1', port, '/submit', {'file': ('doc.pdf', b'data')}, None, None, 0, 3)
+
+        assert success is False
+        assert response == f"FAILED TO POST. Response status-code: {status}"
+        assert len(RecordingHandler.requests) == 1
+
+
+def test_try_post_reports_last_status_when_out_of_attempts(http_server):
+    port = http_server.server_address[1]
+    RecordingHandler.statuses = [503, 503, 503]
+
+    success, response = try_post('http://127.0.0.1', port, '/submit', {'file': ('doc.pdf', b'data')}, None, None, 0, 2)
+
+    assert success is False
+    assert response == "FAILED TO POST. Response status-code: 503"
+    assert len(RecordingHandler.requests) == 2
+
+
+def test_try_post_does_not_resend_a_post_the_server_was_slow_to_answer(http_server):
+    port = http_server.server_address[1]
+    configure_http(read_timeout=0.2)
+    RecordingHandler.delays = [1]
+
+    success, response = try_post('http://127.0.0.1', port, '/submit', {'file': ('doc.pdf', b'data')}, None, None, 0, 3)
+    configure_http()
+
+    assert success is False
+    assert response.startswith("FAILED TO POST. Exception: ")
+    assert len(RecordingHandler.requests) == 1
+
+
+def test_only_failures_to_connect_are_connect_failures():
+    with pytest.raises(requests.exceptions.ConnectionError) as refused:
+        requests.post('http://127.0.0.1:1/submit', timeout=1)
+
+    assert is_connect_failure(refused.value)
+    assert is_connect_failure(requests.exceptions.ConnectTimeout())
+    assert not is_connect_failure(requests.exceptions.ReadTimeout())
+    assert not is_connect_failure(requests.exceptions.ConnectionError('Connection aborted.'))
+
+
+def test_try_post_does_not_send_anything_after_the_deadline(http_server):
+    port = http_server.server_address[1]
+
+    success, response = try_post('http://127.0.0.1', port, '/submit', {'file': ('doc.pdf', b'data')}, None, None, 0, 3,
+                                 deadline=Deadline.after(0))
+
+    assert success is False
+    assert response == "FAILED TO POST. Exception: Deadline exceeded before posting"
+    assert len(RecordingHandler.requests) == 0
+
+
+def test_request_timeout_is_shortened_to_the_deadline():
+    configure_http(connect_timeout=3, read_timeout=60)
+
+    assert request_timeout() == (3, 60)
+
+    connect_timeout, read_timeout = request_timeout(Deadline.after(10))
+    assert connect_timeout == 3
+    assert 9.9 < read_timeout <= 10
+    configure_http()
+
+
+def test_concurrent_threads_get_their_own_session_sharing_one_pool(http_server):
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(get_http_session())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(id(session) for session in sessions)) == 4
+    assert len(set(id(session.get_adapter('http://')) for session in sessions)) == 1
+
+
+def test_get_http_session_uses_configured_pool_size():
+    get_http_session()
+    configure_http(max_pool_connections=3)
+
+    assert get_http_session().get_adapter('https://')._pool_maxsize == 3
+    configure_http()
+
+
+def test_is_server_failure_only_blames_the_server_for_unreachable_or_retryable_responses():
+    assert is_server_failure('FAILED TO POST. Response status-code: 503')
+    assert is_server_failure('FAILED TO POST. Response status-code: 429')
+    assert is_server_failure('FAILED TO POST. Exception: Connection refused')
+    assert not is_server_failure('FAILED TO POST. Response status-code: 400')
+    assert not is_server_failure('FAILED TO POST. Exception: Deadline exceeded before posting')
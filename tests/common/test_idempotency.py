@@ -0,0 +1,122 @@
+import boto3
+import botocore.exceptions
+import mock
+from moto import mock_s3
+
+from dart_lambdas.common.idempotency import idempotency_key, md5_from_etag, InMemoryIdempotencyStore, S3IdempotencyStore, \
+    TieredIdempotencyStore, get_idempotency_store, set_idempotency_store, configure_idempotency_store
+from dart_lambdas.common.s3_utils import reset_s3_client
+
+
+def test_idempotency_key_ignores_etag_quotes_but_not_etag_value():
+    assert idempotency_key('bucket', 'a.pdf.raw', '"abc"') == idempotency_key('bucket', 'a.pdf.raw', 'abc')
+    assert idempotency_key('bucket', 'a.pdf.raw', 'abc') != idempotency_key('bucket', 'a.pdf.raw', 'abd')
+
+
+def test_md5_from_etag_only_accepts_single_part_etags():
+    assert md5_from_etag({'ETag': '"D41D8CD98F00B204E9800998ECF8427E"'}) == 'd41d8cd98f00b204e9800998ecf8427e'
+    assert md5_from_etag({'ETag': 'd41d8cd98f00b204e9800998ecf8427e-3'}) is None
+    assert md5_from_etag({}) is None
+
+
+def test_md5_from_etag_only_accepts_etags_of_objects_without_kms_or_customer_keys():
+    etag = '"d41d8cd98f00b204e9800998ecf8427e"'
+
+    assert md5_from_etag({'ETag': etag, 'ServerSideEncryption': 'AES256'}) == 'd41d8cd98f00b204e9800998ecf8427e'
+    assert md5_from_etag({'ETag': etag, 'ServerSideEncryption': 'aws:kms'}) is None
+    assert md5_from_etag({'ETag': etag, 'ServerSideEncryption': 'aws:kms:dsse'}) is None
+    assert md5_from_etag({'ETag': etag, 'ServerSideEncryption': 'AES256', 'SSECustomerAlgorithm': 'AES256'}) is None
+
+
+def test_in_memory_store_evicts_least_recently_used_entry():
+    store = InMemoryIdempotencyStore(max_size=2)
+    store.put('a', 1)
+    store.put('b', 2)
+    assert store.get('a') == 1
+
+    store.put('c', 3)
+
+    assert store.get('a') == 1
+    assert store.get('b') is None
+    assert store.get('c') == 3
+
+
+def test_in_memory_store_expires_entries_after_ttl():
+    now = [1000.0]
+    with mock.patch('dart_lambdas.common.idempotency.time.monotonic', side_effect=lambda: now[0]):
+        store = InMemoryIdempotencyStore(ttl=10)
+        store.put('a', 1)
+
+        now[0] += 9
+        assert store.get('a') == 1
+
+        now[0] += 1
+        assert store.get('a') is None
+
+
+def test_tiered_store_copies_hits_into_faster_stores():
+    fast = InMemoryIdempotencyStore()
+    slow = InMemoryIdempotencyStore()
+    slow.put('a', 1)
+    store = TieredIdempotencyStore([fast, slow])
+
+    assert store.get('a') == 1
+    assert fast.get('a') == 1
+    assert store.get('b') is None
+
+    store.put('b', 2)
+    assert fast.get('b') == 2
+    assert slow.get('b') == 2
+
+
+def test_s3_store_round_trips_entries(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    with mock_s3():
+        reset_s3_client()
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='idempotency-bucket')
+        store = S3IdempotencyStore('idempotency-bucket')
+
+        assert store.get('test-bucket/a.pdf.raw#abc') is None
+        store.put('test-bucket/a.pdf.raw#abc', 'doc-id')
+        assert store.get('test-bucket/a.pdf.raw#abc') == 'doc-id'
+        assert S3IdempotencyStore('idempotency-bucket').get('test-bucket/a.pdf.raw#abd') is None
+
+    reset_s3_client()
+
+
+def test_s3_store_treats_unreadable_entries_as_misses(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    with mock_s3():
+        reset_s3_client()
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        s3_client.create_bucket(Bucket='idempotency-bucket')
+        store = S3IdempotencyStore('idempotency-bucket')
+        s3_client.put_object(Bucket='idempotency-bucket', Key=store._object_key('test-bucket/a.pdf.raw#abc'), Body=b'{ not json')
+
+        assert store.get('test-bucket/a.pdf.raw#abc') is None
+
+        with mock.patch('dart_lambdas.common.idempotency.get_s3_client') as get_s3_client_mocker:
+            get_s3_client_mocker.return_value.get_object.side_effect = botocore.exceptions.EndpointConnectionError(endpoint_url='https://s3')
+            assert store.get('test-bucket/a.pdf.raw#abc') is None
+
+    reset_s3_client()
+
+
+def test_get_idempotency_store_adds_s3_store_only_if_bucket_is_set():
+    configure_idempotency_store()
+    set_idempotency_store(None)
+    assert len(get_idempotency_store().stores) == 1
+
+    configure_idempotency_store(bucket='idempotency-bucket')
+    stores = get_idempotency_store().stores
+    assert isinstance(stores[0], InMemoryIdempotencyStore)
+    assert isinstance(stores[1], S3IdempotencyStore) and stores[1].bucket == 'idempotency-bucket'
+
+    configure_idempotency_store()
+    set_idempotency_store(None)
@@ -0,0 +1,69 @@
+import json
+import threading
+import time
+
+from dart_lambdas.common.metrics import create_metrics, NULL_METRICS, BYTES
+
+
+def test_create_metrics_returns_null_metrics_unless_enabled(monkeypatch):
+    monkeypatch.delenv('METRICS', raising=False)
+
+    assert create_metrics(Function='test') is NULL_METRICS
+
+
+def test_metrics_are_emitted_in_embedded_metric_format(monkeypatch, capsys):
+    monkeypatch.setenv('METRICS', 'ON')
+    monkeypatch.setenv('METRICS_NAMESPACE', 'Test/Namespace')
+    metrics = create_metrics(Function='test')
+
+    with metrics.time('Post'):
+        time.sleep(0.01)
+    metrics.add('RawBytes', 1024, BYTES)
+    retried = metrics.counter('FetchRawRetries')
+    retried(1)
+    retried(2)
+
+    metrics.emit()
+    emf = json.loads(capsys.readouterr().out)
+
+    assert emf['_aws']['CloudWatchMetrics'] == [{
+        'Namespace': 'Test/Namespace',
+        'Dimensions': [['Function']],
+        'Metrics': [
+            {'Name': 'PostLatency', 'Unit': 'Milliseconds'},
+            {'Name': 'RawBytes', 'Unit': 'Bytes'},
+            {'Name': 'FetchRawRetries', 'Unit': 'Count'},
+        ],
+    }]
+    assert isinstance(emf['_aws']['Timestamp'], int)
+    assert emf['Function'] == 'test'
+    assert emf['PostLatency'] >= 10
+    assert emf['RawBytes'] == 1024
+    assert emf['FetchRawRetries'] == 2
+
+
+def test_metrics_can_be_recorded_from_several_threads(monkeypatch):
+    monkeypatch.setenv('METRICS', 'ON')
+    metrics = create_metrics(Function='test')
+
+    def record():
+        for _ in range(1000):
+            metrics.add('Count', 1)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert metrics.to_emf()['Count'] == 4000
+
+
+def test_null_metrics_do_nothing(capsys):
+    with NULL_METRICS.time('Post'):
+        pass
+    NULL_METRICS.add('RawBytes', 1024, BYTES)
+    NULL_METRICS.counter('FetchRawRetries')(1)
+    NULL_METRICS.emit()
+
+    assert capsys.readouterr().out == ''
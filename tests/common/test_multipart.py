@@ -0,0 +1,91 @@
+import io
+
+import pytest
+from urllib3.fields import RequestField
+from urllib3.filepost import encode_multipart_formdata
+
+from dart_lambdas.common.multipart import MultipartEncoder, SizedStream
+
+
+class OneShotStream:
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return self._data.read(size)
+
+
+def expected_body(boundary, fields):
+    request_fields = []
+    for name, filename, data, content_type in fields:
+        request_field = RequestField(name=name, data=data, filename=filename)
+        request_field.make_multipart(content_type=content_type)
+        request_fields.append(request_field)
+
+    return encode_multipart_formdata(request_fields, boundary=boundary)[0]
+
+
+def test_multipart_encoder_matches_requests_encoding():
+    test_data = b"this is a test" * 1000
+    encoder = MultipartEncoder({
+        'file': ('Test Sübmission.pdf', test_data),
+        'metadata': (None, '{"a": 1}', 'application/json'),
+    }, {'field': 'value'})
+
+    body = encoder.to_bytes()
+
+    assert body == expected_body(encoder.boundary, [
+        ('field', None, 'value', None),
+        ('file', 'Test Sübmission.pdf', test_data, None),
+        ('metadata', None, '{"a": 1}', 'application/json'),
+    ])
+    assert encoder.len == len(body)
+    assert encoder.content_type == f'multipart/form-data; boundary={encoder.boundary}'
+
+
+def test_multipart_encoder_streams_file_contents_in_chunks():
+    test_data = b"0123456789" * 1000
+    stream = OneShotStream(test_data)
+    encoder = MultipartEncoder({'file': ('doc.pdf', SizedStream(stream, len(test_data)))}, chunk_size=1000)
+
+    chunks = list(encoder)
+
+    assert b''.join(chunks) == expected_body(encoder.boundary, [('file', 'doc.pdf', test_data, None)])
+    assert max(len(chunk) for chunk in chunks) == 1000
+    assert stream.reads == 10
+    assert encoder.len == len(b''.join(chunks))
+
+
+def test_multipart_encoder_has_no_length_for_streams_of_unknown_size():
+    encoder = MultipartEncoder({'file': ('doc.pdf', OneShotStream(b"test"))})
+
+    assert not hasattr(encoder, 'len')
+    assert b"test" in encoder.to_bytes()
+
+
+def test_multipart_encoder_can_be_replayed_when_contents_are_seekable():
+    encoder = MultipartEncoder({'file': ('doc.pdf', io.BytesIO(b"test data"))})
+
+    assert encoder.to_bytes() == encoder.to_bytes()
+
+
+def test_multipart_encoder_refuses_to_replay_an_exhausted_sized_stream():
+    encoder = MultipartEncoder({'file': ('doc.pdf', SizedStream(OneShotStream(b"test data"), 9))})
+    encoder.to_bytes()
+
+    with pytest.raises(Exception) as excinfo:
+        encoder.to_bytes()
+
+    assert "produced 0 bytes but 9 were expected" in str(excinfo.value)
+
+
+def test_sized_stream_fails_when_stream_is_shorter_than_declared():
+    stream = SizedStream(OneShotStream(b"short"), 10)
+
+    with pytest.raises(Exception) as excinfo:
+        stream.read()
+        stream.read()
+
+    assert "ended 5 bytes before its declared length of 10" in str(excinfo.value)
@@ -1,5 +1,9 @@
+import asyncio
+
 import pytest
-from dart_lambdas.common.retry import retry
+from dart_lambdas.common import retry as retry_module
+from dart_lambdas.common.deadline import Deadline
+from dart_lambdas.common.retry import retry, retry_async, RetryPolicy
 
 counter = 3
 
@@ -84,3 +88,117 @@ def test_retry_pauses_between_tries():
         return arg1 + arg2
 
     assert retry(retry_function, [0,1], 5, None, 1000) == 1
+
+def test_retry_is_iterative_and_does_not_grow_the_stack():
+    calls = []
+
+    def retry_function():
+        calls.append(1)
+        if len(calls) < 5000:
+            raise Exception("not yet")
+        return "done"
+
+    assert retry(retry_function, [], 5000) == "done"
+    assert len(calls) == 5000
+
+def test_retry_policy_backs_off_exponentially_up_to_max_delay():
+    policy = RetryPolicy(10, base_delay=100, max_delay=1000, jitter=False)
+
+    assert [policy.delay(attempt) for attempt in range(1, 7)] == [100, 200, 400, 800, 1000, 1000]
+
+def test_retry_policy_uses_full_jitter():
+    policy = RetryPolicy(10, base_delay=100, max_delay=1000)
+
+    delays = [policy.delay(4) for _ in range(200)]
+
+    assert all(0 <= delay <= 800 for delay in delays)
+    assert len(set(delays)) > 100
+
+def test_retry_policy_sleeps_between_attempts(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(retry_module.time, 'sleep', lambda seconds: sleeps.append(seconds))
+    policy = RetryPolicy(4, base_delay=100, jitter=False)
+
+    with pytest.raises(Exception) as excinfo:
+        retry(lambda: (_ for _ in ()).throw(Exception("always fails")), [], policy=policy)
+
+    assert "always fails" in str(excinfo.value)
+    assert sleeps == [0.1, 0.2, 0.4]
+
+def test_retry_policy_stops_before_exceeding_max_elapsed(monkeypatch):
+    sleeps = []
+    clock = [0.0]
+
+    def fake_sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+
+    monkeypatch.setattr(retry_module.time, 'sleep', fake_sleep)
+    monkeypatch.setattr(retry_module.time, 'monotonic', lambda: clock[0])
+    policy = RetryPolicy(100, base_delay=100, jitter=False, max_elapsed=1000)
+
+    assert retry(lambda: 1, [], fail_check_fn=lambda res: True, policy=policy) == 1
+
+    # 100 + 200 + 400 fit within a second; the next wait of 800 would not
+    assert sleeps == [0.1, 0.2, 0.4]
+
+def test_retry_policy_does_not_retry_exceptions_it_classifies_as_permanent():
+    attempts = []
+
+    def retry_function():
+        attempts.append(1)
+        raise ValueError("permanent")
+
+    policy = RetryPolicy(5, retryable=lambda e: not isinstance(e, ValueError))
+
+    with pytest.raises(ValueError):
+        retry(retry_function, [], policy=policy)
+
+    assert len(attempts) == 1
+
+def test_retry_policy_does_not_wait_past_the_deadline():
+    attempts = []
+
+    def retry_function():
+        attempts.append(1)
+        raise Exception("still failing")
+
+    policy = RetryPolicy(100, base_delay=100, jitter=False)
+
+    with pytest.raises(Exception) as excinfo:
+        retry(retry_function, [], policy=policy, deadline=Deadline.after(0.5))
+
+    # waits of 100 and 200 fit in half a second; a further 400 would not
+    assert "still failing" in str(excinfo.value)
+    assert len(attempts) == 3
+
+def test_retry_async_retries_coroutines_without_blocking_the_event_loop(monkeypatch):
+    attempts = []
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(asyncio, 'sleep', fake_sleep)
+
+    async def retry_function(value):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Exception("not yet")
+        return value
+
+    policy = RetryPolicy(5, base_delay=100, jitter=False)
+
+    assert asyncio.run(retry_async(retry_function, {'value': 'done'}, policy=policy)) == 'done'
+    assert len(attempts) == 3
+    assert sleeps == [0.1, 0.2]
+
+def test_retry_async_uses_fail_check_and_gives_up_after_num_times():
+    attempts = []
+
+    async def retry_function():
+        attempts.append(1)
+        return False
+
+    assert asyncio.run(retry_async(retry_function, [], num_times=3, fail_check_fn=lambda res: res is False)) is False
+    assert len(attempts) == 3
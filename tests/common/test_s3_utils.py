@@ -0,0 +1,125 @@
+import threading
+import time
+
+import botocore.exceptions
+import pytest
+from dart_lambdas.common.s3_utils import get_s3_client, reset_s3_client, is_retryable_s3_error, byte_ranges, RangedStream, \
+    configure_s3_client
+
+
+def test_get_s3_client_returns_the_same_client_until_reset(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    reset_s3_client()
+
+    client = get_s3_client()
+    assert get_s3_client() is client
+
+    reset_s3_client()
+    assert get_s3_client() is not client
+    reset_s3_client()
+
+
+def test_get_s3_client_uses_configured_pool_size(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    get_s3_client()
+    configure_s3_client(max_pool_connections=7)
+
+    assert get_s3_client().meta.config.max_pool_connections == 7
+    configure_s3_client()
+    reset_s3_client()
+
+
+def test_get_s3_client_creates_one_client_when_called_concurrently(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    reset_s3_client()
+
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(get_s3_client())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(id(client) for client in clients)) == 1
+    reset_s3_client()
+
+
+def client_error(code, status_code):
+    return botocore.exceptions.ClientError(
+        {'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status_code}},
+        'GetObject',
+    )
+
+
+def test_is_retryable_s3_error_retries_throttling_and_server_errors():
+    assert is_retryable_s3_error(client_error('SlowDown', 503))
+    assert is_retryable_s3_error(client_error('InternalError', 500))
+    assert is_retryable_s3_error(client_error('SomethingNew', 502))
+    assert is_retryable_s3_error(botocore.exceptions.EndpointConnectionError(endpoint_url='https://s3'))
+
+
+def test_is_retryable_s3_error_does_not_retry_permanent_errors():
+    assert not is_retryable_s3_error(client_error('AccessDenied', 403))
+    assert not is_retryable_s3_error(client_error('NoSuchBucket', 404))
+    assert not is_retryable_s3_error(client_error('NoSuchKey', 404))
+    assert not is_retryable_s3_error(ValueError("bad argument"))
+
+
+def test_byte_ranges_cover_the_object_in_order():
+    assert byte_ranges(10, 4) == [(0, 3), (4, 7), (8, 9)]
+    assert byte_ranges(8, 4) == [(0, 3), (4, 7)]
+    assert byte_ranges(0, 4) == []
+
+
+def test_ranged_stream_reassembles_ranges_in_order_fetching_only_a_few_ahead():
+    data = bytes(range(256)) * 40
+    fetched = []
+    in_flight = [0]
+    most_in_flight = [0]
+    lock = threading.Lock()
+
+    def get_range(start, end):
+        with lock:
+            fetched.append(start)
+            in_flight[0] += 1
+            most_in_flight[0] = max(most_in_flight[0], in_flight[0])
+        # Later ranges come back first
+        time.sleep(0.01 if start == 0 else 0)
+        with lock:
+            in_flight[0] -= 1
+        return data[start:end + 1]
+
+    stream = RangedStream(get_range, len(data), 1000, 3)
+    time.sleep(0.05)
+
+    assert len(stream) == len(data)
+    assert len(fetched) == 3
+    assert stream.read(1500) == data[:1500]
+    assert stream.read() == data[1500:]
+    assert stream.read() == b''
+    assert sorted(fetched) == list(range(0, len(data), 1000))
+    assert most_in_flight[0] <= 3
+    stream.close()
+
+
+def test_ranged_stream_raises_when_a_range_can_not_be_fetched():
+    def get_range(start, end):
+        if start > 0:
+            raise botocore.exceptions.EndpointConnectionError(endpoint_url='https://s3')
+        return b'x' * (end - start + 1)
+
+    stream = RangedStream(get_range, 30, 10, 2)
+    stream.wait_for_first_range()
+
+    assert stream.read(10) == b'x' * 10
+    with pytest.raises(botocore.exceptions.EndpointConnectionError):
+        stream.read(10)
+    stream.close()
+
+
+def test_ranged_stream_raises_when_a_range_is_short():
+    stream = RangedStream(lambda start, end: b'x', 30, 10, 2)
+
+    with pytest.raises(Exception, match='Range 0-9 produced 1 bytes but 10 were expected'):
+        stream.read()
+    stream.close()
@@ -0,0 +1,27 @@
+import boto3
+from moto import mock_ssm
+
+from dart_lambdas.common.secrets import resolve_secret
+
+
+def test_resolve_secret_returns_plain_values_as_they_are():
+    assert resolve_secret('testpassword') == 'testpassword'
+    assert resolve_secret(None) is None
+
+
+def test_resolve_secret_reads_file_references(tmp_path):
+    secret_file = tmp_path / 'password'
+    secret_file.write_text('hunter2\n')
+
+    assert resolve_secret(f'file:{secret_file}') == 'hunter2'
+
+
+def test_resolve_secret_reads_encrypted_ssm_parameters(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    with mock_ssm():
+        boto3.client('ssm').put_parameter(Name='/dart/ladle/password', Value='hunter2', Type='SecureString')
+
+        assert resolve_secret('ssm:/dart/ladle/password') == 'hunter2'
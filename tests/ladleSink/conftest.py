@@ -3,6 +3,12 @@ import pytest
 import boto3
 from moto import mock_s3
 
+from dart_lambdas.common.circuit_breaker import reset_circuit_breakers
+from dart_lambdas.common.concurrency_limit import reset_concurrency_limiters
+from dart_lambdas.common.idempotency import set_idempotency_store
+from dart_lambdas.common.s3_utils import reset_s3_client
+from dart_lambdas.ladleSink.config import reset_config
+
 @pytest.fixture(scope='function')
 def aws_credentials():
     """Mocked AWS Credentials for moto."""
@@ -11,6 +17,40 @@ def aws_credentials():
     os.environ['AWS_SECURITY_TOKEN'] = 'testing'
     os.environ['AWS_SESSION_TOKEN'] = 'testing'
 
+@pytest.fixture(scope='function', autouse=True)
+def fresh_s3_client():
+    """Make sure the lambda's shared S3 client is created inside each test's moto context."""
+    reset_s3_client()
+    yield
+    reset_s3_client()
+
+
+@pytest.fixture(scope='function', autouse=True)
+def fresh_config():
+    """Read the lambda's configuration from each test's environment."""
+    reset_config()
+    yield
+    reset_config()
+
+
+@pytest.fixture(scope='function', autouse=True)
+def fresh_idempotency_store():
+    """Don't let documents submitted in one test look like duplicates in the next."""
+    set_idempotency_store(None)
+    yield
+    set_idempotency_store(None)
+
+
+@pytest.fixture(scope='function', autouse=True)
+def fresh_ladle_guards():
+    """Start every test with Ladle's circuit closed and its concurrency limit at the maximum."""
+    reset_circuit_breakers()
+    reset_concurrency_limiters()
+    yield
+    reset_circuit_breakers()
+    reset_concurrency_limiters()
+
+
 @pytest.fixture(scope='function')
 def s3_resource(aws_credentials):
     with mock_s3():
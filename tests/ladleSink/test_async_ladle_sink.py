@@ -0,0 +1,239 @@
+import asyncio
+import json
+import os
+import sys
+
+import botocore.exceptions
+import mock
+import pytest
+import requests
+
+import dart_lambdas.ladleSink
+from dart_lambdas.ladleSink.ladle_sink import lambda_handler
+from .test_ladle_sink import s3_objects_created_event
+
+pytest.importorskip('aiobotocore')
+pytest.importorskip('aiohttp')
+from dart_lambdas.ladleSink import async_workers  # noqa: E402
+
+
+class AsyncBody:
+    def __init__(self, body):
+        self._body = body
+
+    async def read(self):
+        return self._body.read()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self._body.close()
+
+
+# Coroutine facade over a boto3 client, standing in for an aiobotocore client (which moto can't mock)
+class AsyncS3Client:
+    def __init__(self, s3_client):
+        self._s3_client = s3_client
+
+    def __getattr__(self, name):
+        method = getattr(self._s3_client, name)
+
+        async def call(**kwargs):
+            response = method(**kwargs)
+            if 'Body' in response:
+                response['Body'] = AsyncBody(response['Body'])
+            return response
+
+        return call
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+@pytest.fixture(scope='function')
+def async_env(normal_env, s3_client, monkeypatch):
+    monkeypatch.setenv('PIPELINE_ENGINE', 'async')
+    monkeypatch.setattr('dart_lambdas.ladleSink.async_ladle_sink.create_async_s3_client', lambda: AsyncS3Client(s3_client))
+
+
+def put_documents(s3_resource, s3_client, names):
+    test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+    test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+
+    s3_resource.create_bucket(Bucket=os.environ.get('S3_BUCKET_IN'))
+    s3_resource.create_bucket(Bucket=os.environ.get('S3_BUCKET_PROCESSED'))
+    for name in names:
+        s3_client.put_object(Bucket=os.environ.get('S3_BUCKET_IN'), Key=f"{name}.pdf.raw", Body=test_file)
+        s3_client.put_object(Bucket=os.environ.get('S3_BUCKET_IN'), Key=f"{name}.meta", Body=test_file_metadata)
+
+    return test_file
+
+
+def test_async_engine_gets_files_sends_them_to_ladle_then_moves_them_to_processed_bucket(async_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    DART_URL = os.environ.get('DART_URL')
+    test_file = put_documents(s3_resource, s3_client, ['doc-a', 'doc-b'])
+
+    async def mock_try_post(http_session, url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+        assert post_files['file'][1] == test_file
+        return True, json.dumps({'document_id': post_files['file'][0].split('.')[0] + '-id'})
+
+    with mock.patch('dart_lambdas.common.async_http_utils.try_post', side_effect=mock_try_post) as try_post_mocker:
+        result = lambda_handler(s3_objects_created_event(S3_BUCKET_IN, ["doc-a.pdf.raw", "doc-b.pdf.raw"]), None)
+
+    assert result['statusCode'] == 200
+    assert json.loads(result['body']) == [
+        f'Successfully pulled {name}.pdf.raw from {S3_BUCKET_IN}, posted it to {DART_URL} as {name}.pdf, and moved it to {S3_BUCKET_PROCESSED} as {name}-id.pdf'
+        for name in ['doc-a', 'doc-b']
+    ]
+    assert try_post_mocker.call_count == 2
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 0
+    assert sorted(o['Key'] for o in s3_client.list_objects_v2(Bucket=S3_BUCKET_PROCESSED)['Contents']) == \
+        ['doc-a-id.meta', 'doc-a-id.pdf', 'doc-b-id.meta', 'doc-b-id.pdf']
+
+
+def test_async_engine_archives_identical_content_uploaded_under_another_key(async_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    DART_URL = os.environ.get('DART_URL')
+    put_documents(s3_resource, s3_client, ['doc-a', 'doc-b'])
+
+    async def mock_try_post(http_session, url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+        return True, json.dumps({'document_id': 'doc-a-id'})
+
+    with mock.patch('dart_lambdas.common.async_http_utils.try_post', side_effect=mock_try_post) as try_post_mocker:
+        assert lambda_handler(s3_objects_created_event(S3_BUCKET_IN, ["doc-a.pdf.raw"]), None)['statusCode'] == 200
+        result = lambda_handler(s3_objects_created_event(S3_BUCKET_IN, ["doc-b.pdf.raw"]), None)
+
+    assert json.loads(result['body']) == \
+        f'doc-b.pdf.raw has the same content as document doc-a-id already submitted to {DART_URL}; archived it in {S3_BUCKET_PROCESSED} as duplicates/doc-b.pdf.raw'
+    assert try_post_mocker.call_count == 1
+    assert sorted(o['Key'] for o in s3_client.list_objects_v2(Bucket=S3_BUCKET_PROCESSED)['Contents']) == \
+        ['doc-a-id.meta', 'doc-a-id.pdf', 'duplicates/doc-b.meta', 'duplicates/doc-b.pdf.raw']
+
+
+def test_async_engine_submits_documents_by_url_that_can_be_fetched_after_they_are_moved(async_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    monkeypatch.setenv('URL_SUBMISSION_ENDPOINT', '/test/url/endpoint')
+    test_file = put_documents(s3_resource, s3_client, ['doc-a'])
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        try_post_mocker.return_value = True, json.dumps({'document_id': 'doc-a-id'})
+
+        assert lambda_handler(s3_objects_created_event(S3_BUCKET_IN, ["doc-a.pdf.raw"]), None)['statusCode'] == 200
+
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 0
+    assert requests.get(try_post_mocker.call_args.kwargs['post_data']['url']).content == test_file
+
+
+def test_async_engine_keeps_at_most_max_concurrent_records_in_flight(async_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    monkeypatch.setenv('ASYNC_MAX_CONCURRENT_RECORDS', '2')
+    names = [f'doc-{index}' for index in range(6)]
+    put_documents(s3_resource, s3_client, names)
+    in_flight = [0]
+    max_in_flight = [0]
+
+    async def mock_try_post(http_session, url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+        in_flight[0] += 1
+        max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+        await asyncio.sleep(0.05)
+        in_flight[0] -= 1
+        return True, json.dumps({'document_id': post_files['file'][0].split('.')[0] + '-id'})
+
+    with mock.patch('dart_lambdas.common.async_http_utils.try_post', side_effect=mock_try_post):
+        result = lambda_handler(s3_objects_created_event(S3_BUCKET_IN, [f"{name}.pdf.raw" for name in names]), None)
+
+    assert result['statusCode'] == 200
+    assert max_in_flight[0] == 2
+
+
+def test_async_engine_falls_back_to_threads_when_unavailable(async_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    put_documents(s3_resource, s3_client, ['doc-a'])
+    monkeypatch.delattr(dart_lambdas.ladleSink, 'async_ladle_sink')
+    monkeypatch.setitem(sys.modules, 'dart_lambdas.ladleSink.async_ladle_sink', None)
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        try_post_mocker.return_value = True, '{ "document_id": "doc-a-id" }'
+        result = lambda_handler(s3_objects_created_event(S3_BUCKET_IN, ["doc-a.pdf.raw"]), None)
+
+    assert result['statusCode'] == 200
+    try_post_mocker.assert_called_once()
+
+
+def test_async_move_processed_objects_undoes_copies_when_any_copy_fails(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    put_documents(s3_resource, s3_client, ['doc-a'])
+
+    success, message = asyncio.run(async_workers.move_processed_objects(
+        AsyncS3Client(s3_client),
+        [("doc-a.meta", "doc-a-id.meta"), ("missing.pdf.raw", "missing-id.pdf")],
+        S3_BUCKET_IN,
+        S3_BUCKET_PROCESSED,
+    ))
+
+    assert success is False
+    assert 'Unable to copy missing.pdf.raw' in message
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_PROCESSED)['KeyCount'] == 0
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 2
+
+
+def test_async_get_created_object_fetches_large_objects_in_ranges(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    monkeypatch.setenv('RANGED_GET_THRESHOLD_BYTES', '1000')
+    monkeypatch.setenv('RANGED_GET_PART_SIZE_BYTES', '1000')
+    monkeypatch.setenv('RANGED_GET_CONCURRENCY', '3')
+    test_file = put_documents(s3_resource, s3_client, ['doc-a'])
+
+    record = s3_objects_created_event(S3_BUCKET_IN, ["doc-a.pdf.raw"])['Records'][0]
+    record['s3']['object']['size'] = len(test_file)
+
+    with mock.patch.object(s3_client, 'get_object', wraps=s3_client.get_object) as get_object_mocker:
+        success, key, raw_doc, msg = asyncio.run(async_workers.get_created_object(AsyncS3Client(s3_client), record, S3_BUCKET_IN))
+
+    assert success is True
+    assert raw_doc == test_file
+    assert get_object_mocker.call_count == -(-len(test_file) // 1000)
+    assert all('Range' in call.kwargs for call in get_object_mocker.call_args_list)
+
+
+def test_async_get_created_object_cancels_the_other_ranges_when_one_fails(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    monkeypatch.setenv('RANGED_GET_THRESHOLD_BYTES', '1000')
+    monkeypatch.setenv('RANGED_GET_PART_SIZE_BYTES', '1000')
+    monkeypatch.setenv('RANGED_GET_CONCURRENCY', '3')
+    test_file = put_documents(s3_resource, s3_client, ['doc-a'])
+
+    record = s3_objects_created_event(S3_BUCKET_IN, ["doc-a.pdf.raw"])['Records'][0]
+    record['s3']['object']['size'] = len(test_file)
+    started = []
+    cancelled = []
+
+    class FailingRangesS3Client:
+        async def get_object(self, Range, **kwargs):
+            if Range.startswith('bytes=0-'):
+                raise botocore.exceptions.ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'GetObject')
+            started.append(Range)
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(Range)
+                raise
+
+    async def get_and_check():
+        result = await async_workers.get_created_object(FailingRangesS3Client(), record, S3_BUCKET_IN)
+        return result, list(cancelled)
+
+    (success, key, raw_doc, msg), cancelled_by_return = asyncio.run(get_and_check())
+
+    assert success is False
+    assert 'PreconditionFailed' in msg
+    assert len(started) > 0
+    assert sorted(cancelled_by_return) == sorted(started)
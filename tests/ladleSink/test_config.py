@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from dart_lambdas.common.circuit_breaker import get_circuit_breaker
+from dart_lambdas.common.http_utils import request_timeout, configure_http
+from dart_lambdas.ladleSink.config import get_config, reset_config, ConfigurationError
+from dart_lambdas.ladleSink.ladle_sink import lambda_handler
+from .test_ladle_sink import s3_object_created_event
+
+
+def test_get_config_reads_the_environment_once(normal_env, monkeypatch):
+    config = get_config()
+
+    assert config.dart_url == "0.0.0.0"
+    assert config.submission_port == "100"
+    assert config.basic_auth == ("testusername", "testpassword")
+    assert config.routes.endpoint("02fda3137e912f948c337263d790698a.factiva") == "/test/factiva/endpoint"
+
+    monkeypatch.setenv('DART_URL', 'http://elsewhere')
+    assert get_config() is config
+
+    reset_config()
+    assert get_config().dart_url == 'http://elsewhere'
+
+
+def test_config_can_not_be_changed(normal_env):
+    with pytest.raises(AttributeError):
+        get_config().dart_url = 'http://elsewhere'
+
+
+def test_get_config_names_every_missing_or_invalid_setting(normal_env, monkeypatch):
+    monkeypatch.delenv('DART_URL')
+    monkeypatch.setenv('SUBMISSION_PORT', 'eighty')
+    monkeypatch.setenv('MAX_CONCURRENT_RECORDS', '0')
+    monkeypatch.delenv('BAUTH_PASSWORD')
+
+    with pytest.raises(ConfigurationError) as error:
+        get_config()
+
+    assert 'DART_URL is not set' in str(error.value)
+    assert 'SUBMISSION_PORT must be a port number' in str(error.value)
+    assert 'MAX_CONCURRENT_RECORDS must be at least 1' in str(error.value)
+    assert 'BAUTH_USERNAME and BAUTH_PASSWORD must be set together' in str(error.value)
+
+
+def test_get_config_checks_the_settings_of_batching_and_shared_clients(normal_env, monkeypatch):
+    monkeypatch.setenv('SUBMISSION_BATCH_SIZE', 'ten')
+    monkeypatch.setenv('HTTP_READ_TIMEOUT', '30s')
+    monkeypatch.setenv('CIRCUIT_BREAKER_FAILURE_RATE', '2')
+    monkeypatch.setenv('PIPELINE_ENGINE', 'asyncio')
+    monkeypatch.setenv('SUBMISSION_ROUTES', '{"factiva": 5, "lexis": null}')
+
+    with pytest.raises(ConfigurationError) as error:
+        get_config()
+
+    assert 'SUBMISSION_BATCH_SIZE must be a number: ten' in str(error.value)
+    assert 'HTTP_READ_TIMEOUT must be a number: 30s' in str(error.value)
+    assert 'CIRCUIT_BREAKER_FAILURE_RATE must be at most 1' in str(error.value)
+    assert 'PIPELINE_ENGINE must be "threads" or "async"' in str(error.value)
+    assert 'Endpoint for "factiva" documents must be a string: 5' in str(error.value)
+    assert 'Endpoint for "lexis" documents must be a string: None' in str(error.value)
+
+
+def test_get_config_configures_the_shared_clients(normal_env, monkeypatch):
+    monkeypatch.setenv('HTTP_READ_TIMEOUT', '12')
+    monkeypatch.setenv('CIRCUIT_BREAKER_MIN_CALLS', '3')
+
+    get_config()
+
+    assert request_timeout()[1] == 12
+    assert get_circuit_breaker('test').min_calls == 3
+    configure_http()
+
+
+def test_get_config_resolves_credentials_from_files(normal_env, monkeypatch, tmp_path):
+    password_file = tmp_path / 'password'
+    password_file.write_text('hunter2\n')
+    monkeypatch.setenv('BAUTH_PASSWORD', f'file:{password_file}')
+
+    assert get_config().basic_auth == ("testusername", "hunter2")
+
+
+def test_get_config_fails_when_a_secret_can_not_be_resolved(normal_env, monkeypatch, tmp_path):
+    monkeypatch.setenv('BAUTH_PASSWORD', f'file:{tmp_path / "missing"}')
+
+    with pytest.raises(ConfigurationError) as error:
+        get_config()
+
+    assert 'Unable to resolve basic auth credentials' in str(error.value)
+
+
+def test_handler_fails_before_touching_any_record_when_misconfigured(normal_env, monkeypatch, s3_resource, s3_client):
+    monkeypatch.delenv('SUBMISSION_ENDPOINT')
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+
+    with pytest.raises(ConfigurationError):
+        lambda_handler(s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw"), None)
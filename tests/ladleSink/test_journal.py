@@ -0,0 +1,163 @@
+import json
+import mock
+import os
+import botocore.exceptions
+
+from dart_lambdas.common.idempotency import set_idempotency_store
+from dart_lambdas.common.s3_utils import get_s3_client
+from dart_lambdas.ladleSink.journal import Journal, POSTED, COPIED, STEP_TAG, DOCUMENT_ID_TAG
+from dart_lambdas.ladleSink.ladle_sink import lambda_handler
+from .test_ladle_sink import s3_object_created_event
+
+RAW_KEY = "02fda3137e912f948c337263d790698a.pdf.raw"
+METADATA_KEY = "02fda3137e912f948c337263d790698a.meta"
+DOC_ID = "Z2fda3137e912f948c337263d790698Z"
+
+
+def put_document(s3_client, bucket):
+    s3_client.put_object(Bucket=bucket, Key=RAW_KEY, Body=b'raw document')
+    s3_client.put_object(Bucket=bucket, Key=METADATA_KEY, Body=b'{ "title": "test" }')
+
+
+def tags_of(s3_client, bucket, key):
+    return {tag['Key']: tag['Value'] for tag in s3_client.get_object_tagging(Bucket=bucket, Key=key)['TagSet']}
+
+
+def test_posted_document_is_moved_on_redelivery_without_posting_it_again(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    DART_URL = os.environ.get('DART_URL')
+    monkeypatch.setenv('JOURNAL', 'ON')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        try_post_mocker.return_value = True, f'{{ "document_id": "{DOC_ID}" }}'
+
+        # No processed bucket yet, so the first delivery is posted but can't be moved
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        put_document(s3_client, S3_BUCKET_IN)
+
+        assert lambda_handler(s3_object_created_event(S3_BUCKET_IN, RAW_KEY), None)['statusCode'] == 500
+        assert tags_of(s3_client, S3_BUCKET_IN, RAW_KEY) == {STEP_TAG: POSTED, DOCUMENT_ID_TAG: DOC_ID}
+
+        # The redelivery lands somewhere that has never seen the document
+        set_idempotency_store(None)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, RAW_KEY), None)
+
+        assert result['statusCode'] == 200
+        assert json.loads(result['body']) == f'{RAW_KEY} was already posted to {DART_URL} as document {DOC_ID}; moved it to {S3_BUCKET_PROCESSED} as {DOC_ID}.pdf'
+        assert try_post_mocker.call_count == 1
+
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 0
+    s3_client.head_object(Bucket=S3_BUCKET_PROCESSED, Key=f"{DOC_ID}.pdf")
+    s3_client.head_object(Bucket=S3_BUCKET_PROCESSED, Key=f"{DOC_ID}.meta")
+
+
+def test_processed_copies_keep_the_documents_tags_but_not_the_journal(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    monkeypatch.setenv('JOURNAL', 'ON')
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key=RAW_KEY, Body=b'raw document', Tagging='source=upload')
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key=METADATA_KEY, Body=b'{ "title": "test" }')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        try_post_mocker.return_value = True, f'{{ "document_id": "{DOC_ID}" }}'
+
+        assert lambda_handler(s3_object_created_event(S3_BUCKET_IN, RAW_KEY), None)['statusCode'] == 200
+
+    assert tags_of(s3_client, S3_BUCKET_PROCESSED, f"{DOC_ID}.pdf") == {'source': 'upload'}
+    assert tags_of(s3_client, S3_BUCKET_PROCESSED, f"{DOC_ID}.meta") == {}
+
+
+def test_copied_document_only_has_its_sources_removed(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    monkeypatch.setenv('JOURNAL', 'ON')
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+    put_document(s3_client, S3_BUCKET_IN)
+    s3_client.put_object(Bucket=S3_BUCKET_PROCESSED, Key=f"{DOC_ID}.pdf", Body=b'raw document')
+    s3_client.put_object(Bucket=S3_BUCKET_PROCESSED, Key=f"{DOC_ID}.meta", Body=b'{ "title": "test" }')
+    Journal(S3_BUCKET_IN, RAW_KEY, {}).record(COPIED, DOC_ID)
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker, \
+            mock.patch('dart_lambdas.ladleSink.workers.copy_s3_object') as copy_mocker:
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, RAW_KEY), None)
+
+        assert result['statusCode'] == 200
+        assert json.loads(result['body']).endswith(f'copied to {S3_BUCKET_PROCESSED} as {DOC_ID}.pdf; removed it from {S3_BUCKET_IN}')
+        assert not try_post_mocker.called
+        assert not copy_mocker.called
+
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 0
+
+
+def test_copied_document_whose_copies_are_gone_is_moved_again(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    monkeypatch.setenv('JOURNAL', 'ON')
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+    put_document(s3_client, S3_BUCKET_IN)
+    Journal(S3_BUCKET_IN, RAW_KEY, {}).record(COPIED, DOC_ID)
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, RAW_KEY), None)
+
+        assert result['statusCode'] == 200
+        assert json.loads(result['body']).endswith(f'moved it to {S3_BUCKET_PROCESSED} as {DOC_ID}.pdf')
+        assert not try_post_mocker.called
+
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 0
+    s3_client.head_object(Bucket=S3_BUCKET_PROCESSED, Key=f"{DOC_ID}.pdf")
+    s3_client.head_object(Bucket=S3_BUCKET_PROCESSED, Key=f"{DOC_ID}.meta")
+
+
+def test_documents_are_not_journaled_unless_journal_is_on(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    put_document(s3_client, S3_BUCKET_IN)
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        try_post_mocker.return_value = True, f'{{ "document_id": "{DOC_ID}" }}'
+
+        assert lambda_handler(s3_object_created_event(S3_BUCKET_IN, RAW_KEY), None)['statusCode'] == 500
+
+    assert tags_of(s3_client, S3_BUCKET_IN, RAW_KEY) == {}
+
+
+def test_journal_keeps_the_objects_other_tags(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key=RAW_KEY, Body=b'raw document', Tagging='source=upload')
+
+    Journal.read(S3_BUCKET_IN, RAW_KEY).record(POSTED, DOC_ID)
+    journal = Journal.read(S3_BUCKET_IN, RAW_KEY)
+
+    assert journal.step == POSTED
+    assert journal.doc_id == DOC_ID
+    assert tags_of(s3_client, S3_BUCKET_IN, RAW_KEY) == {'source': 'upload', STEP_TAG: POSTED, DOCUMENT_ID_TAG: DOC_ID}
+
+
+def test_document_whose_journal_cannot_be_reached_is_processed_without_it(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    monkeypatch.setenv('JOURNAL', 'ON')
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+    put_document(s3_client, S3_BUCKET_IN)
+    unreachable = botocore.exceptions.EndpointConnectionError(endpoint_url='https://s3.amazonaws.com')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker, \
+            mock.patch.object(get_s3_client(), 'get_object_tagging', side_effect=unreachable), \
+            mock.patch.object(get_s3_client(), 'put_object_tagging', side_effect=unreachable):
+        try_post_mocker.return_value = True, f'{{ "document_id": "{DOC_ID}" }}'
+
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, RAW_KEY), None)
+
+        assert result['statusCode'] == 200
+        assert try_post_mocker.call_count == 1
+
+    s3_client.head_object(Bucket=S3_BUCKET_PROCESSED, Key=f"{DOC_ID}.pdf")
@@ -1,10 +1,22 @@
+import hashlib
 import json
 import mock
 import os
+import subprocess
+import sys
+import threading
+import time
 import botocore
 import pytest
+import requests
 
-from dart_lambdas.ladleSink.ladle_sink import lambda_handler
+from dart_lambdas.common.s3_utils import get_s3_client
+from dart_lambdas.ladleSink import workers
+from dart_lambdas.ladleSink.config import ConfigurationError
+from dart_lambdas.ladleSink.ladle_sink import lambda_handler, warm_up
+from dart_lambdas.ladleSink.object_key import ObjectKey
+from dart_lambdas.ladleSink.pairing import MetadataNotUploadedError
+from tests.common.test_deadline import FakeLambdaContext
 
 
 def test_handler_gets_file_from_input_bucket_sends_it_to_ladle_then_moves_to_processed_bucket(normal_env, s3_resource, s3_client):
@@ -18,8 +30,8 @@ def test_handler_gets_file_from_input_bucket_sends_it_to_ladle_then_moves_to_pro
 
         # Set up mock response to ladle call
 
-        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes):
-            assert post_files['file'][1] == test_file
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert post_files['file'][1].read() == test_file
             return True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
 
         try_post_mocker.side_effect = mock_try_post
@@ -63,8 +75,8 @@ def test_handler_gets_file_from_input_bucket_sends_it_to_ladle_then_moves_to_pro
 
         # Set up mock response to ladle call
 
-        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes):
-            assert post_files['file'][1] == test_file
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert post_files['file'][1].read() == test_file
             return True, '{ "document_id": "Z2fda3137e912f948c337263d790698Z" }' # Note first and last letters differ from file below
 
         try_post_mocker.side_effect = mock_try_post
@@ -108,8 +120,8 @@ def test_handler_gets_file_without_docid_filename_with_url_encoded_filename_from
 
         # Set up mock response to ladle call
 
-        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes):
-            assert post_files['file'][1] == test_file
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert post_files['file'][1].read() == test_file
             return True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
 
         try_post_mocker.side_effect = mock_try_post
@@ -161,8 +173,8 @@ def test_handler_does_not_send_file_that_fails_on_ladle_to_processed_and_keeps_i
         test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
 
         # Set up mock response to ladle call
-        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes):
-            assert post_files['file'][1] == test_file
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert post_files['file'][1].read() == test_file
             return False, "mocked ladle failure"
 
         try_post_mocker.side_effect = mock_try_post
@@ -204,8 +216,8 @@ def test_handler_does_nothing_with_metadata_file(normal_env, s3_resource, s3_cli
 
         # Set up mock response to ladle call
 
-        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes):
-            assert post_files['file'][1] == test_file
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert post_files['file'][1].read() == test_file
             return True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
 
         try_post_mocker.side_effect = mock_try_post
@@ -247,10 +259,10 @@ def test_handler_errors_out_when_metadata_file_is_absent(normal_env, s3_resource
     s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.pdf.raw", Body=test_file)
 
     # Run call with an event describing the file:
-    result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw"), None)
+    with pytest.raises(MetadataNotUploadedError) as error:
+        lambda_handler(s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw"), None)
 
-    assert f"Unable to retrieve 02fda3137e912f948c337263d790698a.meta from {S3_BUCKET_IN}" in json.loads(result['body'])
-    assert result['statusCode'] == 500
+    assert f"Unable to retrieve 02fda3137e912f948c337263d790698a.meta from {S3_BUCKET_IN}" in str(error.value)
 
     with pytest.raises(botocore.exceptions.ClientError):
         s3_client.get_object(Key="02fda3137e912f948c337263d790698a.pdf", Bucket=S3_BUCKET_PROCESSED)
@@ -267,7 +279,637 @@ def test_handler_errors_out_when_metadata_file_is_absent(normal_env, s3_resource
         pytest.fail(f"Did not keep file in {S3_BUCKET_IN}")
 
 
+def test_handler_processes_every_record_in_a_multi_record_event(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    DART_URL = os.environ.get('DART_URL')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+
+        # Ladle assigns a document id based on the submitted filename
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert post_files['file'][1].read() == test_file + post_files['file'][0].encode()
+            if post_files['file'][0] == 'doc-3.pdf':
+                return False, "mocked ladle failure"
+            return True, f'{{ "document_id": "id-{post_files["file"][0].split(".")[0]}" }}'
+
+        try_post_mocker.side_effect = mock_try_post
+
+        # Create the bucket
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+
+        keys = ['doc-1.pdf.raw', 'doc-2.pdf.raw', 'doc-3.pdf.raw', 'doc-4.pdf.raw']
+        for key in keys:
+            s3_client.put_object(Bucket=S3_BUCKET_IN, Key=key, Body=test_file + key[:-len('.raw')].encode())
+            s3_client.put_object(Bucket=S3_BUCKET_IN, Key=key.split('.')[0] + '.meta', Body=test_file_metadata)
+
+        # Run call with one event describing all of the files:
+        result = lambda_handler(s3_objects_created_event(S3_BUCKET_IN, keys), None)
+
+        assert result['statusCode'] == 500
+        assert json.loads(result['body']) == [
+            f'Successfully pulled doc-1.pdf.raw from {S3_BUCKET_IN}, posted it to {DART_URL} as doc-1.pdf, and moved it to {S3_BUCKET_PROCESSED} as id-doc-1.pdf',
+            f'Successfully pulled doc-2.pdf.raw from {S3_BUCKET_IN}, posted it to {DART_URL} as doc-2.pdf, and moved it to {S3_BUCKET_PROCESSED} as id-doc-2.pdf',
+            'Unable to submit doc-3.pdf.raw to ladle as doc-3.pdf: mocked ladle failure',
+            f'Successfully pulled doc-4.pdf.raw from {S3_BUCKET_IN}, posted it to {DART_URL} as doc-4.pdf, and moved it to {S3_BUCKET_PROCESSED} as id-doc-4.pdf',
+        ]
+        assert try_post_mocker.call_count == 4
+
+        for doc in ['doc-1', 'doc-2', 'doc-4']:
+            try:
+                s3_client.get_object(Key=f"id-{doc}.pdf", Bucket=S3_BUCKET_PROCESSED)
+                s3_client.get_object(Key=f"id-{doc}.meta", Bucket=S3_BUCKET_PROCESSED)
+            except botocore.exceptions.ClientError as e:
+                pytest.fail(f"Did not put {doc} in {S3_BUCKET_PROCESSED}")
+
+        try:
+            s3_client.get_object(Key="doc-3.pdf.raw", Bucket=S3_BUCKET_IN)
+            s3_client.get_object(Key="doc-3.meta", Bucket=S3_BUCKET_IN)
+        except botocore.exceptions.ClientError as e:
+            pytest.fail(f"Did not keep doc-3 in {S3_BUCKET_IN}")
+
+
+def test_handler_reports_only_failed_sqs_messages_as_batch_item_failures(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            if post_files['file'][0] == 'doc-2.pdf':
+                return False, "mocked ladle failure"
+            return True, f'{{ "document_id": "id-{post_files["file"][0].split(".")[0]}" }}'
+
+        try_post_mocker.side_effect = mock_try_post
+
+        # Create the bucket
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+
+        for doc in ['doc-1', 'doc-2', 'doc-3']:
+            s3_client.put_object(Bucket=S3_BUCKET_IN, Key=f"{doc}.pdf.raw", Body=test_file)
+            s3_client.put_object(Bucket=S3_BUCKET_IN, Key=f"{doc}.meta", Body=test_file_metadata)
+
+        event = sqs_event([
+            ('message-1', json.dumps(s3_object_created_event(S3_BUCKET_IN, "doc-1.pdf.raw"))),
+            ('message-2', json.dumps(s3_object_created_event(S3_BUCKET_IN, "doc-2.pdf.raw"))),
+            ('message-3', json.dumps(s3_object_created_event(S3_BUCKET_IN, "doc-3.pdf.raw"))),
+            ('message-4', json.dumps({"Event": "s3:TestEvent", "Bucket": S3_BUCKET_IN})),
+            ('message-5', 'not json'),
+        ])
+
+        result = lambda_handler(event, None)
+
+        assert result == {'batchItemFailures': [{'itemIdentifier': 'message-5'}, {'itemIdentifier': 'message-2'}]}
+        assert try_post_mocker.call_count == 3
+
+        try:
+            s3_client.get_object(Key="id-doc-1.pdf", Bucket=S3_BUCKET_PROCESSED)
+            s3_client.get_object(Key="id-doc-3.pdf", Bucket=S3_BUCKET_PROCESSED)
+            s3_client.get_object(Key="doc-2.pdf.raw", Bucket=S3_BUCKET_IN)
+        except botocore.exceptions.ClientError as e:
+            pytest.fail("Did not process sqs messages independently")
+
+
+def test_handler_fetches_metadata_and_raw_object_concurrently(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+
+    # Each fetch waits for the other to start, so the handler only succeeds if they overlap
+    barrier = threading.Barrier(2, timeout=5)
+
+    def get_metadata_after_barrier(record, bucket, deadline, metrics, object_key):
+        barrier.wait()
+        return workers.get_created_object_metadata(record, bucket, deadline, metrics, object_key)
+
+    def open_object_after_barrier(record, bucket, deadline, metrics, object_key):
+        barrier.wait()
+        return workers.open_created_object(record, bucket, deadline, metrics, object_key)
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker, \
+            mock.patch('dart_lambdas.ladleSink.ladle_sink.get_created_object_metadata') as get_metadata_mocker, \
+            mock.patch('dart_lambdas.ladleSink.ladle_sink.open_created_object') as open_object_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+
+        try_post_mocker.return_value = True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+        get_metadata_mocker.side_effect = get_metadata_after_barrier
+        open_object_mocker.side_effect = open_object_after_barrier
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.pdf.raw", Body=test_file)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.meta", Body=test_file_metadata)
+
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw"), None)
+
+        assert result['statusCode'] == 200
+        assert get_metadata_mocker.called
+        assert open_object_mocker.called
+
+
+def test_handler_parses_the_key_of_a_record_once(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker, \
+            mock.patch.object(ObjectKey, 'from_record', wraps=ObjectKey.from_record) as from_record_mocker:
+        try_post_mocker.return_value = True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.pdf.raw", Body=b'raw document')
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.meta", Body=b'{}')
+
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw"), None)
+
+        assert result['statusCode'] == 200
+        assert from_record_mocker.call_count == 1
+
+
+def test_handler_leaves_records_it_has_no_time_for_untouched(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    monkeypatch.setenv('MOVE_TIME_BUDGET_SECONDS', '5')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.pdf.raw", Body=b"raw")
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.meta", Body=b"{}")
+
+        event = sqs_event([('message-1', json.dumps(s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw")))])
+
+        # Less time left than a move needs
+        result = lambda_handler(event, FakeLambdaContext(4000))
+
+        assert result == {'batchItemFailures': [{'itemIdentifier': 'message-1'}]}
+        assert not try_post_mocker.called
+        s3_client.get_object(Key="02fda3137e912f948c337263d790698a.pdf.raw", Bucket=S3_BUCKET_IN)
+        s3_client.get_object(Key="02fda3137e912f948c337263d790698a.meta", Bucket=S3_BUCKET_IN)
+
+
+def test_handler_does_not_start_a_move_it_has_no_time_to_finish(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    DART_URL = os.environ.get('DART_URL')
+    monkeypatch.setenv('MOVE_TIME_BUDGET_SECONDS', '1')
+    monkeypatch.setenv('DEADLINE_RESERVE_SECONDS', '0')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        # Ladle is slow enough to eat into the time reserved for the move
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert 0 < deadline.remaining() < 0.5
+            time.sleep(1)
+            return True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+        try_post_mocker.side_effect = mock_try_post
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.pdf.raw", Body=b"raw")
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.meta", Body=b"{}")
+
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw"), FakeLambdaContext(1500))
+
+        assert result['statusCode'] == 500
+        assert json.loads(result['body']) == f'Posted 02fda3137e912f948c337263d790698a.pdf.raw to {DART_URL} as 02fda3137e912f948c337263d790698a.pdf, but not enough time left to move it to {S3_BUCKET_PROCESSED}; leaving it for retry'
+        assert s3_client.list_objects_v2(Bucket=S3_BUCKET_PROCESSED)['KeyCount'] == 0
+        assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 2
+
+
+def test_handler_emits_per_stage_metrics_for_each_record(normal_env, s3_resource, s3_client, monkeypatch, capsys):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    monkeypatch.setenv('METRICS', 'ON')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+        try_post_mocker.return_value = True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.pdf.raw", Body=test_file)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.meta", Body=test_file_metadata)
+
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw"), None)
+
+        assert result['statusCode'] == 200
+
+    emf_lines = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+    assert len(emf_lines) == 1
+    emf = emf_lines[0]
+    for stage in ['Record', 'FetchMetadata', 'FetchRaw', 'Post', 'Move']:
+        assert emf[f'{stage}Latency'] >= 0
+    assert emf['RawBytes'] == len(test_file)
+    assert emf['MetadataBytes'] == len(test_file_metadata)
+    assert emf['RecordFailures'] == 0
+
+
+def test_handler_moves_a_redelivered_document_without_posting_it_again(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    DART_URL = os.environ.get('DART_URL')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+        try_post_mocker.return_value = True, '{ "document_id": "Z2fda3137e912f948c337263d790698Z" }'
+
+        # No processed bucket yet, so the first delivery is posted but can't be moved
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        put_response = s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.pdf.raw", Body=test_file)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.meta", Body=test_file_metadata)
+
+        event = s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw")
+        event['Records'][0]['s3']['object']['eTag'] = put_response['ETag'].strip('"')
+
+        assert lambda_handler(event, None)['statusCode'] == 500
+        assert try_post_mocker.call_count == 1
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+        result = lambda_handler(event, None)
+
+        assert result['statusCode'] == 200
+        assert json.loads(result['body']) == f'02fda3137e912f948c337263d790698a.pdf.raw was already submitted to {DART_URL} as document Z2fda3137e912f948c337263d790698Z; moved it to {S3_BUCKET_PROCESSED} as Z2fda3137e912f948c337263d790698Z.pdf'
+        assert try_post_mocker.call_count == 1
+
+        assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 0
+        s3_client.get_object(Key="Z2fda3137e912f948c337263d790698Z.pdf", Bucket=S3_BUCKET_PROCESSED)
+        s3_client.get_object(Key="Z2fda3137e912f948c337263d790698Z.meta", Bucket=S3_BUCKET_PROCESSED)
+
+
+def test_handler_posts_a_new_upload_to_the_same_key_again(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+        try_post_mocker.return_value = True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+
+        for body in [test_file, test_file + b'changed']:
+            put_response = s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.pdf.raw", Body=body)
+            s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.meta", Body=test_file_metadata)
+
+            event = s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw")
+            event['Records'][0]['s3']['object']['eTag'] = put_response['ETag'].strip('"')
+
+            assert lambda_handler(event, None)['statusCode'] == 200
+
+        assert try_post_mocker.call_count == 2
+
+
+def test_handler_does_not_post_identical_content_uploaded_under_another_key(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    DART_URL = os.environ.get('DART_URL')
+    monkeypatch.setenv('CONTENT_HASH_FIELD', 'content_md5')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert post_files['file'][1].read() == test_file
+            assert json.loads(post_files['metadata'][1])['content_md5'] == hashlib.md5(test_file).hexdigest()
+            return True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+        try_post_mocker.side_effect = mock_try_post
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+
+        results = []
+        for name in ['first-upload', 'second-upload']:
+            put_response = s3_client.put_object(Bucket=S3_BUCKET_IN, Key=f"{name}.pdf.raw", Body=test_file)
+            s3_client.put_object(Bucket=S3_BUCKET_IN, Key=f"{name}.meta", Body=f'{{ "title": "{name}" }}')
+
+            event = s3_object_created_event(S3_BUCKET_IN, f"{name}.pdf.raw")
+            event['Records'][0]['s3']['object']['eTag'] = put_response['ETag'].strip('"')
+            results.append(lambda_handler(event, None))
+
+        assert [result['statusCode'] for result in results] == [200, 200]
+        assert json.loads(results[1]['body']) == f'second-upload.pdf.raw has the same content as document 02fda3137e912f948c337263d790698a already submitted to {DART_URL}; archived it in {S3_BUCKET_PROCESSED} as duplicates/second-upload.pdf.raw'
+        assert try_post_mocker.call_count == 1
+        assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 0
+
+    # The original's processed objects are left as they were
+    processed_metadata = s3_client.get_object(Bucket=S3_BUCKET_PROCESSED, Key="02fda3137e912f948c337263d790698a.meta")['Body'].read()
+    assert json.loads(processed_metadata)['title'] == 'first-upload'
+    s3_client.head_object(Bucket=S3_BUCKET_PROCESSED, Key="duplicates/second-upload.pdf.raw")
+    s3_client.head_object(Bucket=S3_BUCKET_PROCESSED, Key="duplicates/second-upload.meta")
+
+
+def test_handler_archives_a_redelivered_duplicate_again_rather_than_move_it_over_the_original(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert post_files['file'][1].read() == test_file
+            return True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+        try_post_mocker.side_effect = mock_try_post
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+
+        events = {}
+        for name in ['first-upload', 'second-upload']:
+            put_response = s3_client.put_object(Bucket=S3_BUCKET_IN, Key=f"{name}.pdf.raw", Body=test_file)
+            s3_client.put_object(Bucket=S3_BUCKET_IN, Key=f"{name}.meta", Body=f'{{ "title": "{name}" }}')
+            events[name] = s3_object_created_event(S3_BUCKET_IN, f"{name}.pdf.raw")
+            events[name]['Records'][0]['s3']['object']['eTag'] = put_response['ETag'].strip('"')
+
+        assert lambda_handler(events['first-upload'], None)['statusCode'] == 200
+
+        # The duplicate can't be archived the first time, so its event is redelivered
+        with mock.patch('dart_lambdas.ladleSink.ladle_sink.move_processed_objects', return_value=(False, 'S3 is down')):
+            assert lambda_handler(events['second-upload'], None)['statusCode'] == 500
+        result = lambda_handler(events['second-upload'], None)
+
+        assert result['statusCode'] == 200
+        assert json.loads(result['body']).endswith(f'archived it in {S3_BUCKET_PROCESSED} as duplicates/second-upload.pdf.raw')
+        assert try_post_mocker.call_count == 1
+
+    processed_metadata = s3_client.get_object(Bucket=S3_BUCKET_PROCESSED, Key="02fda3137e912f948c337263d790698a.meta")['Body'].read()
+    assert json.loads(processed_metadata)['title'] == 'first-upload'
+    s3_client.head_object(Bucket=S3_BUCKET_PROCESSED, Key="duplicates/second-upload.meta")
+
+
+def test_handler_posts_identical_content_whose_etag_is_not_its_md5(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert post_files['file'][1].read() == test_file
+            return True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+        try_post_mocker.side_effect = mock_try_post
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+
+        # An object encrypted with a KMS key has an ETag that isn't the MD5 of its content, even if it looks like one
+        get_object = get_s3_client().get_object
+
+        def get_kms_encrypted_object(**kwargs):
+            get_response = get_object(**kwargs)
+            get_response['ServerSideEncryption'] = 'aws:kms'
+            return get_response
+
+        with mock.patch.object(get_s3_client(), 'get_object', side_effect=get_kms_encrypted_object):
+            for name in ['first-upload', 'second-upload']:
+                put_response = s3_client.put_object(Bucket=S3_BUCKET_IN, Key=f"{name}.pdf.raw", Body=test_file)
+                s3_client.put_object(Bucket=S3_BUCKET_IN, Key=f"{name}.meta", Body=test_file_metadata)
+
+                event = s3_object_created_event(S3_BUCKET_IN, f"{name}.pdf.raw")
+                event['Records'][0]['s3']['object']['eTag'] = put_response['ETag'].strip('"')
+                assert lambda_handler(event, None)['statusCode'] == 200
+
+        assert try_post_mocker.call_count == 2
+
+
+def test_handler_posts_documents_of_one_event_to_ladle_in_one_batch(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    monkeypatch.setenv('SUBMISSION_BATCH_SIZE', '3')
+    monkeypatch.setenv('SUBMISSION_BATCH_LINGER_MS', '5000')
+    monkeypatch.setenv('BATCH_SUBMISSION_ENDPOINT', '/test/batch/endpoint')
+    # Batched documents are posted even if Ladle would take them by URL
+    monkeypatch.setenv('URL_SUBMISSION_ENDPOINT', '/test/url/endpoint')
+    names = ['doc-a', 'doc-b', 'doc-c']
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert endpoint == '/test/batch/endpoint'
+            assert [name for name, _ in post_files] == ['file', 'metadata'] * 3
+            filenames = [file[0] for name, file in post_files if name == 'file']
+            for name, file in post_files:
+                if name == 'file':
+                    assert file[1].read() == test_file
+            # Ladle rejects doc-b only
+            return True, json.dumps([{'error': 'bad document'} if filename == 'doc-b.pdf' else {'document_id': filename.split('.')[0] + '-id'}
+                                     for filename in filenames])
+
+        try_post_mocker.side_effect = mock_try_post
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+        for name in names:
+            s3_client.put_object(Bucket=S3_BUCKET_IN, Key=f"{name}.pdf.raw", Body=test_file)
+            s3_client.put_object(Bucket=S3_BUCKET_IN, Key=f"{name}.meta", Body=test_file_metadata)
+
+        start = time.monotonic()
+        result = lambda_handler(s3_objects_created_event(S3_BUCKET_IN, [f"{name}.pdf.raw" for name in names]), None)
+
+        # A full batch is sent without waiting out the linger
+        assert time.monotonic() - start < 5
+        assert try_post_mocker.call_count == 1
+        assert result['statusCode'] == 500
+        messages = json.loads(result['body'])
+        assert messages[0].endswith(f'moved it to {S3_BUCKET_PROCESSED} as doc-a-id.pdf')
+        assert messages[1] == 'Unable to submit doc-b.pdf.raw to ladle as doc-b.pdf: Ladle rejected doc-b.pdf: {"error": "bad document"}'
+        assert messages[2].endswith(f'moved it to {S3_BUCKET_PROCESSED} as doc-c-id.pdf')
+        assert sorted(o['Key'] for o in s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['Contents']) == ['doc-b.meta', 'doc-b.pdf.raw']
+
+
+def test_handler_stops_posting_to_ladle_while_it_is_failing(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    monkeypatch.setenv('CIRCUIT_BREAKER_MIN_CALLS', '3')
+    monkeypatch.setenv('MAX_CONCURRENT_RECORDS', '1')
+    names = [f'doc-{index}' for index in range(5)]
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+        try_post_mocker.return_value = False, 'FAILED TO POST. Response status-code: 503'
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        for name in names:
+            s3_client.put_object(Bucket=S3_BUCKET_IN, Key=f"{name}.pdf.raw", Body=test_file)
+            s3_client.put_object(Bucket=S3_BUCKET_IN, Key=f"{name}.meta", Body=test_file_metadata)
+
+        result = lambda_handler(s3_objects_created_event(S3_BUCKET_IN, [f"{name}.pdf.raw" for name in names]), None)
+
+        assert result['statusCode'] == 500
+        assert try_post_mocker.call_count == 3
+        assert json.loads(result['body'])[3:] == [
+            f'Unable to submit {name}.pdf.raw to ladle as {name}.pdf: Ladle is failing (circuit breaker open); not posting, leaving it for retry'
+            for name in names[3:]
+        ]
+
+
+def test_handler_submits_documents_to_ladle_by_presigned_url(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    monkeypatch.setenv('URL_SUBMISSION_ENDPOINT', '/test/url/endpoint')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker, \
+            mock.patch('dart_lambdas.ladleSink.ladle_sink.open_created_object') as open_created_object_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+        urls = []
+
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert endpoint == '/test/url/endpoint'
+            assert list(post_files) == ['metadata']
+            assert post_data['filename'] == '02fda3137e912f948c337263d790698a.pdf'
+            assert 'X-Amz-Signature=' in post_data['url']
+            urls.append(post_data['url'])
+            return True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+        try_post_mocker.side_effect = mock_try_post
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.pdf.raw", Body=test_file)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.meta", Body=test_file_metadata)
+
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw"), None)
+
+        assert result['statusCode'] == 200
+        assert try_post_mocker.call_count == 1
+        assert not open_created_object_mocker.called
+        s3_client.head_object(Bucket=S3_BUCKET_PROCESSED, Key="02fda3137e912f948c337263d790698a.pdf")
+
+    # Ladle may only fetch the document after it has been moved, and can do so with the URL alone
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 0
+    assert requests.get(urls[0]).content == test_file
+
+
+def test_handler_posts_documents_when_ladle_does_not_take_them_by_url(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    monkeypatch.setenv('URL_SUBMISSION_ENDPOINT', '/test/url/endpoint')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+        endpoints = []
+
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            endpoints.append(endpoint)
+            if endpoint == '/test/url/endpoint':
+                return False, 'FAILED TO POST. Response status-code: 404'
+            assert post_files['file'][1].read().startswith(test_file)
+            return True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+        try_post_mocker.side_effect = mock_try_post
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.pdf.raw", Body=test_file)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.meta", Body=test_file_metadata)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="4c1b9d55e1e1487c8a7d0fa2a1a52f77.factiva.raw", Body=test_file + b'factiva')
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="4c1b9d55e1e1487c8a7d0fa2a1a52f77.meta", Body=test_file_metadata)
+
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw"), None)
+
+        assert result['statusCode'] == 200
+        assert endpoints == ['/test/url/endpoint', '/test/endpoint']
+        # The copy made for Ladle to fetch is removed once Ladle turns it down
+        assert [o['Key'] for o in s3_client.list_objects_v2(Bucket=S3_BUCKET_PROCESSED)['Contents']] == \
+            ['02fda3137e912f948c337263d790698a.meta', '02fda3137e912f948c337263d790698a.pdf']
+
+        # Documents routed elsewhere are always posted
+        endpoints.clear()
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, "4c1b9d55e1e1487c8a7d0fa2a1a52f77.factiva.raw"), None)
+
+        assert result['statusCode'] == 200
+        assert endpoints == ['/test/factiva/endpoint']
+
+
+def test_handler_removes_the_copy_made_for_ladle_when_its_url_is_not_accepted(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    monkeypatch.setenv('URL_SUBMISSION_ENDPOINT', '/test/url/endpoint')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+        test_file_metadata = open('tests/ladleSink/resources/test-file-meta.json', 'rb').read()
+        try_post_mocker.return_value = (False, 'FAILED TO POST. Response status-code: 500')
+
+        s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+        s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.pdf.raw", Body=test_file)
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.meta", Body=test_file_metadata)
+
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw"), None)
+
+        assert result['statusCode'] == 500
+        assert try_post_mocker.call_count == 1
+
+    # The document is left for retry, which stages a fresh copy
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_PROCESSED)['KeyCount'] == 0
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 2
+
+
+def test_importing_the_handler_leaves_the_async_engine_unloaded():
+    imported = subprocess.run(
+        [sys.executable, '-c', 'import sys, dart_lambdas.ladleSink; print(sorted(set(sys.modules) & {"asyncio", "aiohttp", "aiobotocore"}))'],
+        capture_output=True, text=True, check=True,
+    )
+
+    assert imported.stdout.strip() == '[]'
+
+
+def test_warm_up_prepares_shared_clients_and_configuration(normal_env, s3_client):
+    with mock.patch('dart_lambdas.ladleSink.ladle_sink.get_s3_client') as get_s3_client_mocker, \
+            mock.patch('dart_lambdas.ladleSink.ladle_sink.get_http_session') as get_http_session_mocker, \
+            mock.patch('dart_lambdas.ladleSink.ladle_sink.get_config') as get_config_mocker:
+        warm_up()
+
+        get_s3_client_mocker.assert_called_once()
+        get_http_session_mocker.assert_called_once()
+        get_config_mocker.assert_called_once()
+
+
+def test_warm_up_leaves_a_misconfiguration_for_the_handler_to_report(normal_env, monkeypatch):
+    monkeypatch.delenv('DART_URL')
+
+    warm_up()
+
+    with pytest.raises(ConfigurationError):
+        lambda_handler(s3_object_created_event(os.environ.get('S3_BUCKET_IN'), "02fda3137e912f948c337263d790698a.pdf.raw"), None)
+
+
+def sqs_event(messages):
+    # NOTE: truncated event object shown here
+    return {
+      "Records": [
+        {
+          "messageId": message_id,
+          "body": body,
+          "eventSource": "aws:sqs",
+        } for message_id, body in messages
+      ]
+    }
+
+
 def s3_object_created_event(bucket_name, key):
+    return s3_objects_created_event(bucket_name, [key])
+
+
+def s3_objects_created_event(bucket_name, keys):
     # NOTE: truncated event object shown here
     return {
       "Records": [
@@ -280,6 +922,6 @@ def s3_object_created_event(bucket_name, key):
               "name": bucket_name,
             },
           },
-        }
+        } for key in keys
       ]
     }
@@ -0,0 +1,88 @@
+import mock
+import pytest
+
+from dart_lambdas.ladleSink import workers
+from dart_lambdas.ladleSink.object_key import ObjectKey, get_submission_routes
+from .test_ladle_sink import s3_object_created_event
+
+
+def test_object_key_parses_a_raw_document_key():
+    object_key = ObjectKey.parse("02fda3137e912f948c337263d790698a.pdf.raw")
+
+    assert object_key.is_raw()
+    assert not object_key.is_metadata()
+    assert object_key.extension == "pdf"
+    assert object_key.post_key == "02fda3137e912f948c337263d790698a.pdf"
+    assert object_key.metadata_key == "02fda3137e912f948c337263d790698a.meta"
+
+
+def test_object_key_parses_a_metadata_key():
+    object_key = ObjectKey.parse("02fda3137e912f948c337263d790698a.meta")
+
+    assert object_key.is_metadata()
+    assert not object_key.is_raw()
+    assert object_key.extension is None
+
+
+def test_object_key_of_a_raw_document_without_extension_has_none():
+    object_key = ObjectKey.parse("02fda3137e912f948c337263d790698a.raw")
+
+    assert object_key.is_raw()
+    assert object_key.extension is None
+
+
+def test_object_key_is_parsed_once():
+    assert ObjectKey.parse("a.b.pdf.raw") is ObjectKey.parse("a.b.pdf.raw")
+
+
+def test_object_key_from_record_decodes_the_key():
+    record = s3_object_created_event("bucket", "02fda3137e912f948c337263d790698a+%281%29.pdf.raw")['Records'][0]
+    object_key = ObjectKey.from_record(record)
+
+    assert object_key.key == "02fda3137e912f948c337263d790698a (1).pdf.raw"
+    assert object_key.metadata_key == "02fda3137e912f948c337263d790698a (1).meta"
+
+
+def test_object_key_has_no_instance_dict():
+    with pytest.raises(AttributeError):
+        ObjectKey.parse("a.pdf.raw").other = 1
+
+
+def test_submission_routes_send_documents_to_the_default_endpoint(normal_env):
+    routes = get_submission_routes()
+
+    assert routes.endpoint("02fda3137e912f948c337263d790698a.pdf") == "/test/endpoint"
+    assert routes.default_endpoint == "/test/endpoint"
+
+
+def test_submission_routes_keep_the_factiva_endpoint(normal_env):
+    assert get_submission_routes().endpoint("02fda3137e912f948c337263d790698a.factiva") == "/test/factiva/endpoint"
+
+
+def test_submission_routes_are_read_from_submission_routes(normal_env, monkeypatch):
+    monkeypatch.setenv('SUBMISSION_ROUTES', '{"lexisnexis": "/test/lexisnexis/endpoint", "factiva": "/test/factiva/v2"}')
+    routes = get_submission_routes()
+
+    assert routes.endpoint("02fda3137e912f948c337263d790698a.lexisnexis") == "/test/lexisnexis/endpoint"
+    assert routes.endpoint("02fda3137e912f948c337263d790698a.factiva") == "/test/factiva/v2"
+    assert routes.endpoint("02fda3137e912f948c337263d790698a.pdf") == "/test/endpoint"
+
+
+def test_submission_routes_must_be_a_json_object(normal_env, monkeypatch):
+    monkeypatch.setenv('SUBMISSION_ROUTES', '["/test/lexisnexis/endpoint"]')
+
+    with pytest.raises(Exception):
+        get_submission_routes()
+
+
+def test_post_retrieved_object_sends_routed_doc_to_its_endpoint(normal_env, monkeypatch):
+    monkeypatch.setenv('SUBMISSION_ROUTES', '{"lexisnexis": "/test/lexisnexis/endpoint"}')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        try_post_mocker.return_value = True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+        success, msg = workers.post_retrieved_object_and_metadata("02fda3137e912f948c337263d790698a.lexisnexis",
+                                                                  b"this is a test", "this is a test")
+
+        assert success is True
+        assert try_post_mocker.call_args.kwargs['endpoint'] == "/test/lexisnexis/endpoint"
@@ -0,0 +1,166 @@
+import json
+import mock
+import os
+import time
+import botocore
+import pytest
+
+from dart_lambdas.common.metrics import NULL_METRICS
+from dart_lambdas.ladleSink.ladle_sink import lambda_handler
+from dart_lambdas.ladleSink.pairing import pair_record, MetadataNotUploadedError
+from .test_ladle_sink import s3_object_created_event, s3_objects_created_event
+
+RAW_KEY = "02fda3137e912f948c337263d790698a.pdf.raw"
+METADATA_KEY = "02fda3137e912f948c337263d790698a.meta"
+
+
+def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+    post_files['file'][1].read()
+    return True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+
+def create_buckets(s3_resource):
+    s3_resource.create_bucket(Bucket=os.environ.get('S3_BUCKET_IN'))
+    s3_resource.create_bucket(Bucket=os.environ.get('S3_BUCKET_PROCESSED'))
+
+
+# S3 keeps upload times to the second, so make sure the next upload is in a later second than the last one
+def wait_for_next_second():
+    time.sleep(1 - time.time() % 1 + 0.05)
+
+
+def test_lone_raw_document_is_left_for_retry_without_waiting(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    create_buckets(s3_resource)
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key=RAW_KEY, Body=b'raw document')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        started = time.monotonic()
+        # Raising is what gets an asynchronous invocation retried
+        with pytest.raises(MetadataNotUploadedError) as error:
+            lambda_handler(s3_object_created_event(S3_BUCKET_IN, RAW_KEY), None)
+
+        assert time.monotonic() - started < 5
+        assert f"Unable to retrieve {METADATA_KEY} from {S3_BUCKET_IN}" in str(error.value)
+        assert not try_post_mocker.called
+
+    s3_client.head_object(Bucket=S3_BUCKET_IN, Key=RAW_KEY)
+
+
+def test_metadata_event_processes_the_raw_document_waiting_for_it(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    monkeypatch.setenv('PAIRING_WINDOW_SECONDS', "0")
+    create_buckets(s3_resource)
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        try_post_mocker.side_effect = mock_try_post
+
+        # The raw document arrives first and is left for retry...
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key=RAW_KEY, Body=b'raw document')
+        with pytest.raises(MetadataNotUploadedError):
+            lambda_handler(s3_object_created_event(S3_BUCKET_IN, RAW_KEY), None)
+
+        # ...until its metadata's event picks it up
+        wait_for_next_second()
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key=METADATA_KEY, Body=b'{ "title": "test" }')
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, METADATA_KEY), None)
+
+        assert result['statusCode'] == 200
+        assert json.loads(result['body']).startswith(f'Successfully pulled {RAW_KEY} from {S3_BUCKET_IN}')
+        assert try_post_mocker.call_count == 1
+
+        # The raw document's retry then finds nothing left to do
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, RAW_KEY), None)
+
+        assert result['statusCode'] == 200
+        assert try_post_mocker.call_count == 1
+
+    s3_client.head_object(Bucket=S3_BUCKET_PROCESSED, Key="02fda3137e912f948c337263d790698a.pdf")
+    s3_client.head_object(Bucket=S3_BUCKET_PROCESSED, Key=METADATA_KEY)
+    with pytest.raises(botocore.exceptions.ClientError):
+        s3_client.head_object(Bucket=S3_BUCKET_IN, Key=RAW_KEY)
+
+
+def test_raw_document_whose_metadata_lands_just_after_its_event_is_processed_on_retry(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    create_buckets(s3_resource)
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        try_post_mocker.side_effect = mock_try_post
+
+        # The raw document's event runs before its metadata lands, within the default pairing window...
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key=RAW_KEY, Body=b'raw document')
+        with pytest.raises(MetadataNotUploadedError):
+            lambda_handler(s3_object_created_event(S3_BUCKET_IN, RAW_KEY), None)
+
+        # ...so the metadata's event leaves the document to its own event...
+        s3_client.put_object(Bucket=S3_BUCKET_IN, Key=METADATA_KEY, Body=b'{ "title": "test" }')
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, METADATA_KEY), None)
+
+        assert json.loads(result['body']) == f"metadata file ({METADATA_KEY}): {RAW_KEY} is processed by its own event"
+        assert not try_post_mocker.called
+
+        # ...which Lambda retries, since it raised
+        result = lambda_handler(s3_object_created_event(S3_BUCKET_IN, RAW_KEY), None)
+
+        assert result['statusCode'] == 200
+        assert try_post_mocker.call_count == 1
+
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 0
+    s3_client.head_object(Bucket=S3_BUCKET_PROCESSED, Key="02fda3137e912f948c337263d790698a.pdf")
+
+
+def test_only_one_event_processes_a_document_whatever_order_they_arrive_in(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    create_buckets(s3_resource)
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key=RAW_KEY, Body=b'raw document')
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key=METADATA_KEY, Body=b'{ "title": "test" }')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+        try_post_mocker.side_effect = mock_try_post
+
+        result = lambda_handler(s3_objects_created_event(S3_BUCKET_IN, [METADATA_KEY, RAW_KEY]), None)
+
+        assert result['statusCode'] == 200
+        messages = json.loads(result['body'])
+        assert messages[0] == f"metadata file ({METADATA_KEY}): {RAW_KEY} is processed by its own event"
+        assert messages[1].startswith(f'Successfully pulled {RAW_KEY}')
+        assert try_post_mocker.call_count == 1
+
+
+def test_raw_document_defers_to_metadata_uploaded_well_after_it(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    monkeypatch.setenv('PAIRING_WINDOW_SECONDS', "0")
+    create_buckets(s3_resource)
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key=RAW_KEY, Body=b'raw document')
+    wait_for_next_second()
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key=METADATA_KEY, Body=b'{ "title": "test" }')
+
+    raw_record, raw_object_key, (success, message) = pair_record(s3_object_created_event(S3_BUCKET_IN, RAW_KEY)['Records'][0], NULL_METRICS)
+
+    assert raw_record is None
+    assert raw_object_key is None
+    assert success is True
+    assert message == f"{RAW_KEY} is processed by the event for its metadata ({METADATA_KEY})"
+
+
+def test_metadata_event_hands_over_an_encoded_raw_record(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    monkeypatch.setenv('PAIRING_WINDOW_SECONDS', "0")
+    create_buckets(s3_resource)
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key="Test Sübmission.pdf.raw", Body=b'raw document')
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key="Test Sübmission.other.meta", Body=b'{}')
+    wait_for_next_second()
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key="Test Sübmission.meta", Body=b'{}')
+
+    record = s3_object_created_event(S3_BUCKET_IN, "Test+S%C3%BCbmission.meta")['Records'][0]
+    raw_record, raw_object_key, result = pair_record(record, NULL_METRICS)
+
+    assert result is None
+    assert raw_object_key.key == "Test Sübmission.pdf.raw"
+    assert raw_record['s3']['object']['key'] == "Test+S%C3%BCbmission.pdf.raw"
+    assert raw_record['s3']['object']['size'] == len(b'raw document')
+    assert not raw_record['s3']['object']['eTag'].startswith('"')
+    assert record['s3']['object']['key'] == "Test+S%C3%BCbmission.meta"
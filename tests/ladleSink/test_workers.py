@@ -1,9 +1,16 @@
 import mock
 import botocore
 import pytest
+import hashlib
+import io
+import json
 import os
 
+from dart_lambdas.common import s3_utils
+from dart_lambdas.common.multipart import SizedStream
+from dart_lambdas.common.s3_utils import get_s3_client
 from dart_lambdas.ladleSink import workers
+from dart_lambdas.ladleSink.config import reset_config
 from .test_ladle_sink import s3_object_created_event
 
 
@@ -25,7 +32,7 @@ def test_get_created_object_returns_an_object_when_it_exists(normal_env, s3_reso
 
     assert success is True
     assert key == "02fda3137e912f948c337263d790698a.pdf.raw"
-    assert raw_doc == test_file
+    assert raw_doc.view() == test_file
     assert msg is None
 
 
@@ -47,7 +54,7 @@ def test_get_created_object_decodes_url_encoded_key_properly(normal_env, s3_reso
 
     assert success is True
     assert key == "Test Sübmission.pdf.raw"
-    assert raw_doc == test_file
+    assert raw_doc.view() == test_file
     assert msg is None
 
 
@@ -69,6 +76,55 @@ def test_get_created_object_returns_appropriate_error_message_when_object_doesnt
     assert msg[0:11] == f'Exception: '
 
 
+def test_open_created_object_fetches_large_objects_in_ranges_retrying_each_on_its_own(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    monkeypatch.setenv('RANGED_GET_THRESHOLD_BYTES', '1000')
+    monkeypatch.setenv('RANGED_GET_PART_SIZE_BYTES', '1000')
+    test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    etag = s3_client.put_object(Bucket=S3_BUCKET_IN, Key="02fda3137e912f948c337263d790698a.pdf.raw", Body=test_file)['ETag']
+
+    test_record = s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw")['Records'][0]
+    test_record['s3']['object']['size'] = len(test_file)
+    test_record['s3']['object']['eTag'] = etag.strip('"')
+
+    s3 = get_s3_client()
+    get_object = s3.get_object
+    ranges = []
+
+    # The second range fails once
+    def flaky_get_object(**kwargs):
+        ranges.append(kwargs['Range'])
+        assert kwargs['IfMatch'] == etag.strip('"')
+        if kwargs['Range'] == 'bytes=1000-1999' and ranges.count('bytes=1000-1999') == 1:
+            raise botocore.exceptions.ClientError({'Error': {'Code': 'SlowDown'}, 'ResponseMetadata': {'HTTPStatusCode': 503}}, 'GetObject')
+        return get_object(**kwargs)
+
+    with mock.patch.object(s3, 'get_object', side_effect=flaky_get_object):
+        success, key, raw_doc, msg = workers.get_created_object(test_record, S3_BUCKET_IN)
+
+    assert success is True
+    assert raw_doc.view() == test_file
+    assert sorted(set(ranges)) == sorted(f'bytes={start}-{min(start + 1000, len(test_file)) - 1}' for start in range(0, len(test_file), 1000))
+    assert len(ranges) == len(set(ranges)) + 1
+
+
+def test_open_created_object_fails_when_a_large_object_can_not_be_fetched(normal_env, s3_resource, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    monkeypatch.setenv('RANGED_GET_THRESHOLD_BYTES', '1000')
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+
+    test_record = s3_object_created_event(S3_BUCKET_IN, "02fda3137e912f948c337263d790698a.pdf.raw")['Records'][0]
+    test_record['s3']['object']['size'] = 5000
+
+    success, key, raw_doc, msg = workers.open_created_object(test_record, S3_BUCKET_IN)
+
+    assert success is False
+    assert raw_doc is None
+    assert msg[0:11] == f'Exception: '
+
+
 def test_post_retrieved_object_sends_non_factiva_doc_to_regular_submission_endpoint(normal_env):
     DART_URL = os.environ.get('DART_URL')
     SUBMISSION_PORT = os.environ.get('SUBMISSION_PORT')
@@ -78,7 +134,7 @@ def test_post_retrieved_object_sends_non_factiva_doc_to_regular_submission_endpo
 
     with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
 
-        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes):
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
             assert post_files['file'][0] == "02fda3137e912f948c337263d790698a.pdf"
             assert post_files['file'][1] == b"this is a test"
             assert post_files['metadata'][0] is None
@@ -101,6 +157,54 @@ def test_post_retrieved_object_sends_non_factiva_doc_to_regular_submission_endpo
         assert success is True
         assert msg == '{ "document_id": "02fda3137e912f948c337263d790698a" }'
 
+def test_post_retrieved_object_keeps_streams_so_the_post_can_be_retried(normal_env, monkeypatch):
+    monkeypatch.setenv('LADLE_POST_ATTEMPTS', '2')
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            document = post_files['file'][1]
+            assert numtimes == 2
+            # Read as if sent twice
+            assert document.read() == b"this is a test"
+            document.seek(0)
+            assert document.read() == b"this is a test"
+            return True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+        try_post_mocker.side_effect = mock_try_post
+
+        stream = SizedStream(io.BytesIO(b"this is a test"), len(b"this is a test"))
+        success, msg = workers.post_retrieved_object_and_metadata("02fda3137e912f948c337263d790698a.pdf", stream, "{}")
+
+        assert success is True
+        try_post_mocker.assert_called_once()
+
+
+def test_post_retrieved_object_streams_documents_once_when_they_are_not_retried_or_there_is_no_room(normal_env, monkeypatch):
+    stream = SizedStream(io.BytesIO(b"this is a test"), len(b"this is a test"))
+
+    with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
+
+        def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time, numtimes, deadline):
+            assert post_files['file'][1] is stream
+            assert numtimes == 1
+            return True, '{ "document_id": "02fda3137e912f948c337263d790698a" }'
+
+        try_post_mocker.side_effect = mock_try_post
+
+        monkeypatch.setenv('LADLE_POST_ATTEMPTS', '1')
+        reset_config()
+        assert workers.post_retrieved_object_and_metadata("02fda3137e912f948c337263d790698a.pdf", stream, "{}")[0] is True
+
+        monkeypatch.setenv('LADLE_POST_ATTEMPTS', '3')
+        monkeypatch.setenv('DOCUMENT_BUFFER_MEMORY_BYTES', '4')
+        reset_config()
+        with mock.patch('dart_lambdas.common.document_buffer.shutil.disk_usage', return_value=mock.Mock(free=10)):
+            assert workers.post_retrieved_object_and_metadata("02fda3137e912f948c337263d790698a.pdf", stream, "{}")[0] is True
+
+        assert try_post_mocker.call_count == 2
+
+
 def test_post_retrieved_object_sends_factiva_doc_to_factiva_submission_endpoint(normal_env):
     DART_URL = os.environ.get('DART_URL')
     SUBMISSION_PORT = os.environ.get('SUBMISSION_PORT')
@@ -110,7 +214,7 @@ def test_post_retrieved_object_sends_factiva_doc_to_factiva_submission_endpoint(
 
     with mock.patch('dart_lambdas.ladleSink.workers.try_post') as try_post_mocker:
         def mock_try_post(url, port, endpoint, post_files, post_data, basic_auth, sleep_time,
-                          numtimes):
+                          numtimes, deadline):
             assert post_files['file'][0] == "02fda3137e912f948c337263d790698a.factiva"
             assert post_files['file'][1] == b"this is a test"
             assert post_files['metadata'][0] is None
@@ -134,6 +238,24 @@ def test_post_retrieved_object_sends_factiva_doc_to_factiva_submission_endpoint(
         assert msg == '{ "document_id": "02fda3137e912f948c337263d790698a" }'
 
 
+def test_hashing_stream_hashes_everything_read_through_it():
+    stream = workers.HashingStream(SizedStream(io.BytesIO(b'some document'), 13))
+
+    assert stream.read(4) == b'some'
+    assert not stream.complete
+    assert stream.read() == b' document'
+    assert stream.complete
+    assert stream.md5() == hashlib.md5(b'some document').hexdigest()
+
+
+def test_add_content_hash_to_metadata_adds_field_to_json_objects_only():
+    metadata = workers.add_content_hash_to_metadata('{"team": "Two Six Labs"}', 'content_md5', 'abc')
+    assert json.loads(metadata) == {'team': 'Two Six Labs', 'content_md5': 'abc'}
+
+    assert workers.add_content_hash_to_metadata('this is a test', 'content_md5', 'abc') == 'this is a test'
+    assert workers.add_content_hash_to_metadata('[]', 'content_md5', 'abc') == '[]'
+
+
 def test_move_processed_object_deletes_object_in_input_bucket_and_puts_it_in_output_bucket(normal_env, s3_resource, s3_client):
     S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
     S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
@@ -162,3 +284,167 @@ def test_move_processed_object_deletes_object_in_input_bucket_and_puts_it_in_out
         s3_client.get_object(Key="output.pdf", Bucket=S3_BUCKET_PROCESSED)
     except botocore.exceptions.ClientError as e:
         pytest.fail(f"Did not put file in {S3_BUCKET_PROCESSED}")
+
+
+def test_move_processed_objects_copies_all_then_removes_sources_with_one_delete(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    test_file = open('tests/ladleSink/resources/test-file.pdf', 'rb').read()
+
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key="input.meta", Body=b"{}")
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key="input.pdf.raw", Body=test_file)
+
+    shared_client = get_s3_client()
+    with mock.patch.object(shared_client, 'delete_objects', wraps=shared_client.delete_objects) as delete_objects_spy, \
+            mock.patch.object(shared_client, 'delete_object', wraps=shared_client.delete_object) as delete_object_spy:
+        success, msg = workers.move_processed_objects(
+            [("input.meta", "output.meta"), ("input.pdf.raw", "output.pdf", len(test_file))],
+            S3_BUCKET_IN,
+            S3_BUCKET_PROCESSED,
+        )
+
+        assert delete_objects_spy.call_count == 1
+        assert not delete_object_spy.called
+
+    assert success is True
+    assert msg == f"Successfully moved input.meta, input.pdf.raw from {S3_BUCKET_IN} to output.meta, output.pdf in {S3_BUCKET_PROCESSED}"
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 0
+    assert s3_client.get_object(Key="output.pdf", Bucket=S3_BUCKET_PROCESSED)['Body'].read() == test_file
+    assert s3_client.get_object(Key="output.meta", Bucket=S3_BUCKET_PROCESSED)['Body'].read() == b"{}"
+
+
+def test_move_processed_objects_undoes_copies_when_any_copy_fails(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key="input.meta", Body=b"{}")
+
+    # input.pdf.raw doesn't exist, so its copy fails
+    success, msg = workers.move_processed_objects(
+        [("input.meta", "output.meta"), ("input.pdf.raw", "output.pdf")],
+        S3_BUCKET_IN,
+        S3_BUCKET_PROCESSED,
+    )
+
+    assert success is False
+    assert msg.startswith(f"Unable to copy input.pdf.raw from {S3_BUCKET_IN} to output.pdf in {S3_BUCKET_PROCESSED}")
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_PROCESSED)['KeyCount'] == 0
+    s3_client.get_object(Key="input.meta", Bucket=S3_BUCKET_IN)
+
+
+def test_move_processed_objects_undoes_copies_when_a_copy_cannot_reach_s3(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key="input.meta", Body=b"{}")
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key="input.pdf.raw", Body=b"raw")
+
+    real_copy_s3_object = workers.copy_s3_object
+
+    def copy_s3_object_losing_connection(s3_client, input_key, *args, **kwargs):
+        if input_key == "input.pdf.raw":
+            raise botocore.exceptions.EndpointConnectionError(endpoint_url='https://s3.amazonaws.com')
+        return real_copy_s3_object(s3_client, input_key, *args, **kwargs)
+
+    with mock.patch('dart_lambdas.ladleSink.workers.copy_s3_object', side_effect=copy_s3_object_losing_connection):
+        success, msg = workers.move_processed_objects(
+            [("input.meta", "output.meta"), ("input.pdf.raw", "output.pdf")],
+            S3_BUCKET_IN,
+            S3_BUCKET_PROCESSED,
+        )
+
+    assert success is False
+    assert msg.startswith(f"Unable to copy input.pdf.raw from {S3_BUCKET_IN} to output.pdf in {S3_BUCKET_PROCESSED}")
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_PROCESSED)['KeyCount'] == 0
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 2
+
+
+def test_move_processed_objects_restores_sources_when_delete_partially_fails(normal_env, s3_resource, s3_client):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key="input.meta", Body=b"{}")
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key="input.pdf.raw", Body=b"raw")
+
+    shared_client = get_s3_client()
+    real_delete_objects = shared_client.delete_objects
+
+    # Only the metadata is actually removed; the raw document fails
+    def partially_failing_delete_objects(Bucket, Delete):
+        if Bucket == S3_BUCKET_IN:
+            shared_client.delete_object(Bucket=Bucket, Key="input.meta")
+            return {'Errors': [{'Key': 'input.pdf.raw', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]}
+        return real_delete_objects(Bucket=Bucket, Delete=Delete)
+
+    with mock.patch.object(shared_client, 'delete_objects', side_effect=partially_failing_delete_objects):
+        success, msg = workers.move_processed_objects(
+            [("input.meta", "output.meta"), ("input.pdf.raw", "output.pdf")],
+            S3_BUCKET_IN,
+            S3_BUCKET_PROCESSED,
+        )
+
+    assert success is False
+    assert msg.startswith(f"Unable to remove input.meta, input.pdf.raw from {S3_BUCKET_IN}. Undid copy to {S3_BUCKET_PROCESSED}.")
+    assert "input.pdf.raw: AccessDenied Access Denied" in msg
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_PROCESSED)['KeyCount'] == 0
+    assert s3_client.get_object(Key="input.meta", Bucket=S3_BUCKET_IN)['Body'].read() == b"{}"
+    assert s3_client.get_object(Key="input.pdf.raw", Bucket=S3_BUCKET_IN)['Body'].read() == b"raw"
+
+
+def test_move_processed_objects_uses_multipart_copy_for_objects_too_large_for_copy_object(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+
+    # Scale the limits down so that a small object takes the multipart path (S3's minimum part size is 5 MB)
+    monkeypatch.setattr(s3_utils, 'MAX_COPY_OBJECT_SIZE', 1024 ** 2)
+    monkeypatch.setattr(s3_utils, 'MULTIPART_COPY_PART_SIZE', 5 * 1024 ** 2)
+    test_file = os.urandom(11 * 1024 ** 2)
+
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key="input.pdf.raw", Body=test_file, ContentType="application/pdf", Tagging='source=upload')
+
+    shared_client = get_s3_client()
+    with mock.patch.object(shared_client, 'copy_object', wraps=shared_client.copy_object) as copy_object_spy, \
+            mock.patch.object(shared_client, 'upload_part_copy', wraps=shared_client.upload_part_copy) as upload_part_copy_spy:
+        success, msg = workers.move_processed_objects([("input.pdf.raw", "output.pdf", len(test_file))], S3_BUCKET_IN, S3_BUCKET_PROCESSED)
+
+        assert not copy_object_spy.called
+        assert upload_part_copy_spy.call_count == 3
+
+    assert success is True
+    output = s3_client.get_object(Key="output.pdf", Bucket=S3_BUCKET_PROCESSED)
+    assert output['Body'].read() == test_file
+    assert output['ContentType'] == "application/pdf"
+    assert s3_client.get_object_tagging(Key="output.pdf", Bucket=S3_BUCKET_PROCESSED)['TagSet'] == [{'Key': 'source', 'Value': 'upload'}]
+    assert s3_client.list_objects_v2(Bucket=S3_BUCKET_IN)['KeyCount'] == 0
+
+
+def test_move_processed_objects_falls_back_to_multipart_copy_when_s3_rejects_copy_object(normal_env, s3_resource, s3_client, monkeypatch):
+    S3_BUCKET_IN = os.environ.get('S3_BUCKET_IN')
+    S3_BUCKET_PROCESSED = os.environ.get('S3_BUCKET_PROCESSED')
+    monkeypatch.setattr(s3_utils, 'MULTIPART_COPY_PART_SIZE', 5 * 1024 ** 2)
+
+    s3_resource.create_bucket(Bucket=S3_BUCKET_IN)
+    s3_resource.create_bucket(Bucket=S3_BUCKET_PROCESSED)
+    s3_client.put_object(Bucket=S3_BUCKET_IN, Key="input.pdf.raw", Body=b"raw")
+
+    too_large = botocore.exceptions.ClientError(
+        {'Error': {'Code': 'InvalidRequest', 'Message': 'The specified copy source is larger than the maximum allowable size for a copy source: 5368709120'}},
+        'CopyObject',
+    )
+
+    shared_client = get_s3_client()
+    with mock.patch.object(shared_client, 'copy_object', side_effect=too_large):
+        success, msg = workers.move_processed_object("input.pdf.raw", S3_BUCKET_IN, "output.pdf", S3_BUCKET_PROCESSED)
+
+    assert success is True
+    assert s3_client.get_object(Key="output.pdf", Bucket=S3_BUCKET_PROCESSED)['Body'].read() == b"raw"